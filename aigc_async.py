@@ -0,0 +1,251 @@
+"""
+AIGC 图片元数据异步扫描 (远程 / 慢速存储)
+HTTP(S) 图片用 Range 请求只读取元数据所在的前缀, 本地 (NFS 等) 文件在线程池里读取,
+多个文件的 I/O 在 asyncio 中重叠进行; 解析交给进程池, 不阻塞事件循环。
+
+用法:
+  python aigc_async.py https://example.com/a.png https://example.com/b.jpg
+  python aigc_async.py /mnt/nfs/photos --concurrency 128 --workers 8 > results.jsonl
+  cat urls.txt | python aigc_async.py -
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import aiohttp
+
+import aigc_metadata as am
+
+RANGE_SIZE = 16 * 1024  # 第一次 Range 请求的字节数 (多数 A1111 / EXIF 元数据在 16 KB 以内), 之后按已读量翻倍
+MAX_FETCH_BYTES = 256 * 1024 * 1024  # 单个文件最多下载这么多字节
+
+
+def is_url(item):
+    return item.startswith(("http://", "https://"))
+
+
+def iter_inputs(sources):
+    """URL 原样产出, 其余交给 iter_image_paths 展开 (目录 / glob / '-'); stdin 里也可以是 URL"""
+    for source in sources:
+        if is_url(source):
+            yield source
+        elif source == "-":
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
+                    yield line
+        else:
+            yield from am.iter_image_paths([source])
+
+
+# ========== 读取 ==========
+class FetchStats:
+    """累计的请求次数 / 下载字节数, 用于核对 Range 读取确实只读了前缀"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.full_reads = 0
+
+
+async def fetch_url(session, url, stats, range_size=RANGE_SIZE, max_bytes=MAX_FETCH_BYTES, full=False):
+    """用 HTTP Range 请求按需读取图片, 读到元数据区结束 (am.metadata_read_target) 为止
+
+    服务器不支持 Range (返回 200) 时从头读响应流, 读够后直接断开连接, 不下载剩余部分。
+    """
+    buf = bytearray()
+    target = -1 if full else None
+    eof = False
+    while not eof:
+        if target is not None and target >= 0:
+            return bytes(buf[:target])
+        if len(buf) >= max_bytes:
+            raise am.ResourceLimitError(f"超过下载上限 {max_bytes} 字节")
+        # 需要完整文件时一次读到结尾; 否则前缀按倍数增长, 绝大多数图片一次请求就够
+        want = max(range_size, len(buf))
+        stop = "" if target == -1 else str(len(buf) + want - 1)
+        async with session.get(url, headers={"Range": f"bytes={len(buf)}-{stop}"}) as resp:
+            stats.requests += 1
+            if resp.status == 416:  # 起点已经超过文件末尾
+                break
+            resp.raise_for_status()
+            if resp.status == 200:
+                buf = bytearray()
+            received = 0
+            async for chunk in resp.content.iter_chunked(range_size):
+                buf += chunk
+                received += len(chunk)
+                stats.bytes += len(chunk)
+                if len(buf) > max_bytes:
+                    raise am.ResourceLimitError(f"超过下载上限 {max_bytes} 字节")
+                if resp.status == 200 and target != -1:
+                    target = am.metadata_read_target(buf)
+                    if target is not None and target >= 0:
+                        return bytes(buf[:target])
+            # 200 读到了结尾; 206 返回的字节数少于请求的, 说明也到了文件末尾
+            eof = resp.status == 200 or not stop or received < want
+        if target != -1:
+            target = am.metadata_read_target(buf)
+    stats.full_reads += 1
+    return bytes(buf)
+
+
+def read_local(path, full=False, max_bytes=None):
+    """在线程池里读取本地文件的元数据前缀 (NFS 上的 open / read 不会阻塞事件循环)
+
+    max_bytes 与 URL 的下载上限相同, 前缀超过时抛出 ResourceLimitError。
+    """
+    with open(path, "rb") as f:
+        return am.ImageSource.from_stream(f, full=full, max_bytes=max_bytes).data
+
+
+def detect_prefix(data, detect_options, timeout=None):
+    """进程池任务: 把读到的前缀包装成文件对象交给检测, ImageSource.from_stream 会按同样规则识别出前缀"""
+    return am._detect_worker(io.BytesIO(data), detect_options, timeout=timeout)
+
+
+# ========== 扫描 ==========
+async def scan_async(items, concurrency=64, workers=None, detect_options=None, range_size=RANGE_SIZE,
+                     max_bytes=MAX_FETCH_BYTES, timeout=30.0, stats=None):
+    """异步扫描一批 URL / 本地路径, 按完成顺序产出结果
+
+    concurrency 限制同时进行的 I/O 数 (也是每个主机的连接上限), workers 为解析用的进程数;
+    timeout 同时是单个 URL 的下载超时和单个文件的解析时间上限, 解析超过 timeout + POOL_DEADLINE_GRACE 秒
+    (卡在原生代码里) 时结束整个进程池换新的;
+    max_bytes 是单个文件的字节预算, URL 下载和本地读取同样受限, 并作为 max_file_bytes 传给检测
+    (detect_options 里已有更小的 max_file_bytes 时以它为准);
+    输入迭代器通过有界队列消费, 百万级列表也不会一次性展开。
+    """
+    detect_options = detect_options or {}
+    max_bytes = min(max_bytes, detect_options.get("max_file_bytes") or max_bytes)
+    detect_options = {**detect_options, "max_file_bytes": max_bytes}
+    stats = stats or FetchStats()
+    full = detect_options.get("scan_after_idat", False)
+    loop = asyncio.get_running_loop()
+    inputs = asyncio.Queue(maxsize=concurrency * 2)
+    outputs = asyncio.Queue()
+    done = object()
+
+    workers = workers or os.cpu_count() or 1
+    pools = [ProcessPoolExecutor(max_workers=workers)]
+    # 同时交给进程池的文件不超过进程数, 等待时间不算进解析期限 (见下面的 wait_for)
+    parse_slots = asyncio.Semaphore(workers)
+    threads = ThreadPoolExecutor(max_workers=concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def detect_one(session, item):
+        try:
+            if is_url(item):
+                data = await fetch_url(session, item, stats, range_size, max_bytes, full)
+            else:
+                data = await loop.run_in_executor(threads, read_local, item, full, max_bytes)
+                stats.bytes += len(data)
+            async with parse_slots:
+                pool = pools[-1]
+                try:
+                    result = await asyncio.wait_for(
+                        loop.run_in_executor(pool, detect_prefix, data, detect_options, timeout),
+                        timeout + am.POOL_DEADLINE_GRACE if timeout else None)
+                except asyncio.TimeoutError:
+                    # 子进程卡在原生代码里, time_limit 打断不了: 结束整个进程池换新的
+                    if pools[-1] is pool:
+                        am.kill_pool(pool)
+                        pools.append(ProcessPoolExecutor(max_workers=workers))
+                    raise am.DetectTimeout(f"检测超过 {timeout} 秒 (卡在原生代码中, 已结束检测进程)")
+                except BrokenProcessPool:
+                    # 解析进程崩溃 (恶意文件触发段错误 / OOM) 后整个进程池不可用, 换一个新的继续扫描;
+                    # 同时在途的其他文件也会收到这个错误, 只有第一个发现的协程负责重建
+                    if pools[-1] is pool:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pools.append(ProcessPoolExecutor(max_workers=workers))
+                    raise
+        except Exception as e:
+            # 任何异常都只记为这一项的错误结果, 不能让 worker 协程退出 (否则消费端永远等不到 done)
+            result = {"source": "未知", "error": str(e) or type(e).__name__}
+        result.pop("path", None)
+        return {"path": item, **result}
+
+    async def worker(session):
+        try:
+            while True:
+                item = await inputs.get()
+                if item is done:
+                    return
+                await outputs.put(await detect_one(session, item))
+        finally:
+            await outputs.put(done)
+
+    async def feed():
+        for item in items:
+            await inputs.put(item)
+        for _ in range(concurrency):
+            await inputs.put(done)
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+            tasks = [asyncio.create_task(feed())]
+            tasks += [asyncio.create_task(worker(session)) for _ in range(concurrency)]
+            finished = 0
+            try:
+                while finished < concurrency:
+                    result = await outputs.get()
+                    if result is done:
+                        finished += 1
+                    else:
+                        yield result
+            finally:
+                for task in tasks:
+                    task.cancel()
+    finally:
+        threads.shutdown(wait=False, cancel_futures=True)
+        pools[-1].shutdown(cancel_futures=True)
+
+
+async def run_async(sources, out=None, **options):
+    """命令行入口: 结果按 JSON Lines 写到 stdout, 统计写到 stderr"""
+    out = out or sys.stdout
+    stats = FetchStats()
+    count = errors = 0
+    start = time.perf_counter()
+    async for result in scan_async(iter_inputs(sources), stats=stats, **options):
+        am.write_json_line(result, out)
+        out.flush()
+        count += 1
+        if result.get("error"):
+            errors += 1
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"✅ 扫描完成: {count} 个文件 ({errors} 个出错), 耗时 {elapsed:.2f}s, {rate:.1f} 文件/秒", file=sys.stderr)
+    print(f"🌐 HTTP 请求 {stats.requests} 次, 共读取 {stats.bytes / 1024 / 1024:.2f} MB, "
+          f"{stats.full_reads} 个 URL 需要完整下载", file=sys.stderr)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AIGC 图片元数据异步扫描 (HTTP Range / NFS)")
+    parser.add_argument("sources", nargs="+", help="URL、本地路径、目录、通配符, 或 '-' 从 stdin 读取")
+    parser.add_argument("--concurrency", type=int, default=64, help="同时进行的 I/O 数")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数 (默认 CPU 核数)")
+    parser.add_argument("--range-kb", type=int, default=RANGE_SIZE // 1024, help="第一次 Range 请求的大小 (KB)")
+    parser.add_argument("--max-mb", type=int, default=MAX_FETCH_BYTES // 1024 // 1024, help="单个文件的字节上限 (MB), URL 与本地文件相同")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单个 URL 的超时 (秒)")
+    parser.add_argument("--mode", choices=am.DETECT_MODES, default="fast",
+                        help="默认 fast: 远程扫描以吞吐为主, 只解析容器头")
+    args = parser.parse_args(argv)
+
+    asyncio.run(run_async(
+        args.sources, concurrency=args.concurrency, workers=args.workers, detect_options={"mode": args.mode},
+        range_size=args.range_kb * 1024, max_bytes=args.max_mb * 1024 * 1024, timeout=args.timeout,
+    ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
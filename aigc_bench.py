@@ -0,0 +1,672 @@
+"""
+aigc_metadata.py 性能基准
+用法:
+  python aigc_bench.py single-pass <图片|目录|通配符> ... [--repeat N]
+  python aigc_bench.py fast-vs-full <图片|目录|通配符> ... [--repeat N]
+  python aigc_bench.py xmp-regex [--repeat N]
+  python aigc_bench.py import-time [--runs N] [--budget-ms MS]
+  python aigc_bench.py make-corpus <目录> [--count N] [--seed S]
+  python aigc_bench.py corpus <目录> [--repeat N] [--save report.json] [--baseline report.json]
+  python aigc_bench.py remote <图片|目录|通配符> ... [--concurrency N]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import resource
+import struct
+import subprocess
+import sys
+import time
+
+from PIL import Image, PngImagePlugin
+
+import aigc_metadata as am
+
+
+# ========== 计数工具 ==========
+class IOCounter:
+    """统计 open 次数 (audit hook) 与 read 系统调用 / 读取字节数 (/proc/self/io, 仅 Linux)"""
+
+    opens = 0
+    _hooked = False
+
+    @classmethod
+    def install(cls):
+        if cls._hooked:
+            return
+
+        def hook(event, args):
+            if event == "open":
+                cls.opens += 1
+
+        sys.addaudithook(hook)
+        cls._hooked = True
+
+    @staticmethod
+    def proc_io():
+        try:
+            with open("/proc/self/io") as f:
+                fields = dict(line.split(": ") for line in f.read().splitlines())
+            return int(fields["syscr"]), int(fields["rchar"])
+        except (OSError, KeyError, ValueError):
+            return 0, 0
+
+    def __enter__(self):
+        IOCounter.install()
+        self.start_opens = IOCounter.opens
+        self.start_syscr, self.start_rchar = self.proc_io()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start_time
+        # 读取 /proc/self/io 本身也会产生 1 次 open 和若干次 read, 在此扣除
+        syscr, rchar = self.proc_io()
+        self.opens = IOCounter.opens - self.start_opens - 1
+        self.syscr = syscr - self.start_syscr
+        self.rchar = rchar - self.start_rchar
+        return False
+
+
+def print_row(name, counter, n):
+    print(f"   {name:<14} {counter.elapsed / n * 1000:>9.3f} ms {counter.opens / n:>8.2f} "
+          f"{counter.syscr / n:>10.2f} {counter.rchar / n / 1024:>11.1f} KB")
+
+
+def print_header():
+    print(f"   {'模式':<12} {'耗时/张':>12} {'open/张':>8} {'read调用/张':>8} {'读取量/张':>10}")
+
+
+# ========== single-pass: 共享文件上下文 vs 各检测器各自打开文件 ==========
+def multi_open_detect(filepath):
+    """旧流程: PIL / C2PA / XMP / PNG chunk 各自按路径打开文件"""
+    img = Image.open(filepath)
+    dict(img.info)
+    am.read_c2pa_metadata(filepath)
+    am.extract_xmp(filepath)
+    if img.format == "PNG":
+        am.read_png_chunks(filepath)
+    if hasattr(img, "_getexif"):
+        img._getexif()
+    img.close()
+
+
+def bench_single_pass(paths, repeat):
+    n = len(paths) * repeat
+    print(f"\n📊 single-pass 基准: {len(paths)} 个文件 x {repeat} 轮")
+    print_header()
+    for name, func in [("多次打开", multi_open_detect), ("共享上下文", am.detect_aigc_source)]:
+        for path in paths:  # 预热 page cache, 避免第一个模式吃亏
+            func(path)
+        with IOCounter() as counter:
+            for _ in range(repeat):
+                for path in paths:
+                    func(path)
+        print_row(name, counter, n)
+
+
+# ========== fast-vs-full: 容器头解析 vs Pillow 完整解析 ==========
+def bench_fast_vs_full(paths, repeat):
+    n = len(paths) * repeat
+    print(f"\n📊 fast-vs-full 基准: {len(paths)} 个文件 x {repeat} 轮")
+    print_header()
+    verdicts = {}
+    for mode in am.DETECT_MODES:
+        verdicts[mode] = [am.detect_aigc_source(path, mode=mode)["source"] for path in paths]
+        with IOCounter() as counter:
+            for _ in range(repeat):
+                for path in paths:
+                    am.detect_aigc_source(path, mode=mode)
+        print_row(mode, counter, n)
+
+    mismatches = [(path, full, fast) for path, full, fast
+                  in zip(paths, verdicts["full"], verdicts["fast"]) if full != fast]
+    print(f"\n   来源判断一致: {len(paths) - len(mismatches)}/{len(paths)}")
+    for path, full, fast in mismatches[:10]:
+        print(f"   ⚠️ {path}: full={full} fast={fast}")
+
+
+# ========== xmp-regex: 预编译单次扫描 vs 原先的 7 次 re.search ==========
+def legacy_parse_aigc_from_xmp(xmp_string):
+    """优化前的 parse_aigc_from_xmp, 仅作为基准对照"""
+    aigc_info = {}
+    if not xmp_string:
+        return aigc_info
+
+    match = re.search(r'"AIGC"\s*:\s*(\{[^}]+\})', xmp_string)
+    if match:
+        try:
+            return {"AIGC": json.loads(match.group(1))}
+        except ValueError:
+            pass
+
+    patterns = {
+        'Label': r'<[^>]*:?Label[^>]*>([^<]+)<',
+        'ContentProducer': r'<[^>]*:?ContentProducer[^>]*>([^<]+)<',
+        'ProduceID': r'<[^>]*:?ProduceID[^>]*>([^<]+)<',
+        'Propagator': r'<[^>]*:?Propagator[^>]*>([^<]+)<',
+        'PropatorID': r'<[^>]*:?PropatorID[^>]*>([^<]+)<',
+        'ReserveCode1': r'<[^>]*:?ReserveCode1[^>]*>([^<]+)<',
+        'ReserveCode2': r'<[^>]*:?ReserveCode2[^>]*>([^<]+)<',
+    }
+    for key, pattern in patterns.items():
+        match = re.search(pattern, xmp_string, re.IGNORECASE)
+        if match:
+            aigc_info[key] = match.group(1)
+
+    if not aigc_info:
+        if 'AIGC' in xmp_string or 'aigc' in xmp_string:
+            aigc_info['raw_aigc_detected'] = True
+            if 'ContentProducer' in xmp_string:
+                cp_match = re.search(r'ContentProducer["\s:]+([^",}\s]+)', xmp_string)
+                if cp_match:
+                    aigc_info['ContentProducer'] = cp_match.group(1)
+
+    return {"AIGC": aigc_info} if aigc_info else {}
+
+
+def make_xmp_packet(body):
+    """生成接近真实相机 / Photoshop 导出的 XMP 包: 多个命名空间, 历史记录, 末尾 2 KB 填充"""
+    history = "".join(
+        f'<rdf:li stEvt:action="saved" stEvt:instanceID="xmp.iid:{i:032x}" '
+        f'stEvt:when="2026-04-0{i % 9 + 1}T10:00:00+08:00" stEvt:softwareAgent="Adobe Photoshop 25.0" '
+        f'stEvt:changed="/"/>'
+        for i in range(20)
+    )
+    return (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="Adobe XMP Core 9.1-c001">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/" '
+        'xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/" xmlns:stEvt="http://ns.adobe.com/xap/1.0/sType/ResourceEvent#" '
+        'xmlns:TC260="http://www.tc260.org.cn/ns/AIGC/1.0/" '
+        'xmp:CreatorTool="Adobe Photoshop 25.0" xmp:CreateDate="2026-04-01T10:00:00+08:00" '
+        'photoshop:ColorMode="3" xmpMM:DocumentID="xmp.did:0123456789abcdef">'
+        '<dc:format>image/jpeg</dc:format>'
+        '<dc:title><rdf:Alt><rdf:li xml:lang="x-default">sunset over the harbour</rdf:li></rdf:Alt></dc:title>'
+        f'<xmpMM:History><rdf:Seq>{history}</rdf:Seq></xmpMM:History>'
+        f'{body}'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>'
+        + " " * 2048 +
+        '<?xpacket end="w"?>'
+    )
+
+
+XMP_SAMPLES = {
+    "AIGC JSON": make_xmp_packet(
+        '<TC260:AIGC>{"AIGC": {"Label": "1", "ContentProducer": "doubao", "ProduceID": "7f3a", '
+        '"ReservedCode1": "", "ContentPropagator": "doubao", "PropagateID": "7f3a"}}</TC260:AIGC>'),
+    "AIGC 标签": make_xmp_packet(
+        '<TC260:Label>1</TC260:Label><TC260:ContentProducer>tongyi</TC260:ContentProducer>'
+        '<TC260:ProduceID>a1b2c3</TC260:ProduceID><TC260:Propagator>aliyun</TC260:Propagator>'
+        '<TC260:PropatorID>d4e5f6</TC260:PropatorID><TC260:ReserveCode1>x</TC260:ReserveCode1>'
+        '<TC260:ReserveCode2>y</TC260:ReserveCode2>'),
+    "无 AIGC": make_xmp_packet('<photoshop:City>Taipei</photoshop:City>'),
+}
+
+
+def bench_xmp_regex(repeat):
+    print(f"\n📊 xmp-regex 基准: 每种 XMP 包 x {repeat} 次")
+    print(f"   {'样本':<10} {'大小':>8} {'原实现':>12} {'新实现':>12} {'加速比':>8}  结果一致")
+    for name, packet in XMP_SAMPLES.items():
+        timings = []
+        for func in (legacy_parse_aigc_from_xmp, am.parse_aigc_from_xmp):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func(packet)
+            timings.append((time.perf_counter() - start) / repeat * 1e6)
+        same = legacy_parse_aigc_from_xmp(packet) == am.parse_aigc_from_xmp(packet)
+        print(f"   {name:<10} {len(packet) / 1024:>6.1f}KB {timings[0]:>9.1f} us {timings[1]:>9.1f} us "
+              f"{timings[0] / timings[1]:>7.1f}x  {'✅' if same else '❌'}")
+
+
+# ========== import-time: 启动耗时回归检查 (python -X importtime) ==========
+# 这些模块只应在真正用到的代码路径里导入
+HEAVY_MODULES = ("PIL", "c2pa", "multiprocessing", "concurrent.futures.process", "sqlite3", "argparse")
+
+
+def measure_import_time():
+    """在子进程里 import aigc_metadata, 返回 (累计耗时 us, 导入过的模块名列表)"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import aigc_metadata"],
+        cwd=os.path.dirname(os.path.abspath(am.__file__)),
+        capture_output=True, text=True, check=True,
+    )
+    total = None
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _self, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # 表头
+        modules.append(name.strip())
+        if name.strip() == "aigc_metadata":
+            total = int(cumulative)
+    return total, modules
+
+
+def bench_import_time(runs, budget_ms):
+    measure_import_time()  # 预热: 生成 .pyc, 避免把编译时间算进去
+    samples = []
+    for _ in range(runs):
+        total, modules = measure_import_time()
+        samples.append(total / 1000)
+    best = min(samples)
+    print(f"\n📊 import-time: import aigc_metadata 最快 {best:.1f} ms, 中位数 {sorted(samples)[runs // 2]:.1f} ms "
+          f"({runs} 次)")
+
+    loaded = [m for m in HEAVY_MODULES if m in modules]
+    ok = True
+    if loaded:
+        print(f"   ❌ 启动时加载了重量级模块: {', '.join(loaded)}")
+        ok = False
+    if budget_ms and best > budget_ms:
+        print(f"   ❌ 超出预算 {budget_ms:.1f} ms")
+        ok = False
+    if ok:
+        print("   ✅ 启动耗时检查通过")
+    return ok
+
+
+# ========== make-corpus: 可复现的合成语料 ==========
+PROMPT_WORDS = ("masterpiece", "best quality", "1girl", "landscape", "sunset", "city", "neon", "portrait",
+                "watercolor", "cinematic lighting", "mountains", "cat", "cyberpunk", "forest", "ocean", "8k")
+SAMPLERS = ("Euler a", "DPM++ 2M Karras", "DDIM", "UniPC", "DPM++ SDE Karras")
+AIGC_PRODUCERS = ("doubao", "wenxin", "tongyi", "midjourney", "hunyuan")
+
+# 语料种类 -> 期望的检测结论
+CORPUS_KINDS = {
+    "a1111": "Stable Diffusion (A1111/Forge)",
+    "comfyui": "ComfyUI",
+    "novelai": "NovelAI",
+    "exif_usercomment": "带 EXIF UserComment 的图片",
+    "xmp_aigc_jpeg": "符合中国 AIGC 国家标准",
+    "xmp_aigc_png": "符合中国 AIGC 国家标准",
+    "plain_jpeg": "未知",
+    "large_png": "Stable Diffusion (A1111/Forge)",
+    "large_jpeg": "未知",
+}
+LARGE_KINDS = ("large_png", "large_jpeg")
+
+
+def random_prompt(rng):
+    return ", ".join(rng.sample(PROMPT_WORDS, rng.randint(4, 10)))
+
+
+def a1111_parameters(rng):
+    return (f"{random_prompt(rng)}\nNegative prompt: lowres, bad anatomy, blurry\n"
+            f"Steps: {rng.randint(20, 50)}, Sampler: {rng.choice(SAMPLERS)}, CFG scale: {rng.choice((5, 6.5, 7, 9))}, "
+            f"Seed: {rng.getrandbits(32)}, Size: 512x512, Model hash: {rng.getrandbits(40):010x}, "
+            f"Model: sd_xl_base_1.0, Version: v1.9.4")
+
+
+def comfyui_graph(rng):
+    """生成 ComfyUI 的 prompt (API 格式) 与 workflow (界面格式), 节点数随机"""
+    nodes = {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd_xl_base_1.0.safetensors"}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": random_prompt(rng), "clip": ["4", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "lowres, blurry", "clip": ["4", 1]}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 1024, "height": 1024, "batch_size": 1}},
+        "3": {"class_type": "KSampler", "inputs": {
+            "seed": rng.getrandbits(48), "steps": rng.randint(20, 40), "cfg": 7.0, "sampler_name": "euler",
+            "scheduler": "normal", "denoise": 1.0, "model": ["4", 0], "positive": ["6", 0],
+            "negative": ["7", 0], "latent_image": ["5", 0]}},
+        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI", "images": ["8", 0]}},
+    }
+    for i in range(rng.randint(0, 40)):  # 额外的 LoRA / 预处理节点, 让 workflow 大小有差异
+        nodes[str(100 + i)] = {"class_type": "LoraLoader", "inputs": {
+            "lora_name": f"style_{rng.getrandbits(16):04x}.safetensors", "strength_model": 0.8,
+            "strength_clip": 0.8, "model": ["4", 0], "clip": ["4", 1]}}
+    workflow = {"last_node_id": len(nodes), "nodes": [
+        {"id": int(node_id), "type": node["class_type"], "pos": [rng.randint(0, 2000), rng.randint(0, 2000)],
+         "size": [315, 262], "widgets_values": list(node["inputs"].values())}
+        for node_id, node in nodes.items()
+    ], "links": [], "version": 0.4}
+    return json.dumps(nodes), json.dumps(workflow)
+
+
+def novelai_comment(rng):
+    return json.dumps({
+        "prompt": random_prompt(rng), "steps": 28, "height": 1216, "width": 832, "scale": 5.0,
+        "uncond_scale": 1.0, "cfg_rescale": 0.0, "seed": rng.getrandbits(32), "n_samples": 1,
+        "sampler": "k_euler_ancestral", "generator": "NovelAI Diffusion V3",
+        "uc": "lowres, bad anatomy",
+    })
+
+
+def xmp_aigc_packet(rng):
+    return make_xmp_packet(
+        f'<TC260:Label>1</TC260:Label><TC260:ContentProducer>{rng.choice(AIGC_PRODUCERS)}</TC260:ContentProducer>'
+        f'<TC260:ProduceID>{rng.getrandbits(64):016x}</TC260:ProduceID>')
+
+
+def noise_image(rng, width, height):
+    """随机像素 (压缩率接近真实照片); 用 rng 生成, 同一 seed 每次结果一致"""
+    return Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+
+
+def gradient_image(width, height):
+    """大尺寸图用渐变生成, 避免语料体积过大, 但解码开销与像素数成正比"""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    return Image.merge("RGB", (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient))
+
+
+def encode_png(img, text_chunks=(), itxt_chunks=()):
+    info = PngImagePlugin.PngInfo()
+    for key, value in text_chunks:
+        info.add_text(key, value)
+    for key, value in itxt_chunks:
+        info.add_itxt(key, value)
+    buf = io.BytesIO()
+    img.save(buf, "PNG", pnginfo=info)
+    return buf.getvalue()
+
+
+def encode_jpeg(img, exif=None, xmp=None):
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90, **({"exif": exif} if exif is not None else {}))
+    data = buf.getvalue()
+    if xmp is not None:
+        # 手工插入 APP1 XMP 段 (紧跟 SOI), 与相机 / Photoshop 的写法一致
+        payload = am.XMP_JPEG_HEADER + xmp.encode("utf-8")
+        data = data[:2] + b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload + data[2:]
+    return data
+
+
+def make_corpus_file(kind, rng, large_size):
+    """生成一张指定种类的图片, 返回 (扩展名, 文件内容)"""
+    if kind == "a1111":
+        return ".png", encode_png(noise_image(rng, 256, 256), [("parameters", a1111_parameters(rng))])
+    if kind == "comfyui":
+        prompt, workflow = comfyui_graph(rng)
+        return ".png", encode_png(noise_image(rng, 256, 256), [("prompt", prompt), ("workflow", workflow)])
+    if kind == "novelai":
+        return ".png", encode_png(noise_image(rng, 256, 256), [
+            ("Title", "AI generated image"), ("Description", random_prompt(rng)),
+            ("Software", "NovelAI"), ("Source", "NovelAI Diffusion V3 C1E1DE52"), ("Comment", novelai_comment(rng))])
+    if kind == "exif_usercomment":
+        exif = Image.Exif()
+        exif[0x010F] = "Canon"
+        exif[0x0110] = "EOS R5"
+        exif.get_ifd(am.EXIF_IFD_POINTER)[0x9286] = b"ASCII\x00\x00\x00" + random_prompt(rng).encode()
+        return ".jpg", encode_jpeg(noise_image(rng, 256, 256), exif=exif)
+    if kind == "xmp_aigc_jpeg":
+        return ".jpg", encode_jpeg(noise_image(rng, 256, 256), xmp=xmp_aigc_packet(rng))
+    if kind == "xmp_aigc_png":
+        return ".png", encode_png(noise_image(rng, 256, 256),
+                                  itxt_chunks=[(am.XMP_PNG_KEYWORD.decode(), xmp_aigc_packet(rng))])
+    if kind == "plain_jpeg":
+        return ".jpg", encode_jpeg(noise_image(rng, 256, 256))
+    if kind == "large_png":
+        return ".png", encode_png(gradient_image(large_size, large_size), [("parameters", a1111_parameters(rng))])
+    if kind == "large_jpeg":
+        return ".jpg", encode_jpeg(gradient_image(large_size, large_size))
+    raise ValueError(f"未知的语料种类: {kind}")
+
+
+def make_corpus(directory, count, large_count, large_size, seed):
+    """生成合成语料和 manifest.json (文件名 -> 种类 / 期望结论), 同一 seed 生成的内容完全一致"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    total = 0
+    for kind in CORPUS_KINDS:
+        for i in range(large_count if kind in LARGE_KINDS else count):
+            suffix, data = make_corpus_file(kind, rng, large_size)
+            name = f"{kind}_{i:04d}{suffix}"
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(data)
+            manifest[name] = {"kind": kind, "expected": CORPUS_KINDS[kind]}
+            total += len(data)
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"seed": seed, "files": manifest}, f, ensure_ascii=False, indent=1)
+    print(f"✅ 已生成 {len(manifest)} 个文件 ({total / 1024 / 1024:.1f} MB) 到 {directory} (seed={seed})")
+
+
+# ========== corpus: 语料基准 (各阶段延迟分位数 / 吞吐 / 峰值内存) ==========
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize_ms(samples):
+    values = sorted(samples)
+    return {"n": len(values), "p50": percentile(values, 0.50), "p90": percentile(values, 0.90),
+            "p99": percentile(values, 0.99), "max": values[-1] if values else None}
+
+
+def time_ms(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_corpus(directory, repeat, mode, exhaustive):
+    """对语料逐文件计时: 端到端检测、各检测器、以及 extract_xmp / read_png_chunks / parse_aigc_from_xmp 单独计时"""
+    with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)["files"]
+    paths = [os.path.join(directory, name) for name in sorted(manifest)]
+    stages = {}
+
+    def observe(stage, ms):
+        stages.setdefault(stage, []).append(ms)
+
+    wrong = []
+    for path in paths:  # 预热 page cache 和延迟导入
+        am.detect_aigc_source(path, mode=mode, exhaustive=exhaustive)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for round_index in range(repeat):
+        for path in paths:
+            results, ms = time_ms(am.detect_aigc_source, path, mode=mode, exhaustive=exhaustive)
+            observe("detect", ms)
+            for name, detector_ms in results["detector_ms"].items():
+                observe(f"detector:{name}", detector_ms)
+            if round_index == 0 and results["source"] != manifest[os.path.basename(path)]["expected"]:
+                wrong.append((path, results["source"]))
+    detect_seconds = time.perf_counter() - start
+
+    for _ in range(repeat):
+        for path in paths:
+            with am.open_source(path) as source:
+                xmp, ms = time_ms(am.extract_xmp, source)
+                observe("extract_xmp", ms)
+                if xmp:
+                    observe("parse_aigc_from_xmp", time_ms(am.parse_aigc_from_xmp, xmp)[1])
+                if source.data[:8] == am.PNG_SIGNATURE:
+                    observe("read_png_chunks", time_ms(am.read_png_chunks, source, metadata_only=True)[1])
+
+    n = len(paths) * repeat
+    return {
+        "files": len(paths),
+        "repeat": repeat,
+        "mode": mode,
+        "exhaustive": exhaustive,
+        "files_per_sec": n / detect_seconds if detect_seconds else None,
+        # ru_maxrss 在 Linux 上单位是 KB; 预热之后的增长才是检测本身造成的
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+        "verdict_errors": len(wrong),
+        "stages": {stage: summarize_ms(samples) for stage, samples in sorted(stages.items())},
+    }, wrong
+
+
+def print_corpus_report(report, wrong):
+    print(f"\n📊 corpus 基准: {report['files']} 个文件 x {report['repeat']} 轮, mode={report['mode']}"
+          f"{', exhaustive' if report['exhaustive'] else ''}")
+    print(f"   {'阶段':<26} {'次数':>6} {'p50':>10} {'p90':>10} {'p99':>10} {'max':>10}")
+    for stage, s in report["stages"].items():
+        print(f"   {stage:<26} {s['n']:>6} {s['p50']:>7.3f} ms {s['p90']:>7.3f} ms "
+              f"{s['p99']:>7.3f} ms {s['max']:>7.3f} ms")
+    print(f"\n   吞吐: {report['files_per_sec']:.1f} 文件/秒 (单进程)")
+    print(f"   峰值 RSS: {report['peak_rss_mb']:.1f} MB (检测期间增长 {report['peak_rss_growth_mb']:.1f} MB)")
+    if wrong:
+        print(f"   ❌ 来源判断与 manifest 不一致: {len(wrong)} 个")
+        for path, source in wrong[:10]:
+            print(f"      {path}: {source}")
+    else:
+        print("   ✅ 来源判断全部与 manifest 一致")
+
+
+# p50 低于该值的阶段计时噪声太大, 不参与回归比较
+REGRESSION_FLOOR_MS = 0.05
+
+
+def compare_with_baseline(report, baseline, max_regress):
+    """逐阶段比较 p50, 超过 baseline 的 max_regress 倍视为回归; 吞吐下降同理"""
+    regressions = []
+    for stage, s in report["stages"].items():
+        base = baseline["stages"].get(stage)
+        if not base or max(base["p50"], s["p50"]) < REGRESSION_FLOOR_MS:
+            continue
+        if s["p50"] > base["p50"] * max_regress:
+            regressions.append(f"{stage}: p50 {base['p50']:.3f} -> {s['p50']:.3f} ms")
+    if report["files_per_sec"] * max_regress < baseline["files_per_sec"]:
+        regressions.append(f"吞吐: {baseline['files_per_sec']:.1f} -> {report['files_per_sec']:.1f} 文件/秒")
+    if regressions:
+        print(f"\n   ❌ 相对基线出现性能回归 (阈值 {max_regress}x):")
+        for line in regressions:
+            print(f"      {line}")
+        return False
+    print(f"\n   ✅ 与基线相比没有超过 {max_regress}x 的回归")
+    return True
+
+
+# ========== remote: 本地 HTTP 服务器上验证 aigc_async 的 Range 读取 ==========
+async def serve_files(paths):
+    """启动本地 HTTP 服务器: /range/<i> 支持 Range (FileResponse), /plain/<i> 忽略 Range 总是返回整个文件"""
+    from aiohttp import web
+
+    async def ranged(request):
+        return web.FileResponse(paths[int(request.match_info["index"])])
+
+    async def plain(request):
+        with open(paths[int(request.match_info["index"])], "rb") as f:
+            return web.Response(body=f.read(), content_type="application/octet-stream")
+
+    app = web.Application()
+    app.router.add_get("/range/{index}", ranged)
+    app.router.add_get("/plain/{index}", plain)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def bench_remote_async(paths, concurrency, mode):
+    import aigc_async
+
+    runner, base = await serve_files(paths)
+    expected = [am.detect_aigc_source(path, mode=mode)["source"] for path in paths]
+    total = sum(os.path.getsize(path) for path in paths)
+    print(f"\n📊 remote 基准: {len(paths)} 个文件 ({total / 1024 / 1024:.2f} MB), 并发 {concurrency}, mode={mode}")
+    print(f"   {'服务器':<10} {'耗时':>9} {'请求数':>8} {'读取量':>12} {'占文件总量':>10}  来源判断一致")
+    try:
+        for route in ("range", "plain"):
+            urls = {f"{base}/{route}/{i}": i for i in range(len(paths))}
+            stats = aigc_async.FetchStats()
+            start = time.perf_counter()
+            results = [r async for r in aigc_async.scan_async(
+                list(urls), concurrency=concurrency, detect_options={"mode": mode}, stats=stats)]
+            elapsed = time.perf_counter() - start
+            mismatches = [(paths[urls[r["path"]]], r.get("error") or r["source"]) for r in results
+                          if r["source"] != expected[urls[r["path"]]]]
+            print(f"   {route:<10} {elapsed:>7.2f} s {stats.requests:>8} {stats.bytes / 1024 / 1024:>9.2f} MB "
+                  f"{stats.bytes / total:>10.1%}  {len(results) - len(mismatches)}/{len(paths)}")
+            for path, got in mismatches[:10]:
+                print(f"   ⚠️ {path}: {got}")
+    finally:
+        await runner.cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="aigc_metadata.py 性能基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("single-pass", help="共享文件上下文 vs 多次打开文件")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--repeat", type=int, default=20)
+
+    p = sub.add_parser("fast-vs-full", help="容器头解析 vs Pillow 完整解析")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--repeat", type=int, default=20)
+
+    p = sub.add_parser("xmp-regex", help="parse_aigc_from_xmp: 预编译单次扫描 vs 7 次 re.search")
+    p.add_argument("--repeat", type=int, default=2000)
+
+    p = sub.add_parser("import-time", help="启动耗时回归检查, 超出预算或加载了重量级模块时返回 1")
+    p.add_argument("--runs", type=int, default=10)
+    p.add_argument("--budget-ms", type=float, default=50.0)
+
+    p = sub.add_parser("make-corpus", help="生成可复现的合成语料 (A1111 / ComfyUI / NovelAI / EXIF / XMP / 大图)")
+    p.add_argument("directory")
+    p.add_argument("--count", type=int, default=20, help="每种小图的数量")
+    p.add_argument("--large-count", type=int, default=2, help="每种大图的数量")
+    p.add_argument("--large-size", type=int, default=4096, help="大图边长 (像素)")
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser("corpus", help="在合成语料上测量各阶段延迟分位数、吞吐和峰值内存")
+    p.add_argument("directory")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--mode", choices=am.DETECT_MODES, default="full")
+    p.add_argument("--exhaustive", action="store_true", help="执行全部检测器, 每个检测器都有计时")
+    p.add_argument("--save", metavar="JSON", help="把报告保存为 JSON, 作为以后比较的基线")
+    p.add_argument("--baseline", metavar="JSON", help="与基线报告比较, 出现回归时返回 1")
+    p.add_argument("--max-regress", type=float, default=1.5, help="允许的 p50 变慢倍数")
+
+    p = sub.add_parser("remote", help="在本地 HTTP 服务器上验证异步扫描的 Range 读取 (有 / 无 Range 支持)")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--mode", choices=am.DETECT_MODES, default="fast")
+
+    args = parser.parse_args(argv)
+    if args.command == "make-corpus":
+        make_corpus(args.directory, args.count, args.large_count, args.large_size, args.seed)
+        return 0
+    if args.command == "corpus":
+        if not os.path.exists(os.path.join(args.directory, "manifest.json")):
+            print(f"❌ {args.directory} 下没有 manifest.json, 请先运行 make-corpus")
+            return 1
+        report, wrong = bench_corpus(args.directory, args.repeat, args.mode, args.exhaustive)
+        print_corpus_report(report, wrong)
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=1)
+        ok = not wrong
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                ok = compare_with_baseline(report, json.load(f), args.max_regress) and ok
+        return 0 if ok else 1
+    if args.command == "xmp-regex":
+        bench_xmp_regex(args.repeat)
+        return 0
+    if args.command == "import-time":
+        return 0 if bench_import_time(args.runs, args.budget_ms) else 1
+
+    paths = list(am.iter_image_paths(args.paths))
+    if not paths:
+        print("❌ 没有找到图片")
+        return 1
+
+    if args.command == "single-pass":
+        bench_single_pass(paths, args.repeat)
+    elif args.command == "fast-vs-full":
+        bench_fast_vs_full(paths, args.repeat)
+    elif args.command == "remote":
+        asyncio.run(bench_remote_async(paths, args.concurrency, args.mode))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
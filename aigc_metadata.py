@@ -7,29 +7,268 @@ AIGC 图片元数据检测工具
 - 通用 XMP/EXIF 元数据
 """
 
-from PIL import Image
-from PIL.ExifTags import TAGS
+import codecs
+import io
 import json
+import mmap
+import os
 import struct
 import sys
 import re
-from pathlib import Path
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
 
-# 尝试导入 c2pa 库
-try:
-    import c2pa
-    C2PA_AVAILABLE = True
-except ImportError:
-    C2PA_AVAILABLE = False
+# 检测逻辑或输出格式变化时递增, 旧的缓存结果随之失效
+DETECTOR_VERSION = "7"
+# 只影响输出附加信息、不影响检测结论的选项, 不参与缓存键和增量清单的选项键
+PROFILE_ONLY_OPTIONS = ("profile",)
 
 
-def read_c2pa_metadata(filepath):
-    """使用 c2pa 库读取完整的 C2PA 元数据"""
-    if not C2PA_AVAILABLE:
+class ResourceLimitError(ValueError):
+    """单个文件超出字节预算 / 解析上限 (恶意构造或异常巨大的图片)"""
+
+
+class DetectTimeout(ResourceLimitError):
+    """单个文件检测超时"""
+
+# 重量级依赖 (Pillow / c2pa 原生库 / multiprocessing / sqlite3 / argparse / hashlib 等) 都在用到时才导入,
+# 这样 --help、缓存命中和 fast 模式都不必承担原生库的加载时间。
+_c2pa_module = None
+
+
+def load_c2pa():
+    """按需导入 c2pa 库 (只尝试一次), 未安装时返回 None"""
+    global _c2pa_module
+    if _c2pa_module is None:
+        try:
+            import c2pa
+            _c2pa_module = c2pa
+        except ImportError:
+            _c2pa_module = False
+    return _c2pa_module or None
+
+
+def c2pa_available():
+    return load_c2pa() is not None
+
+
+class BufferReader(io.RawIOBase):
+    """共享缓冲区上的只读流: 每个读者独立维护读指针, 不拷贝整块数据
+
+    name 为来源文件路径; Pillow 报 "cannot identify image file %r" 时用的是 repr(流), 这里让它显示路径。
+    """
+
+    def __init__(self, buf, name=None):
+        super().__init__()
+        self._view = memoryview(buf)
+        self.name = name
+        self._pos = 0
+        self.bytes_read = 0  # 通过这个流交出去的字节数 (Pillow / c2pa 实际读取量)
+
+    def __repr__(self):
+        return repr(self.name) if self.name else f"<内存图片 {len(self._view)} 字节>"
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        if end <= self._pos:
+            return b''
+        data = self._view[self._pos:end].tobytes()
+        self.bytes_read += end - self._pos
+        self._pos = end
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class ImageSource:
+    """共享的文件上下文: 文件只打开一次, 同一块缓冲区交给 PIL / C2PA / XMP / PNG chunk / EXIF 复用
+
+    网络存储上每次 open+read 都是一次往返, 原先一张图要打开 4 次文件。
+    文件默认以 mmap 方式映射, 只有真正被访问到的页才会读入, 内存占用不随图片大小增长。
+    """
+
+    def __init__(self, data, path=None, fileobj=None):
+        self.data = data
+        self.path = str(path) if path is not None else None
+        # 自己打开的文件对象: close() 时连同 mmap 一起关闭; 调用方传入的文件对象不归这里管
+        self._file = fileobj
+        self._readers = []
+        # False 表示 data 只是文件前缀 (见 from_stream), 不能交给需要完整像素数据的步骤
+        self.complete = True
+
+    @classmethod
+    def from_path(cls, filepath, use_mmap=True, full=False, max_bytes=None):
+        """映射 / 读取整个文件; 设置 max_bytes 且文件更大时, 改为像 from_stream 一样只读元数据前缀"""
+        f = open(filepath, 'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if max_bytes is not None and size > max_bytes:
+                with f:
+                    source = cls.from_stream(f, full=full, max_bytes=max_bytes)
+                source.path = str(filepath)
+                return source
+            if use_mmap and size > 0:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), filepath, fileobj=f)
+            data = f.read()
+        except BaseException:
+            f.close()
+            raise
+        f.close()
+        return cls(data, filepath)
+
+    @classmethod
+    def from_buffer(cls, buf, max_bytes=None):
+        """包装内存中的图片数据; bytes / bytearray 零拷贝, memoryview 只在覆盖整个 bytes 对象时零拷贝
+
+        各解析步骤要用 bytes 的 find / split 等方法, 其余 memoryview 需要复制一次。
+        """
+        if max_bytes is not None and len(buf) > max_bytes:
+            raise ResourceLimitError(f"图片超过字节预算 {max_bytes}")
+        if isinstance(buf, memoryview):
+            if isinstance(buf.obj, bytes) and buf.nbytes == len(buf.obj) and buf.contiguous:
+                buf = buf.obj
+            else:
+                buf = buf.tobytes()
+        return cls(buf)
+
+    @classmethod
+    def from_stream(cls, f, full=False, chunk_size=None, max_bytes=None):
+        """从可读的文件对象 (HTTP 响应体 / 压缩包成员 / BytesIO 等) 读取图片
+
+        默认只读到元数据区结束 (PNG 第一个 IDAT / JPEG SOS) 为止, 像素数据不读;
+        前缀里发现 C2PA 清单时补读剩余部分, 因为 C2PA 校验需要完整文件。
+        full=True 或无法判断元数据区边界的格式 (WebP / TIFF 的元数据可能在文件末尾) 读取全部内容。
+        调用方传入的文件对象不会被关闭。
+        max_bytes 是最多读取的字节数, 需要读更多才能完成时抛出 ResourceLimitError
+        (例如 PNG chunk 声明了巨大的长度, 元数据区边界迟迟读不到)。
+        """
+        chunk_size = chunk_size or STREAM_READ_CHUNK
+        buf = bytearray()
+        target = -1 if full else None
+
+        def read_more(size):
+            if max_bytes is not None:
+                if len(buf) >= max_bytes:
+                    # 已经用完预算: 再读 1 字节确认后面还有没有数据
+                    if f.read(1):
+                        raise ResourceLimitError(f"读取超过字节预算 {max_bytes}")
+                    return b''
+                size = max_bytes - len(buf) if size < 0 else min(size, max_bytes - len(buf))
+            return f.read(size)
+
+        while target is None:
+            chunk = read_more(chunk_size)
+            if not chunk:
+                return cls(bytes(buf))
+            buf += chunk
+            target = metadata_read_target(buf)
+        if target < 0:
+            while True:
+                chunk = read_more(-1)
+                if not chunk:
+                    break
+                buf += chunk
+            return cls(bytes(buf))
+        # 截到元数据区边界, 同一张图无论分几次读到, 前缀内容 (以及缓存键) 都一样
+        del buf[target:]
+        source = cls(bytes(buf))
+        source.complete = False
+        return source
+
+    def stream(self):
+        """返回一个独立读指针的只读流, 与其他读者共享同一块缓冲区"""
+        reader = BufferReader(self.data, self.path)
+        self._readers.append(reader)
+        return reader
+
+    def bytes_streamed(self):
+        """所有 stream() 读者累计读走的字节数"""
+        return sum(reader.bytes_read for reader in self._readers)
+
+    def close(self):
+        # 先释放所有读者持有的 memoryview, 否则 mmap 无法关闭
+        for reader in self._readers:
+            reader.close()
+        self._readers = []
+        if self._file is not None:
+            self.data.close()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+@contextmanager
+def open_source(filepath, full=False, max_bytes=None):
+    """接受路径 / ImageSource / bytes / memoryview / 文件对象, 统一得到 ImageSource; 只关闭自己打开的资源
+
+    文件对象默认只读取元数据所在的前缀, full=True 时读取全部内容 (见 ImageSource.from_stream)。
+    max_bytes 是单个文件的字节预算: 超过预算的路径只读元数据前缀, 前缀也放不下时抛出 ResourceLimitError。
+    """
+    if isinstance(filepath, ImageSource):
+        yield filepath
+        return
+    if isinstance(filepath, (bytes, bytearray, memoryview)):
+        source = ImageSource.from_buffer(filepath, max_bytes=max_bytes)
+    elif hasattr(filepath, 'read'):
+        source = ImageSource.from_stream(filepath, full=full, max_bytes=max_bytes)
+    else:
+        source = ImageSource.from_path(filepath, full=full, max_bytes=max_bytes)
+    with source:
+        yield source
+
+
+def read_c2pa_metadata(filepath, mime_type=None):
+    """使用 c2pa 库读取完整的 C2PA 元数据
+
+    传入 ImageSource / bytes / 文件对象和 MIME 类型时直接从内存流读取, 不再重新打开文件;
+    C2PA 校验需要完整内容, 文件对象会被完整读取。
+    """
+    c2pa = load_c2pa()
+    if c2pa is None:
         return None
     
     try:
-        path = Path(filepath)
+        if mime_type and not isinstance(filepath, (str, os.PathLike)):
+            with open_source(filepath, full=True) as source, c2pa.Reader(mime_type, source.stream()) as reader:
+                return json.loads(reader.json())
+        path = filepath.path if isinstance(filepath, ImageSource) else filepath
         with c2pa.Reader(path) as reader:
             manifest_json = reader.json()
             return json.loads(manifest_json)
@@ -88,35 +327,271 @@ def parse_c2pa_info(c2pa_data):
     return info
 
 
+# ========== 容器结构解析 (只读段头, 不解码像素) ==========
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TIFF_XMP_TAG = 700
+EXIF_IFD_POINTER = 0x8769
+# TIFF 字段类型 -> (struct 格式, 单个值字节数)
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8),
+    6: ('b', 1), 7: ('s', 1), 8: ('h', 2), 9: ('i', 4), 10: ('ii', 8),
+}
+
+STREAM_READ_CHUNK = 64 * 1024  # 从文件对象读取前缀时每次读取的字节数
+PNG_MAX_CHUNK_LENGTH = 0x7FFFFFFF  # PNG 规范规定 chunk 长度不超过 2^31-1, 更大的一定是损坏或恶意构造
+# 未指定 max_bytes 时文本值默认保留的字节数: 压缩值只解压到这里 (防解压炸弹), 超出的值输出为截断标记 + 原始长度,
+# 一个恶意 PNG 不会产生几十 MB 的 JSON 结果
+TEXT_DEFAULT_LIMIT = 1024 * 1024
+TEXT_SIZE_SCAN_LIMIT = 256 * 1024 * 1024  # 统计被截断文本的完整大小时最多解压这么多字节
+EXIF_PILLOW_MAX_PIXELS = 4096 * 4096  # 超过这个像素数的非 JPEG 图片不用 Pillow 读 EXIF (会解码全部像素)
+
+
+def iter_jpeg_segments(buf):
+    """遍历 JPEG 段头, 产出 (marker, 数据起始偏移, 数据长度), 产出 SOS 段后停止"""
+    pos = 2
+    size = len(buf)
+    while pos + 4 <= size:
+        if buf[pos] != 0xFF:
+            return
+        marker = buf[pos + 1]
+        if marker == 0xFF:  # 填充字节
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker == 0xD9:
+            return
+        length = struct.unpack_from('>H', buf, pos + 2)[0]
+        yield marker, pos + 4, length - 2
+        if marker == 0xDA:  # SOS 之后是压缩数据
+            return
+        pos += 2 + length
+
+
+def iter_png_chunk_headers(buf):
+    """只解析 PNG chunk 头, 产出 (类型, 数据起始偏移, 长度), 不触碰 chunk 数据"""
+    pos = len(PNG_SIGNATURE)
+    size = len(buf)
+    while pos + 8 <= size:
+        length, chunk_type = struct.unpack_from('>I4s', buf, pos)
+        if length > PNG_MAX_CHUNK_LENGTH:
+            return
+        yield chunk_type.decode('ascii', errors='ignore'), pos + 8, length
+        if chunk_type == b'IEND':
+            return
+        pos += 12 + length
+
+
+def iter_riff_chunks(buf):
+    """遍历 WebP (RIFF) chunk 头, 产出 (fourcc, 数据起始偏移, 长度)"""
+    pos = 12
+    size = len(buf)
+    while pos + 8 <= size:
+        fourcc = buf[pos:pos + 4].decode('ascii', errors='ignore')
+        length = struct.unpack_from('<I', buf, pos + 4)[0]
+        yield fourcc, pos + 8, length
+        pos += 8 + length + (length & 1)
+
+
+def metadata_prefix_end(buf):
+    """根据已读到的前缀判断元数据区在哪里结束 (像素数据开始处)
+
+    PNG 返回第一个 IDAT 的数据起点, JPEG 返回 SOS 段头之后; 前缀还不够判断时返回 None,
+    元数据可能位于文件任意位置的格式 (WebP / TIFF 等) 返回 -1, 表示需要完整读取。
+    """
+    if len(buf) < 12:
+        return None
+    if buf[:8] == PNG_SIGNATURE:
+        for chunk_type, offset, _length in iter_png_chunk_headers(buf):
+            if chunk_type in ('IDAT', 'IEND'):
+                return offset
+        return None
+    if buf[:2] == b'\xff\xd8':
+        for marker, offset, length in iter_jpeg_segments(buf):
+            if marker == 0xDA:
+                return offset + length
+        return None
+    return -1
+
+
+def metadata_read_target(buf):
+    """流式读取时决定还要读多少: 返回元数据前缀的长度 (已经读够), None (继续读前缀), -1 (需要完整文件)
+
+    前缀里发现 C2PA 清单时也需要完整文件, 因为 C2PA 校验要用到全部内容。
+    ImageSource.from_stream 和 aigc_async 的 HTTP Range 读取共用这套判断。
+    """
+    end = metadata_prefix_end(buf)
+    if end is None or (end >= 0 and len(buf) < end):
+        return None
+    if end < 0:
+        return -1
+    prefix = buf[:end]
+    header = sniff_image_header(prefix)
+    if header is None or has_c2pa_manifest(prefix, header[0]):
+        return -1
+    return end
+
+
+def iter_tiff_ifd(buf, offset):
+    """遍历 TIFF/EXIF 块中位于 offset 的 IFD, 产出 (tag, 值)
+
+    buf 是以 TIFF 头 (II*\\0 / MM\\0*) 开始的字节块; ASCII 值转成 str, BYTE / UNDEFINED 数组保留 bytes,
+    分数转成 float, 多个数值返回 tuple。
+    """
+    endian = '<' if buf[:2] == b'II' else '>'
+    count = struct.unpack_from(endian + 'H', buf, offset)[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, typ, n = struct.unpack_from(endian + 'HHI', buf, entry)
+        if typ not in TIFF_TYPES:
+            continue
+        fmt, unit = TIFF_TYPES[typ]
+        nbytes = unit * n
+        pos = entry + 8 if nbytes <= 4 else struct.unpack_from(endian + 'I', buf, entry + 8)[0]
+        raw = buf[pos:pos + nbytes]
+        if len(raw) < nbytes:
+            continue
+        if typ == 2:
+            value = raw.split(b'\x00', 1)[0].decode('utf-8', errors='replace')
+        elif typ == 7 or (typ == 1 and n > 1):
+            value = bytes(raw)
+        else:
+            values = struct.unpack(endian + fmt * n, raw)
+            if typ in (5, 10):
+                values = tuple(a / b if b else 0.0 for a, b in zip(values[::2], values[1::2]))
+            value = values[0] if n == 1 else values
+        yield tag, value
+
+
+XMP_JPEG_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+XMP_PNG_KEYWORD = b'XML:com.adobe.xmp'
+XMP_SCAN_LIMIT = 1024 * 1024  # 容器里找不到时, 回退扫描文件头/尾各 1 MB
+
+
+def _xmp_from_jpeg(buf):
+    """在 APP1 (Adobe XMP 命名空间) 段中找 XMP"""
+    for marker, offset, length in iter_jpeg_segments(buf):
+        if marker == 0xE1 and buf[offset:offset + len(XMP_JPEG_HEADER)] == XMP_JPEG_HEADER:
+            return buf[offset + len(XMP_JPEG_HEADER):offset + length]
+    return None
+
+
+def decode_itxt(data):
+    """解析 iTXt chunk 数据, 返回 (关键字, 文本); 支持压缩的 iTXt"""
+    return decode_png_text_chunk(b'iTXt', data)
+
+
+def _xmp_from_png(buf):
+    for chunk_type, offset, length in iter_png_chunk_headers(buf):
+        if chunk_type == 'iTXt' and buf[offset:offset + len(XMP_PNG_KEYWORD) + 1] == XMP_PNG_KEYWORD + b'\x00':
+            _key, text = decode_itxt(buf[offset:offset + length])
+            return text.encode('utf-8')
+    return None
+
+
+def _xmp_from_webp(buf):
+    for fourcc, offset, length in iter_riff_chunks(buf):
+        if fourcc == 'XMP ':
+            return buf[offset:offset + length]
+    return None
+
+
+def _xmp_from_tiff(buf):
+    """在 TIFF IFD0 中找 XMLPacket (tag 700)"""
+    endian = '<' if buf[:2] == b'II' else '>'
+    for tag, value in iter_tiff_ifd(buf, struct.unpack_from(endian + 'I', buf, 4)[0]):
+        if tag == TIFF_XMP_TAG:
+            return value if isinstance(value, bytes) else None
+    return None
+
+
+def _scan_xmp(buf, limit):
+    """回退方案: 只在文件头/尾各 limit 字节内查找 XMP 标记"""
+    size = len(buf)
+    windows = [(0, min(size, limit))]
+    if size > limit:
+        windows.append((max(limit, size - limit), size))
+
+    xmp_start_markers = [b'<?xpacket', b'<x:xmpmeta', b'<rdf:RDF']
+    xmp_end_markers = [b'<?xpacket end', b'</x:xmpmeta>', b'</rdf:RDF>']
+    for lo, hi in windows:
+        for start_marker, end_marker in zip(xmp_start_markers, xmp_end_markers):
+            start_idx = buf.find(start_marker, lo, hi)
+            if start_idx != -1:
+                end_idx = buf.find(end_marker, start_idx, hi)
+                if end_idx != -1:
+                    return buf[start_idx:end_idx + len(end_marker) + 20]
+    return None
+
+
+def find_xmp_packet(buf, scan_limit=XMP_SCAN_LIMIT):
+    """按容器格式在元数据段中定位 XMP (JPEG APP1 / PNG iTXt / WebP XMP / TIFF tag 700)
+
+    buf 可以是 bytes 或 mmap; 只切出 XMP 所在的那一段, 不会把整个文件读进内存。
+    """
+    packet = None
+    try:
+        if buf[:2] == b'\xff\xd8':
+            packet = _xmp_from_jpeg(buf)
+        elif buf[:8] == PNG_SIGNATURE:
+            packet = _xmp_from_png(buf)
+        elif buf[:4] == b'RIFF' and buf[8:12] == b'WEBP':
+            packet = _xmp_from_webp(buf)
+        elif buf[:4] in (b'II*\x00', b'MM\x00*'):
+            packet = _xmp_from_tiff(buf)
+    except (struct.error, ValueError, IndexError, zlib.error):
+        packet = None
+    if packet is None:
+        packet = _scan_xmp(buf, scan_limit)
+    return packet
+
+
 def extract_xmp(filepath):
-    """从图片文件中提取 XMP 元数据"""
+    """从图片 (路径 / ImageSource / bytes / 文件对象) 中提取 XMP 元数据"""
     xmp_data = None
     
     try:
-        with open(filepath, 'rb') as f:
-            content = f.read()
-        
-        # 查找 XMP 数据块
-        xmp_start_markers = [b'<?xpacket', b'<x:xmpmeta', b'<rdf:RDF']
-        xmp_end_markers = [b'<?xpacket end', b'</x:xmpmeta>', b'</rdf:RDF>']
-        
-        for start_marker, end_marker in zip(xmp_start_markers, xmp_end_markers):
-            start_idx = content.find(start_marker)
-            if start_idx != -1:
-                end_idx = content.find(end_marker, start_idx)
-                if end_idx != -1:
-                    xmp_data = content[start_idx:end_idx + len(end_marker) + 20]
-                    try:
-                        xmp_data = xmp_data.decode('utf-8', errors='ignore')
-                    except:
-                        pass
-                    break
+        with open_source(filepath) as source:
+            packet = find_xmp_packet(source.data)
+        if packet:
+            xmp_data = packet.decode('utf-8', errors='ignore')
     except Exception as e:
         pass
     
     return xmp_data
 
 
+# 中国 AIGC 国家标准 XMP 字段; 所有正则在导入时编译一次
+AIGC_XMP_FIELDS = ('Label', 'ContentProducer', 'ProduceID', 'Propagator', 'PropatorID',
+                   'ReserveCode1', 'ReserveCode2')
+AIGC_FIELD_KEYS = [(name, name.lower().encode('ascii')) for name in AIGC_XMP_FIELDS]
+AIGC_JSON_RE = re.compile(r'"AIGC"\s*:\s*(\{[^}]+\})')
+CONTENT_PRODUCER_RE = re.compile(r'ContentProducer["\s:]+([^",}\s]+)')
+
+
+def _find_xml_field(raw, lowered, key):
+    """找第一个标签内含 key 的 XML 标签, 返回紧跟其后的文本
+
+    等价于忽略大小写的 <[^>]*key[^>]*>([^<]+)<, 但只用 bytes.find / rfind 定位:
+    对 ASCII 小写化后的字节串做子串查找, 比在整个 XMP 上跑正则回溯快一个数量级。
+    """
+    pos = lowered.find(key)
+    while pos != -1:
+        tag_start = lowered.rfind(b'<', 0, pos)
+        if tag_start != -1 and lowered.find(b'>', tag_start, pos) == -1:
+            tag_end = lowered.find(b'>', pos + len(key))
+            if tag_end == -1:
+                return None
+            text_end = lowered.find(b'<', tag_end + 1)
+            if text_end == -1:
+                return None
+            if text_end > tag_end + 1:
+                return raw[tag_end + 1:text_end].decode('utf-8', errors='replace')
+        pos = lowered.find(key, pos + 1)
+    return None
+
+
 def parse_aigc_from_xmp(xmp_string):
     """从 XMP 字符串中解析 AIGC 字段（中国国家标准）"""
     aigc_info = {}
@@ -125,8 +600,7 @@ def parse_aigc_from_xmp(xmp_string):
         return aigc_info
     
     # 方法1: 直接用正则匹配 AIGC 相关字段
-    aigc_pattern = r'"AIGC"\s*:\s*(\{[^}]+\})'
-    match = re.search(aigc_pattern, xmp_string)
+    match = AIGC_JSON_RE.search(xmp_string)
     if match:
         try:
             aigc_info = json.loads(match.group(1))
@@ -134,195 +608,803 @@ def parse_aigc_from_xmp(xmp_string):
         except:
             pass
     
-    # 方法2: 匹配 XML 格式的 AIGC 标签
-    patterns = {
-        'Label': r'<[^>]*:?Label[^>]*>([^<]+)<',
-        'ContentProducer': r'<[^>]*:?ContentProducer[^>]*>([^<]+)<',
-        'ProduceID': r'<[^>]*:?ProduceID[^>]*>([^<]+)<',
-        'Propagator': r'<[^>]*:?Propagator[^>]*>([^<]+)<',
-        'PropatorID': r'<[^>]*:?PropatorID[^>]*>([^<]+)<',
-        'ReserveCode1': r'<[^>]*:?ReserveCode1[^>]*>([^<]+)<',
-        'ReserveCode2': r'<[^>]*:?ReserveCode2[^>]*>([^<]+)<',
-    }
-    
-    for key, pattern in patterns.items():
-        match = re.search(pattern, xmp_string, re.IGNORECASE)
-        if match:
-            aigc_info[key] = match.group(1)
+    # 方法2: 匹配 XML 格式的 AIGC 标签 (编码一次、小写化一次, 之后全是子串查找)
+    raw = xmp_string.encode('utf-8', errors='surrogatepass')
+    lowered = raw.lower()
+    for name, key in AIGC_FIELD_KEYS:
+        value = _find_xml_field(raw, lowered, key)
+        if value is not None:
+            aigc_info[name] = value
     
     # 方法3: 检查是否包含 AIGC 相关关键词
     if not aigc_info:
         if 'AIGC' in xmp_string or 'aigc' in xmp_string:
             aigc_info['raw_aigc_detected'] = True
             if 'ContentProducer' in xmp_string:
-                cp_match = re.search(r'ContentProducer["\s:]+([^",}\s]+)', xmp_string)
+                cp_match = CONTENT_PRODUCER_RE.search(xmp_string)
                 if cp_match:
                     aigc_info['ContentProducer'] = cp_match.group(1)
     
     return {"AIGC": aigc_info} if aigc_info else {}
 
 
-def read_png_chunks(filepath):
-    """读取 PNG 文件的所有 chunks"""
+PNG_TEXT_CHUNK_TYPES = (b'tEXt', b'iTXt', b'zTXt')
+
+
+def split_png_text_chunk(chunk_type, data):
+    """拆分 tEXt / zTXt / iTXt chunk, 返回 (关键字, 值字节, 是否 zlib 压缩, 文本编码); 值既不解压也不解码"""
+    if chunk_type == b'iTXt':
+        keyword, rest = data.split(b'\x00', 1)
+        compressed, rest = rest[0], rest[2:]
+        _lang, _translated, text = rest.split(b'\x00', 2)
+        return keyword.decode('latin-1'), text, bool(compressed), 'utf-8'
+    null_idx = data.index(b'\x00')
+    key = data[:null_idx].decode('latin-1')
+    if chunk_type == b'zTXt':
+        # 关键字后 1 字节是压缩方法 (只定义了 0 = zlib)
+        return key, data[null_idx + 2:], True, 'latin-1'
+    return key, data[null_idx + 1:], False, 'latin-1'
+
+
+def decode_png_text_chunk(chunk_type, data):
+    """解码 tEXt / zTXt / iTXt chunk, 返回 (关键字, 文本)"""
+    key, value, compressed, encoding = split_png_text_chunk(chunk_type, data)
+    if compressed:
+        value = zlib.decompress(value)
+    return key, value.decode(encoding, errors='replace')
+
+
+class LazyText:
+    """大文本 chunk 的延迟解码视图 (ComfyUI workflow / prompt 可达数 MB)
+
+    只保存 chunk 里的原始字节 (zTXt / 压缩 iTXt 保持压缩状态), 调用方真正用到时才解压、解码。
+    limit 是解码后字节数上限, 超出部分丢弃; 输出 JSON 时被截断的值写成
+    {"truncated": true, "bytes": 完整字节数 (最多统计到 TEXT_SIZE_SCAN_LIMIT), "head": 前 limit 字节的文本}。
+    """
+
+    __slots__ = ('raw', 'compressed', 'encoding', 'limit')
+
+    def __init__(self, raw, compressed=False, encoding='latin-1', limit=None):
+        self.raw = raw
+        self.compressed = compressed
+        self.encoding = encoding
+        self.limit = limit
+
+    def _iter_raw(self, chunk_size):
+        if not self.compressed:
+            for pos in range(0, len(self.raw), chunk_size):
+                yield self.raw[pos:pos + chunk_size]
+            return
+        decompressor = zlib.decompressobj()
+        pending = self.raw
+        try:
+            while True:
+                out = decompressor.decompress(pending, chunk_size)
+                pending = decompressor.unconsumed_tail
+                if not out:
+                    return
+                yield out
+        except zlib.error:
+            return  # 与 errors='replace' 一致: 损坏的数据尽量输出已解出的部分
+
+    def iter_bytes(self, chunk_size=STREAM_READ_CHUNK):
+        """逐块产出解压后的字节, 最多 limit 字节"""
+        remaining = self.limit
+        for block in self._iter_raw(chunk_size):
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                block = block[:remaining]
+                remaining -= len(block)
+            yield block
+
+    def iter_text(self, chunk_size=STREAM_READ_CHUNK):
+        """逐块产出解码后的文本, 多字节字符跨块时由增量解码器拼接"""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        for block in self.iter_bytes(chunk_size):
+            text = decoder.decode(block)
+            if text:
+                yield text
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+    def size(self, stop_at=None):
+        """解码前的完整字节数 (忽略 limit); 压缩数据需要完整解压一遍才能知道, 但不占内存
+
+        stop_at: 数到超过这个值就停止 (解压炸弹可以膨胀上千倍, 没必要全部解完)。
+        """
+        if not self.compressed:
+            return len(self.raw)
+        total = 0
+        for block in LazyText(self.raw, True)._iter_raw(STREAM_READ_CHUNK):
+            total += len(block)
+            if stop_at is not None and total > stop_at:
+                break
+        return total
+
+    @property
+    def truncated(self):
+        return self.limit is not None and self.size(stop_at=self.limit) > self.limit
+
+    def text(self):
+        return ''.join(self.iter_text())
+
+    def preview(self, chars):
+        """只解码开头足够多的字节, 返回前 chars 个字符"""
+        parts = []
+        count = 0
+        for text in self.iter_text(chunk_size=max(chars * 4, 256)):
+            parts.append(text)
+            count += len(text)
+            if count >= chars:
+                break
+        return ''.join(parts)[:chars]
+
+    def json(self):
+        return json.loads(self.text())
+
+    def to_json_value(self):
+        if self.truncated:
+            # 超过 TEXT_SIZE_SCAN_LIMIT 时 bytes 只是下限
+            return {"truncated": True, "bytes": self.size(stop_at=TEXT_SIZE_SCAN_LIMIT), "head": self.text()}
+        return self.text()
+
+    def iter_json(self):
+        """逐块产出该值的 JSON 编码, 不在内存里拼出完整字符串"""
+        if self.limit is not None:
+            # 有上限时内容最多 limit 字节, 先判断是否截断再决定输出字符串还是截断对象
+            yield json.dumps(self.to_json_value(), ensure_ascii=False)
+            return
+        yield '"'
+        for text in self.iter_text():
+            yield json.encoder.encode_basestring(text)[1:-1]
+        yield '"'
+
+    def __str__(self):
+        return self.text()
+
+    def __repr__(self):
+        return f"<LazyText {len(self.raw)} bytes{' zlib' if self.compressed else ''}>"
+
+
+def read_png_chunks(filepath, metadata_only=False, lazy_bytes=None, max_bytes=None):
+    """读取 PNG 图片 (路径 / ImageSource / bytes / 文件对象) 的所有文本 chunks
+
+    非文本 chunk (包括 IDAT 像素数据) 直接 seek 跳过, 不读取内容。
+    metadata_only=True 时读到第一个 IDAT 就停止: 文本 chunk 几乎都写在像素数据之前。
+    原始长度超过 lazy_bytes 的值返回 LazyText, 不立即解压解码;
+    设置 max_bytes 时, 可能超过上限的值 (包括所有压缩的值) 也返回带上限的 LazyText。
+    长度不合法 (超过 2^31-1 或超出文件末尾) 的 chunk 视为损坏, 停止解析;
+    未设置 max_bytes 时, 解压 / 解码后超过 TEXT_DEFAULT_LIMIT 的值同样返回带上限的 LazyText (输出为截断标记)。
+    """
     chunks = {}
     try:
-        with open(filepath, 'rb') as f:
+        with open_source(filepath, full=not metadata_only) as source, source.stream() as f:
             # 跳过 PNG 签名 (8 bytes)
-            f.read(8)
+            f.seek(len(PNG_SIGNATURE))
             
             while True:
-                try:
-                    length_data = f.read(4)
-                    if len(length_data) < 4:
-                        break
-                    length = struct.unpack('>I', length_data)[0]
-                    chunk_type = f.read(4).decode('ascii', errors='ignore')
-                    
-                    data = f.read(length)
-                    f.read(4)  # CRC
-                    
-                    if chunk_type in ['tEXt', 'iTXt', 'zTXt']:
-                        try:
-                            if chunk_type == 'tEXt':
-                                null_idx = data.index(b'\x00')
-                                key = data[:null_idx].decode('latin-1')
-                                value = data[null_idx+1:].decode('latin-1', errors='replace')
-                                chunks[key] = value
-                            elif chunk_type == 'iTXt':
-                                parts = data.split(b'\x00', 4)
-                                if len(parts) >= 5:
-                                    key = parts[0].decode('utf-8', errors='replace')
-                                    value = parts[4].decode('utf-8', errors='replace')
-                                    chunks[key] = value
-                        except:
-                            pass
-                            
-                    if chunk_type == 'IEND':
-                        break
-                except:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                length, chunk_type = struct.unpack('>I4s', header)
+                if chunk_type == b'IEND' or (metadata_only and chunk_type == b'IDAT'):
+                    break
+                if length > PNG_MAX_CHUNK_LENGTH:
+                    break
+                
+                if chunk_type not in PNG_TEXT_CHUNK_TYPES:
+                    f.seek(length + 4, io.SEEK_CUR)  # 数据 + CRC
+                    continue
+                
+                data = f.read(length)
+                if len(data) < length:  # 声明的长度超出了文件末尾
                     break
+                f.seek(4, io.SEEK_CUR)  # CRC
+                try:
+                    key, value, compressed, encoding = split_png_text_chunk(chunk_type, data)
+                    if ((lazy_bytes is not None and len(value) > lazy_bytes)
+                            or (max_bytes is not None and (compressed or len(value) > max_bytes))):
+                        chunks[key] = LazyText(value, compressed, encoding, max_bytes)
+                    elif compressed:
+                        decompressor = zlib.decompressobj()
+                        text = decompressor.decompress(value, TEXT_DEFAULT_LIMIT)
+                        if decompressor.unconsumed_tail:
+                            chunks[key] = LazyText(value, compressed, encoding, TEXT_DEFAULT_LIMIT)
+                        elif decompressor.eof:  # 不完整的压缩流与 zlib.decompress 一样丢弃
+                            chunks[key] = text.decode(encoding, errors='replace')
+                    elif len(value) > TEXT_DEFAULT_LIMIT:
+                        chunks[key] = LazyText(value, compressed, encoding, TEXT_DEFAULT_LIMIT)
+                    else:
+                        chunks[key] = value.decode(encoding, errors='replace')
+                except (ValueError, IndexError, zlib.error):
+                    pass
     except:
         pass
     return chunks
 
 
-def detect_aigc_source(filepath):
-    """检测 AIGC 图片的来源和元数据"""
+# ========== fast 模式: 直接从容器头读取尺寸与元数据, 不经过 Pillow ==========
+DETECT_MODES = ("full", "fast")
+IMAGE_MIME_TYPES = {
+    "PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp",
+    "GIF": "image/gif", "TIFF": "image/tiff",
+}
+PNG_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+JPEG_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+EXIF_JPEG_HEADER = b'Exif\x00\x00'
+# 与 PIL.ExifTags.TAGS 同名, 只收录和来源判断相关的常见标签; 其余标签名见 exif_tag_name
+EXIF_TAG_NAMES = {
+    0x010E: "ImageDescription", 0x010F: "Make", 0x0110: "Model", 0x0112: "Orientation",
+    0x011A: "XResolution", 0x011B: "YResolution", 0x0128: "ResolutionUnit",
+    0x0131: "Software", 0x0132: "DateTime", 0x013B: "Artist", 0x013C: "HostComputer",
+    0x8298: "Copyright", 0x8769: "ExifOffset", 0x8825: "GPSInfo",
+    0x9000: "ExifVersion", 0x9003: "DateTimeOriginal", 0x9004: "DateTimeDigitized",
+    0x927C: "MakerNote", 0x9286: "UserComment", 0x9C9B: "XPTitle", 0x9C9C: "XPComment",
+    0x9C9D: "XPAuthor", 0xA001: "ColorSpace", 0xA002: "ExifImageWidth",
+    0xA003: "ExifImageHeight", 0xA420: "ImageUniqueID",
+}
+
+
+def _png_header(buf):
+    width, height, bit_depth, color_type = struct.unpack_from('>IIBB', buf, 16)
+    mode = PNG_MODES.get(color_type)
+    if color_type == 0 and bit_depth == 1:
+        mode = "1"
+    elif color_type == 0 and bit_depth == 16:
+        mode = "I;16"
+    return width, height, mode
+
+
+def _jpeg_header(buf):
+    for marker, offset, _length in iter_jpeg_segments(buf):
+        if marker in JPEG_SOF_MARKERS:
+            height, width, components = struct.unpack_from('>HHB', buf, offset + 1)
+            return width, height, JPEG_MODES.get(components)
+    return None
+
+
+def _webp_header(buf):
+    fourcc = buf[12:16]
+    if fourcc == b'VP8X':
+        flags = buf[20]
+        width = int.from_bytes(buf[24:27], 'little') + 1
+        height = int.from_bytes(buf[27:30], 'little') + 1
+        return width, height, "RGBA" if flags & 0x10 else "RGB"
+    if fourcc == b'VP8 ':
+        width, height = struct.unpack_from('<HH', buf, 26)
+        return width & 0x3FFF, height & 0x3FFF, "RGB"
+    if fourcc == b'VP8L':
+        bits = struct.unpack_from('<I', buf, 21)[0]
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        return width, height, "RGBA" if bits >> 28 & 1 else "RGB"
+    return None
+
+
+def _tiff_header(buf):
+    endian = '<' if buf[:2] == b'II' else '>'
+    tags = dict(iter_tiff_ifd(buf, struct.unpack_from(endian + 'I', buf, 4)[0]))
+    if 256 not in tags or 257 not in tags:
+        return None
+    # PhotometricInterpretation (262) + SamplesPerPixel (277) 推断模式, 只覆盖常见组合
+    photometric, samples = tags.get(262), tags.get(277, 1)
+    bits = tags.get(258, 8)
+    bits = bits[0] if isinstance(bits, tuple) else bits
+    if photometric in (0, 1):
+        mode = "1" if bits == 1 else "L"
+    elif photometric == 2:
+        mode = {3: "RGB", 4: "RGBA"}.get(samples)
+    else:
+        mode = {3: "P", 5: "CMYK"}.get(photometric)
+    return tags[256], tags[257], mode
+
+
+def sniff_image_header(buf):
+    """根据魔数识别格式并从容器头读出尺寸 / 模式, 返回 (格式, 宽, 高, 模式); 无法识别返回 None
+
+    支持 PNG (IHDR)、JPEG (SOFn)、WebP (VP8X/VP8/VP8L)、GIF 与 TIFF (IFD0)。
+    """
+    try:
+        if buf[:8] == PNG_SIGNATURE:
+            fmt, header = "PNG", _png_header(buf)
+        elif buf[:2] == b'\xff\xd8':
+            fmt, header = "JPEG", _jpeg_header(buf)
+        elif buf[:4] == b'RIFF' and buf[8:12] == b'WEBP':
+            fmt, header = "WEBP", _webp_header(buf)
+        elif buf[:6] in (b'GIF87a', b'GIF89a'):
+            fmt, header = "GIF", struct.unpack_from('<HH', buf, 6) + ("P",)
+        elif buf[:4] in (b'II*\x00', b'MM\x00*'):
+            fmt, header = "TIFF", _tiff_header(buf)
+        else:
+            return None
+    except (struct.error, IndexError):
+        return None
+    if header is None:
+        return None
+    return (fmt,) + tuple(header)
+
+
+def find_exif_block(buf, fmt):
+    """定位 EXIF 数据 (以 TIFF 头开始的字节块): JPEG APP1 'Exif', PNG eXIf, WebP EXIF chunk"""
+    if fmt == "JPEG":
+        for marker, offset, length in iter_jpeg_segments(buf):
+            if marker == 0xE1 and buf[offset:offset + 6] == EXIF_JPEG_HEADER:
+                return buf[offset + 6:offset + length]
+    elif fmt == "PNG":
+        for chunk_type, offset, length in iter_png_chunk_headers(buf):
+            if chunk_type == 'eXIf':
+                return buf[offset:offset + length]
+            if chunk_type == 'IDAT':
+                break
+    elif fmt == "WEBP":
+        for fourcc, offset, length in iter_riff_chunks(buf):
+            if fourcc == 'EXIF':
+                block = buf[offset:offset + length]
+                return block[6:] if block.startswith(EXIF_JPEG_HEADER) else block
+    return None
+
+
+_pillow_exif_tags = None
+
+
+def exif_tag_name(tag):
+    """EXIF 标签名, 与 PIL.ExifTags.TAGS 一致
+
+    常用标签查 EXIF_TAG_NAMES; 表里没有的才导入 PIL.ExifTags (约 10ms), 没有 Pillow 时用数字。
+    """
+    global _pillow_exif_tags
+    name = EXIF_TAG_NAMES.get(tag)
+    if name is not None:
+        return name
+    if _pillow_exif_tags is None:
+        try:
+            from PIL.ExifTags import TAGS
+        except ImportError:
+            TAGS = {}
+        _pillow_exif_tags = TAGS
+    return _pillow_exif_tags.get(tag, str(tag))
+
+
+def read_exif_fast(buf, fmt):
+    """不依赖 Pillow 读取 EXIF (IFD0 + Exif 子 IFD), 键名与 PIL.ExifTags.TAGS 一致"""
+    exif = {}
+    try:
+        block = find_exif_block(buf, fmt)
+        if not block or block[:4] not in (b'II*\x00', b'MM\x00*'):
+            return exif
+        endian = '<' if block[:2] == b'II' else '>'
+        ifd0 = dict(iter_tiff_ifd(block, struct.unpack_from(endian + 'I', block, 4)[0]))
+        if EXIF_IFD_POINTER in ifd0:
+            ifd0.update(iter_tiff_ifd(block, ifd0[EXIF_IFD_POINTER]))
+        for tag, value in ifd0.items():
+            exif[exif_tag_name(tag)] = value
+    except (struct.error, IndexError, ValueError):
+        pass
+    return exif
+
+
+def has_c2pa_manifest(buf, fmt):
+    """检查容器里是否嵌有 C2PA 清单 (JUMBF): JPEG APP11 / PNG caBX / WebP C2PA
+
+    其他格式无法快速判断, 返回 True 交给 c2pa 库处理。
+    """
+    if fmt == "JPEG":
+        return any(marker == 0xEB and b'c2pa' in buf[offset:offset + length]
+                   for marker, offset, length in iter_jpeg_segments(buf))
+    if fmt == "PNG":
+        return any(chunk_type == 'caBX' for chunk_type, _offset, _length in iter_png_chunk_headers(buf))
+    if fmt == "WEBP":
+        return any(fourcc == 'C2PA' for fourcc, _offset, _length in iter_riff_chunks(buf))
+    return True
+
+
+def has_xmp_packet(buf, fmt):
+    """检查容器里是否嵌有 XMP: JPEG APP1 (Adobe XMP 命名空间) / PNG iTXt XML:com.adobe.xmp / WebP XMP
+
+    只看段头, 不解码内容; 其他格式 (TIFF 等) 返回 True 交给 find_xmp_packet。
+    JPEG / PNG / WebP 的 XMP 不在标准位置时不再回退扫描文件头尾。
+    """
+    if fmt == "JPEG":
+        return any(marker == 0xE1 and buf[offset:offset + len(XMP_JPEG_HEADER)] == XMP_JPEG_HEADER
+                   for marker, offset, length in iter_jpeg_segments(buf))
+    if fmt == "PNG":
+        keyword = XMP_PNG_KEYWORD + b'\x00'
+        return any(chunk_type == 'iTXt' and buf[offset:offset + len(keyword)] == keyword
+                   for chunk_type, offset, _length in iter_png_chunk_headers(buf))
+    if fmt == "WEBP":
+        return any(fourcc == 'XMP ' for fourcc, _offset, _length in iter_riff_chunks(buf))
+    return True
+
+
+# ========== 分阶段耗时 (可选) ==========
+_NO_STAGE = nullcontext()
+
+
+class StageProfile:
+    """一次检测的分阶段耗时 (毫秒) 和读取字节数, 用于定位慢文件卡在 Pillow / C2PA / XMP / EXIF 的哪一步
+
+    未开启时 stage() 返回共享的空上下文, 不调用计时器, 默认路径几乎没有额外开销。
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages_ms = {}
+        self.start = time.perf_counter() if enabled else None
+
+    def stage(self, name):
+        return self._timed(name) if self.enabled else _NO_STAGE
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, ms):
+        self.stages_ms[name] = self.stages_ms.get(name, 0.0) + ms
+
+    def to_dict(self, source=None):
+        """bytes_read: 读进内存 / 映射的字节数 (mmap 时是文件大小, 实际读取量取决于访问到的页);
+        bytes_streamed: Pillow / c2pa 通过流读走的字节数; prefix_only: 只读取了元数据前缀"""
+        profile = {
+            "total_ms": (time.perf_counter() - self.start) * 1000,
+            "stages_ms": dict(self.stages_ms),
+        }
+        if source is not None:
+            profile["bytes_read"] = len(source.data)
+            profile["bytes_streamed"] = source.bytes_streamed()
+            profile["prefix_only"] = not source.complete
+        return profile
+
+
+NO_PROFILE = StageProfile(enabled=False)
+
+
+# ========== 检测器注册表 ==========
+class Detector:
+    """来源检测器: 声明开销、结论优先级和需要的容器格式, 由 run_detectors 统一调度
+
+    cost 越小越先执行; priority 越小结论越权威 (对应原来 if/elif 的先后顺序)。
+    probe() 是廉价的预检 (只看容器结构), 返回 False 时跳过 run()。
+    collects_metadata=True 的检测器负责写入 results["metadata"], 开销很小, 得出结论后也照常执行。
+    run() 可以往 ctx.results 写入元数据, 返回 None 或结论字典 ({"source": ..., 其他要写入结果的字段})。
+    """
+
+    name = None
+    cost = 0
+    priority = 0
+    formats = None  # 只处理这些格式, None 表示所有格式
+    collects_metadata = False
+
+    def applies(self, ctx):
+        return self.formats is None or ctx.image_format in self.formats
+
+    def probe(self, ctx):
+        return True
+
+    def run(self, ctx):
+        return None
+
+
+class DetectionContext:
+    """一次检测中各检测器共享的状态"""
+
+    def __init__(self, source, img, image_format, mime_type, results, scan_after_idat=False,
+                 lazy_text_bytes=None, max_text_bytes=None, profile=NO_PROFILE):
+        self.source = source
+        self.img = img  # full 模式下的 PIL Image, fast 模式为 None
+        self.image_format = image_format
+        self.mime_type = mime_type
+        self.results = results
+        self.scan_after_idat = scan_after_idat
+        self.lazy_text_bytes = lazy_text_bytes
+        self.max_text_bytes = max_text_bytes
+        self.profile = profile  # StageProfile, 检测器用 ctx.profile.stage(...) 记录内部各步骤
+
+
+DETECTORS = []
+# 每个检测器在本进程内的累计统计: 调用次数 / 得出结论次数 / 被跳过次数 (提前结束或预检未通过) / 累计耗时
+DETECTOR_STATS = {}
+
+
+def register_detector(detector_cls):
+    """注册检测器类 (可作装饰器使用); 同名检测器会被替换"""
+    detector = detector_cls()
+    DETECTORS[:] = [d for d in DETECTORS if d.name != detector.name]
+    DETECTORS.append(detector)
+    return detector_cls
+
+
+def detector_stats():
+    """返回各检测器的累计统计, 用于按实际流量调整 cost"""
+    stats = {}
+    for name, s in DETECTOR_STATS.items():
+        stats[name] = {**s, "mean_ms": s["total_ms"] / s["calls"] if s["calls"] else 0.0}
+    return stats
+
+
+def run_detectors(ctx, exhaustive=False, detectors=None):
+    """按 cost 从低到高执行检测器, 返回 {检测器名: 耗时毫秒}
+
+    已经得出结论后, 优先级不高于该结论的检测器直接跳过 (提前结束), 但 collects_metadata 的检测器
+    (EXIF 等) 照常执行, metadata 与不提前结束时一致; 只有更权威、且 probe() 表明确实可能命中的检测器
+    还会执行, 最终采用优先级最高的结论。
+    exhaustive=True 时所有检测器都执行, 被跳过的 C2PA / XMP 信息也会写入结果。
+    """
+    timings = {}
+    best_priority, best = None, None
+    for detector in sorted(detectors or DETECTORS, key=lambda d: d.cost):
+        if not detector.applies(ctx):
+            continue
+        stats = DETECTOR_STATS.setdefault(detector.name, {"calls": 0, "hits": 0, "skipped": 0, "total_ms": 0.0})
+        if (not exhaustive and best is not None and detector.priority >= best_priority
+                and not detector.collects_metadata or not detector.probe(ctx)):
+            stats["skipped"] += 1
+            continue
+        start = time.perf_counter()
+        verdict = detector.run(ctx)
+        elapsed = (time.perf_counter() - start) * 1000
+        timings[detector.name] = elapsed
+        if ctx.profile.enabled:
+            ctx.profile.add(f"detector:{detector.name}", elapsed)
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed
+        if verdict:
+            stats["hits"] += 1
+            if best is None or detector.priority < best_priority:
+                best_priority, best = detector.priority, verdict
+    if best:
+        ctx.results.update(best)
+    return timings
+
+
+@register_detector
+class C2PADetector(Detector):
+    """C2PA 认证 (国际标准): 调用 c2pa 库, 开销最大, 结论最权威"""
+
+    name = "c2pa"
+    cost = 100
+    priority = 0
+
+    def probe(self, ctx):
+        return has_c2pa_manifest(ctx.source.data, ctx.image_format)
+
+    def run(self, ctx):
+        with ctx.profile.stage("c2pa:read"):
+            c2pa_raw = read_c2pa_metadata(ctx.source, ctx.mime_type)
+        if not c2pa_raw:
+            return None
+        ctx.results["c2pa_raw"] = c2pa_raw
+        with ctx.profile.stage("c2pa:parse"):
+            ctx.results["c2pa"] = parse_c2pa_info(c2pa_raw)
+        if not ctx.results["c2pa"]:
+            return None
+        
+        # 根据 C2PA 内容确定来源
+        generator = ctx.results["c2pa"].get("生成器", "")
+        issuer = ctx.results["c2pa"].get("签名者", "")
+        if "Google" in generator or "Google" in issuer:
+            return {"source": "Google AI (Gemini/Imagen)"}
+        elif "Adobe" in generator or "Adobe" in issuer:
+            return {"source": "Adobe 产品"}
+        elif "Microsoft" in generator or "Microsoft" in issuer:
+            return {"source": "Microsoft AI"}
+        return {"source": f"C2PA 认证 ({issuer})"}
+
+
+@register_detector
+class XMPDetector(Detector):
+    """中国 AIGC 国家标准 (XMP)"""
+
+    name = "xmp"
+    cost = 20
+    priority = 10
+
+    def probe(self, ctx):
+        return has_xmp_packet(ctx.source.data, ctx.image_format)
+
+    def run(self, ctx):
+        with ctx.profile.stage("xmp:extract"):
+            xmp_data = extract_xmp(ctx.source)
+        if xmp_data:
+            with ctx.profile.stage("xmp:parse"):
+                aigc_info = parse_aigc_from_xmp(xmp_data)
+            if aigc_info and aigc_info.get("AIGC"):
+                return {"source": "符合中国 AIGC 国家标准", "aigc_standard": aigc_info["AIGC"]}
+        return None
+
+
+def classify_aigc_producer(aigc_data):
+    """根据 AIGC 字段的 ContentProducer 确定来源"""
+    producer = aigc_data.get("ContentProducer", "").lower()
+    if producer == "doubao":
+        return "豆包 AI (字节跳动)"
+    elif producer == "wenxin" or "baidu" in producer:
+        return "百度文心一格"
+    elif producer == "tongyi" or "aliyun" in producer or "alibaba" in producer:
+        return "阿里通义万相"
+    elif producer == "midjourney":
+        return "Midjourney"
+    elif producer:
+        return f"AIGC ({producer})"
+    return "符合中国 AIGC 国家标准"
+
+
+@register_detector
+class PNGTextDetector(Detector):
+    """PNG 文本 chunk (Stable Diffusion, ComfyUI, NovelAI, AIGC 字段等): 只走 chunk 头, 最便宜"""
+
+    name = "png_text"
+    cost = 1
+    priority = 20
+    formats = ("PNG",)
+    collects_metadata = True
+
+    def run(self, ctx):
+        metadata = ctx.results["metadata"]
+        for key, value in (ctx.img.info if ctx.img is not None else {}).items():
+            if isinstance(value, (str, bytes)):
+                metadata[key] = value if isinstance(value, str) else value.decode('utf-8', errors='replace')
+        
+        with ctx.profile.stage("png_text:chunks"):
+            metadata.update(read_png_chunks(ctx.source, metadata_only=not ctx.scan_after_idat,
+                                            lazy_bytes=ctx.lazy_text_bytes, max_bytes=ctx.max_text_bytes))
+        # Pillow 把 XMP 的 iTXt 另外放在 info["xmp"]; fast 模式没有 img.info, 用 chunk 里的 XMP 补上同名键
+        if ctx.img is None and XMP_PNG_KEYWORD.decode() in metadata:
+            metadata.setdefault("xmp", metadata[XMP_PNG_KEYWORD.decode()])
+        
+        # 检查 PNG 元数据中的 AIGC 字段 (中国国家标准); 值可能是 LazyText, 用到时再 str()
+        if "AIGC" in metadata:
+            try:
+                aigc_data = json.loads(str(metadata["AIGC"]))
+                return {"source": classify_aigc_producer(aigc_data), "aigc_standard": aigc_data}
+            except:
+                pass
+        
+        if "parameters" in metadata:
+            return {"source": "Stable Diffusion (A1111/Forge)"}
+        elif "prompt" in metadata:
+            if "workflow" in metadata:
+                return {"source": "ComfyUI"}
+            return {"source": "Stable Diffusion 变体"}
+        elif "Comment" in metadata:
+            comment = str(metadata["Comment"])
+            if "novelai" in comment.lower() or "nai" in comment.lower():
+                return {"source": "NovelAI"}
+            return {"source": "带 Comment 的 PNG"}
+        elif "Software" in metadata:
+            return {"source": f"软件: {metadata['Software']}"}
+        return None
+
+
+@register_detector
+class EXIFDetector(Detector):
+    """EXIF (JPEG 等): 元数据写入结果, 只有 UserComment 才算弱结论"""
+
+    name = "exif"
+    cost = 5
+    priority = 30
+    collects_metadata = True
+
+    def run(self, ctx):
+        with ctx.profile.stage("exif:parse"):
+            exif = self.read_exif(ctx)
+        if not exif:
+            return None
+        metadata = ctx.results["metadata"]
+        for tag_name, value in exif.items():
+            if isinstance(value, bytes):
+                try:
+                    value = value.decode('utf-8', errors='replace')
+                except:
+                    value = str(value)
+            metadata[str(tag_name)] = value
+        
+        if "UserComment" in metadata:
+            return {"source": "带 EXIF UserComment 的图片"}
+        return None
+
+    @staticmethod
+    def read_exif(ctx):
+        img = ctx.img
+        # 只有前缀时不能走 Pillow: PNG 的 _getexif 会加载整张像素数据; 像素数过大的图片同理 (解压炸弹)
+        if (img is None or not ctx.source.complete
+                or ctx.image_format != "JPEG" and img.width * img.height > EXIF_PILLOW_MAX_PIXELS):
+            return read_exif_fast(ctx.source.data, ctx.image_format)
+        if hasattr(img, '_getexif') and img._getexif():
+            from PIL.ExifTags import TAGS
+            return {TAGS.get(tag_id, tag_id): value for tag_id, value in img._getexif().items()}
+        return None
+
+
+def detect_aigc_source(filepath, scan_after_idat=False, mode="full", exhaustive=False,
+                       lazy_text_bytes=None, max_text_bytes=None, structured=False, profile=False,
+                       max_file_bytes=None):
+    """检测 AIGC 图片的来源和元数据
+
+    filepath 可以是路径 / ImageSource / bytes / memoryview / 文件对象; 文件内容只读取一次, 各检测步骤共享,
+    文件对象只读取元数据所在的前缀。
+    scan_after_idat=True 时继续查找像素数据之后的 PNG 文本 chunk (少见, 默认不扫)。
+    mode="fast" 时只解析容器头, 不导入也不调用 Pillow, C2PA 库只在确实嵌有清单时才调用;
+    容器头无法识别的格式自动退回 full 模式。fast 模式的 metadata 与 full 模式的差别: PNG 不带
+    Pillow img.info 里的二进制块 (exif / icc_profile 等, full 模式下是按 UTF-8 硬解的原始字节),
+    EXIF 只读 IFD0 和 Exif 子 IFD (没有 GPS 等子 IFD 的展开内容); 标签名和 PNG 的 xmp 键与 full 模式一致。
+    来源判断由注册的检测器按开销从低到高执行, 得出结论后跳过不可能推翻它的检测器; PNG 文本 / EXIF 等
+    元数据 (metadata) 总是完整收集, 跳过的只是 C2PA / XMP 这类结论检测, 此时 c2pa / c2pa_raw /
+    aigc_standard 可能为空, 即使文件里有 (例如 PNG 文本已判定为 ComfyUI 时不再解析 XMP)。
+    exhaustive=True 时执行全部检测器, 结果字段最完整。各检测器耗时记录在 detector_ms 中。
+    lazy_text_bytes / max_text_bytes 控制大 PNG 文本 chunk (ComfyUI workflow 等) 的延迟解码与大小上限,
+    见 read_png_chunks 和 LazyText。
+    structured=True 时把 A1111 / ComfyUI / NovelAI 的生成参数解析成结构化字段, 放在 generation 中。
+    profile=True 时在 profile 中记录各阶段耗时 (打开 / 解析容器头 / 各检测器及其内部步骤) 和读取的字节数,
+    见 StageProfile。
+    max_file_bytes 是单个文件的字节预算, 见 open_source; 超出时结果里带 error。
+    """
     results = {
         "source": "未知",
         "metadata": {},
         "basic_info": {},
         "aigc_standard": None,  # 中国 AIGC 国家标准信息
         "c2pa": None,  # C2PA 认证信息
-        "c2pa_raw": None  # C2PA 原始数据
+        "c2pa_raw": None,  # C2PA 原始数据
+        "detector_ms": {}  # 各检测器耗时 (毫秒)
     }
     
+    stages = StageProfile() if profile else NO_PROFILE
     try:
-        img = Image.open(filepath)
-        
-        # 基本信息
-        results["basic_info"] = {
-            "格式": img.format,
-            "尺寸": f"{img.size[0]} x {img.size[1]}",
-            "模式": img.mode
-        }
-        
-        # ========== 优先检查: C2PA 认证 (国际标准) ==========
-        c2pa_raw = read_c2pa_metadata(filepath)
-        if c2pa_raw:
-            results["c2pa_raw"] = c2pa_raw
-            results["c2pa"] = parse_c2pa_info(c2pa_raw)
-            
-            # 根据 C2PA 内容确定来源
-            if results["c2pa"]:
-                generator = results["c2pa"].get("生成器", "")
-                issuer = results["c2pa"].get("签名者", "")
-                
-                if "Google" in generator or "Google" in issuer:
-                    results["source"] = "Google AI (Gemini/Imagen)"
-                elif "Adobe" in generator or "Adobe" in issuer:
-                    results["source"] = "Adobe 产品"
-                elif "Microsoft" in generator or "Microsoft" in issuer:
-                    results["source"] = "Microsoft AI"
-                else:
-                    results["source"] = f"C2PA 认证 ({issuer})"
-        
-        # ========== 检查: 中国 AIGC 国家标准 (XMP) ==========
-        if results["source"] == "未知":
-            xmp_data = extract_xmp(filepath)
-            if xmp_data:
-                aigc_info = parse_aigc_from_xmp(xmp_data)
-                if aigc_info and aigc_info.get("AIGC"):
-                    results["aigc_standard"] = aigc_info["AIGC"]
-                    results["source"] = "符合中国 AIGC 国家标准"
-        
-        # ========== 检查 PNG 元数据 (Stable Diffusion, ComfyUI, NovelAI 等) ==========
-        if img.format == 'PNG':
-            for key, value in img.info.items():
-                if isinstance(value, (str, bytes)):
-                    results["metadata"][key] = value if isinstance(value, str) else value.decode('utf-8', errors='replace')
-            
-            png_chunks = read_png_chunks(filepath)
-            results["metadata"].update(png_chunks)
-            
-            # 检查 PNG 元数据中的 AIGC 字段 (中国国家标准)
-            if "AIGC" in results["metadata"] and results["source"] == "未知":
+        with open_source(filepath, full=scan_after_idat, max_bytes=max_file_bytes) as source:
+            if profile:
+                # 从开始到拿到 ImageSource: mmap / 读取文件对象前缀
+                stages.add("open", (time.perf_counter() - stages.start) * 1000)
+            with stages.stage("header"):
+                header = sniff_image_header(source.data) if mode == "fast" else None
+            img = None
+            if not header:
                 try:
-                    aigc_str = results["metadata"]["AIGC"]
-                    aigc_data = json.loads(aigc_str)
-                    results["aigc_standard"] = aigc_data
-                    
-                    # 根据 ContentProducer 确定来源
-                    producer = aigc_data.get("ContentProducer", "").lower()
-                    if producer == "doubao":
-                        results["source"] = "豆包 AI (字节跳动)"
-                    elif producer == "wenxin" or "baidu" in producer:
-                        results["source"] = "百度文心一格"
-                    elif producer == "tongyi" or "aliyun" in producer or "alibaba" in producer:
-                        results["source"] = "阿里通义万相"
-                    elif producer == "midjourney":
-                        results["source"] = "Midjourney"
-                    elif producer:
-                        results["source"] = f"AIGC ({producer})"
-                    else:
-                        results["source"] = "符合中国 AIGC 国家标准"
-                except:
-                    pass
-            
-            if results["source"] == "未知":
-                if "parameters" in results["metadata"]:
-                    results["source"] = "Stable Diffusion (A1111/Forge)"
-                elif "prompt" in results["metadata"]:
-                    if "workflow" in results["metadata"]:
-                        results["source"] = "ComfyUI"
-                    else:
-                        results["source"] = "Stable Diffusion 变体"
-                elif "Comment" in results["metadata"]:
-                    comment = results["metadata"]["Comment"]
-                    if "novelai" in comment.lower() or "nai" in comment.lower():
-                        results["source"] = "NovelAI"
-                    else:
-                        results["source"] = "带 Comment 的 PNG"
-                elif "Software" in results["metadata"]:
-                    results["source"] = f"软件: {results['metadata']['Software']}"
+                    # 首次调用时包含导入 Pillow 的耗时
+                    with stages.stage("pil_open"):
+                        from PIL import Image
+                        img = Image.open(source.stream())
+                except (ValueError, OSError, SyntaxError):
+                    # Pillow 拒绝解压超过 MAX_TEXT_CHUNK 的文本 chunk (大型 ComfyUI workflow),
+                    # 或者 chunk 长度不合法 (截断 / 恶意构造), 退回容器头解析
+                    header = sniff_image_header(source.data)
+                    if not header:
+                        raise
+            if header:
+                image_format, width, height, image_mode = header
+                mime_type = IMAGE_MIME_TYPES.get(image_format)
+            else:
+                image_format, (width, height), image_mode = img.format, img.size, img.mode
+                mime_type = Image.MIME.get(img.format)
         
-        # ========== 检查 EXIF (JPEG 等) ==========
-        if hasattr(img, '_getexif') and img._getexif():
-            exif = img._getexif()
-            for tag_id, value in exif.items():
-                tag_name = TAGS.get(tag_id, tag_id)
-                if isinstance(value, bytes):
-                    try:
-                        value = value.decode('utf-8', errors='replace')
-                    except:
-                        value = str(value)
-                results["metadata"][str(tag_name)] = value
-            
-            if "UserComment" in results["metadata"] and results["source"] == "未知":
-                results["source"] = "带 EXIF UserComment 的图片"
+            # 基本信息
+            results["basic_info"] = {
+                "格式": image_format,
+                "尺寸": f"{width} x {height}",
+                "模式": image_mode
+            }
+        
+            ctx = DetectionContext(source, img, image_format, mime_type, results, scan_after_idat,
+                                   lazy_text_bytes, max_text_bytes, stages)
+            results["detector_ms"] = run_detectors(ctx, exhaustive)
+            if structured:
+                with stages.stage("structured"):
+                    results["generation"] = extract_generation_info(results)
+            if profile:
+                results["profile"] = stages.to_dict(source)
         
+    except DetectTimeout:
+        raise  # 由 _detect_worker 统一处理, 超时的结果不能进缓存
     except Exception as e:
         results["error"] = str(e)
+        if profile:
+            results["profile"] = stages.to_dict()
     
     return results
 
@@ -398,14 +1480,16 @@ def print_results(results):
         print("-" * 70)
     
     # ========== 其他元数据 ==========
-    # 过滤掉已经在 C2PA 中显示的信息
-    other_metadata = {k: v for k, v in results.get("metadata", {}).items() 
-                      if k not in ["C2PA", "XMP"]}
+    # 过滤掉已经在 C2PA 中显示的信息; 直接遍历, 不复制大字段
+    other_keys = [k for k in results.get("metadata", {}) if k not in ["C2PA", "XMP"]]
     
-    if other_metadata:
+    if other_keys:
         print("\n📝 其他元数据:")
-        for key, value in other_metadata.items():
-            if isinstance(value, str) and len(value) > 200:
+        for key in other_keys:
+            value = results["metadata"][key]
+            if isinstance(value, LazyText):
+                display_value = value.preview(200) + f"... [延迟解码, {len(value.raw)} 字节]"
+            elif isinstance(value, str) and len(value) > 200:
                 display_value = value[:200] + "... [已截断]"
             else:
                 display_value = value
@@ -423,43 +1507,1416 @@ def print_results(results):
     if results.get("error"):
         print(f"\n⚠️ 错误: {results['error']}")
     
+    # ========== 分阶段耗时 (--profile) ==========
+    if results.get("profile"):
+        profile = results["profile"]
+        print(f"\n⏱️ 分阶段耗时 (共 {profile['total_ms']:.2f} ms):")
+        for stage, ms in sorted(profile["stages_ms"].items(), key=lambda item: -item[1]):
+            print(f"   {stage}: {ms:.2f} ms")
+        if "bytes_read" in profile:
+            prefix = ", 只读取元数据前缀" if profile["prefix_only"] else ""
+            print(f"   读取 {profile['bytes_read']} 字节, 经流读取 {profile['bytes_streamed']} 字节{prefix}")
+    
     # C2PA 库状态
-    if not C2PA_AVAILABLE:
+    if not c2pa_available():
         print("\n💡 提示: 安装 c2pa-python 可获取更详细的 C2PA 信息")
         print("   pip install c2pa-python")
     
     print("\n" + "=" * 70)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("=" * 50)
-        print("🔍 AIGC 图片元数据检测工具")
-        print("=" * 50)
-        print("\n使用方法: python aigc_metadata.py <图片路径>")
-        print("\n示例:")
-        print("  python aigc_metadata.py image.png")
-        print("  python aigc_metadata.py ~/Downloads/ai_image.jpg")
-        print("\n支持检测:")
-        print("  ✅ C2PA 认证 (Google Gemini, Adobe, Microsoft)")
-        print("  ✅ 中国 AIGC 国家标准")
-        print("  ✅ Stable Diffusion / ComfyUI / NovelAI")
-        print("  ✅ 通用 EXIF/XMP 元数据")
-        sys.exit(1)
+# ========== 生成参数解析 (A1111 / ComfyUI / NovelAI -> 结构化字段) ==========
+# A1111 最后一行 "Steps: 20, Sampler: Euler a, CFG scale: 7, ..."; 值可以是带逗号的双引号字符串
+A1111_PARAM_RE = re.compile(r'\s*(\w[\w \-/]+):\s*("(?:\\.|[^\\"])+"|[^,]*)(?:,|$)')
+A1111_FIELDS = {
+    "Steps": ("steps", int),
+    "Sampler": ("sampler", str),
+    "Schedule type": ("scheduler", str),
+    "CFG scale": ("cfg_scale", float),
+    "Seed": ("seed", int),
+    "Size": ("size", str),
+    "Model hash": ("model_hash", str),
+    "Model": ("model", str),
+    "Denoising strength": ("denoising_strength", float),
+    "Clip skip": ("clip_skip", int),
+}
+COMFYUI_SAMPLER_FIELDS = {
+    "seed": ("seed", int), "noise_seed": ("seed", int), "steps": ("steps", int), "cfg": ("cfg_scale", float),
+    "sampler_name": ("sampler", str), "scheduler": ("scheduler", str),
+}
+COMFYUI_CHECKPOINT_INPUTS = ("ckpt_name", "unet_name")
+
+
+def _convert(value, typ):
+    """按字段类型转换, 转换失败返回 None (生成器写出的格式并不总是规范)"""
+    try:
+        return typ(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_a1111_parameters(text):
+    """解析 A1111 / Forge 的 parameters 文本: 正向提示词、反向提示词和最后一行的生成设置
+
+    已知字段转换成对应类型 (steps / seed 为 int, cfg_scale 为 float), 其余设置原样放在 extra 中。
+    """
+    lines = str(text).strip().split("\n")
+    settings = []
+    if lines and len(A1111_PARAM_RE.findall(lines[-1])) >= 3:
+        settings = A1111_PARAM_RE.findall(lines.pop())
     
-    image_path = sys.argv[1]
+    prompt_lines, negative_lines = [], []
+    for line in lines:
+        if line.startswith("Negative prompt:"):
+            negative_lines.append(line[len("Negative prompt:"):].strip())
+        elif negative_lines:
+            negative_lines.append(line)
+        else:
+            prompt_lines.append(line)
     
+    info = {"generator": "a1111", "prompt": "\n".join(prompt_lines).strip(),
+            "negative_prompt": "\n".join(negative_lines).strip(), "extra": {}}
+    for key, value in settings:
+        value = value.strip()
+        if value.startswith('"') and value.endswith('"'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if key in A1111_FIELDS:
+            name, typ = A1111_FIELDS[key]
+            info[name] = _convert(value, typ)
+        else:
+            info["extra"][key] = value
+    return info
+
+
+def parse_comfyui_graph(prompt, workflow=None):
+    """解析 ComfyUI 的 prompt (API 格式节点图), 提取节点类型、checkpoint、LoRA 和采样参数
+
+    正向 / 反向提示词沿 KSampler 的 positive / negative 连线找到对应的文本编码节点。
+    prompt 无法解析时退回 workflow (界面格式), 只能得到节点类型。
+    """
+    info = {"generator": "comfyui", "node_types": [], "node_count": 0, "checkpoints": [], "loras": []}
+    try:
+        graph = json.loads(str(prompt)) if prompt is not None else None
+    except ValueError:
+        graph = None
+    
+    if not isinstance(graph, dict):
+        try:
+            nodes = json.loads(str(workflow)).get("nodes", []) if workflow is not None else []
+            types = [node.get("type") for node in nodes if isinstance(node, dict)]
+        except (ValueError, AttributeError):
+            types = []
+        info["node_types"] = sorted({t for t in types if isinstance(t, str)})
+        info["node_count"] = len(types)
+        return info
+    
+    nodes = {node_id: node for node_id, node in graph.items() if isinstance(node, dict)}
+    info["node_count"] = len(nodes)
+    info["node_types"] = sorted({node.get("class_type") for node in nodes.values()
+                                 if isinstance(node.get("class_type"), str)})
+    sampler = None
+    for node in nodes.values():
+        inputs = node.get("inputs") or {}
+        for key in COMFYUI_CHECKPOINT_INPUTS:
+            if isinstance(inputs.get(key), str) and inputs[key] not in info["checkpoints"]:
+                info["checkpoints"].append(inputs[key])
+        if isinstance(inputs.get("lora_name"), str) and inputs["lora_name"] not in info["loras"]:
+            info["loras"].append(inputs["lora_name"])
+        if sampler is None and "sampler_name" in inputs:
+            sampler = inputs
+    
+    if sampler:
+        for key, (name, typ) in COMFYUI_SAMPLER_FIELDS.items():
+            # 连线输入是 [节点 id, 输出序号], 不是字面值
+            if key in sampler and not isinstance(sampler[key], list):
+                info[name] = _convert(sampler[key], typ)
+        for key, name in (("positive", "prompt"), ("negative", "negative_prompt")):
+            link = sampler.get(key)
+            if isinstance(link, list) and link:
+                text = (nodes.get(str(link[0])) or {}).get("inputs", {}).get("text")
+                if isinstance(text, str):
+                    info[name] = text
+    if info["checkpoints"]:
+        info["model"] = info["checkpoints"][0]
+    return info
+
+
+def parse_novelai_comment(comment):
+    """解析 NovelAI 写在 Comment chunk 里的 JSON 生成参数"""
+    try:
+        data = json.loads(str(comment))
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    return {
+        "generator": "novelai",
+        "prompt": data.get("prompt"),
+        "negative_prompt": data.get("uc"),
+        "steps": _convert(data.get("steps"), int),
+        "sampler": data.get("sampler"),
+        "cfg_scale": _convert(data.get("scale"), float),
+        "seed": _convert(data.get("seed"), int),
+    }
+
+
+def extract_generation_info(results):
+    """根据检测结果里的元数据解析生成参数, 没有可解析的参数时返回 None"""
+    metadata = results.get("metadata") or {}
+    if "parameters" in metadata:
+        return parse_a1111_parameters(metadata["parameters"])
+    if "prompt" in metadata or "workflow" in metadata:
+        return parse_comfyui_graph(metadata.get("prompt"), metadata.get("workflow"))
+    if "Comment" in metadata:
+        return parse_novelai_comment(metadata["Comment"])
+    return None
+
+
+# ========== 结果缓存 (内容哈希 -> 检测结果 JSON) ==========
+def content_hash(buf):
+    """对整个文件内容做 BLAKE2b-128 (比 SHA-256 快, 对 mmap 直接按页计算不拷贝)"""
+    import hashlib
+    return hashlib.blake2b(buf, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """持久化在 SQLite 里的检测结果缓存
+
+    键 = 内容哈希 + 检测器版本 + 检测选项, 值 = to_json_output 后的 JSON。
+    转发/CDN 重复图片只需算一次哈希就能直接返回, 不再重复校验 C2PA 签名。
+    按结果 JSON 的总字节数做 LRU 淘汰; 多个进程可以共用同一个数据库文件 (WAL)。
+    """
+
+    # 命中时只有距离上次访问超过这么多秒才回写 last_access, 省掉大部分写事务
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        import sqlite3
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)")
+        self.conn.commit()
+        self.total_bytes = self._sum_bytes()
+
+    @staticmethod
+    def make_key(digest, **detect_options):
+        options = ",".join(f"{k}={v}" for k, v in sorted(detect_options.items()) if k not in PROFILE_ONLY_OPTIONS)
+        return f"{digest}:{DETECTOR_VERSION}:{options}"
+
+    def _sum_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def get(self, key):
+        row = self.conn.execute("SELECT value, last_access FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time.time()
+        if now - row[1] > self.TOUCH_INTERVAL:
+            with alarm_deferred():
+                self.conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+                self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, results):
+        value = json.dumps(results, ensure_ascii=False, default=json_default)
+        size = len(value.encode('utf-8'))
+        # 检测超时 (time_limit) 不能打断写事务, 否则连接会一直持有未提交的事务
+        with alarm_deferred():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self.conn.commit()
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """淘汰最久未访问的条目, 直到总大小降到上限的 90%"""
+        self.total_bytes = self._sum_bytes()  # 其他进程也可能写入过, 先校正
+        target = self.max_bytes * 0.9
+        while self.total_bytes > target:
+            rows = self.conn.execute(
+                "SELECT key, size FROM results ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= target:
+                    break
+        self.conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        entries = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.total_bytes,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def detect_aigc_source_cached(filepath, cache, **detect_options):
+    """带缓存的检测: 命中时直接返回缓存的 JSON 输出, 未命中时检测并写入缓存
+
+    返回值与 to_json_output(detect_aigc_source(...)) 相同, 额外带 "cached" 字段。
+    profile 不参与缓存键, 也不写入缓存; 开启时命中的结果只带哈希和查询的耗时。
+    """
+    stages = StageProfile() if detect_options.get("profile") else NO_PROFILE
+    with open_source(filepath, full=detect_options.get("scan_after_idat", False),
+                     max_bytes=detect_options.get("max_file_bytes")) as source:
+        with stages.stage("cache:hash"):
+            key = ResultCache.make_key(content_hash(source.data), **detect_options)
+        with stages.stage("cache:lookup"):
+            results = cache.get(key)
+        if results is not None:
+            if stages.enabled:
+                results["profile"] = stages.to_dict(source)
+            return {**results, "cached": True}
+        results = to_json_output(detect_aigc_source(source, **detect_options))
+    profile = results.pop("profile", None)
+    cache.put(key, results)
+    if profile is not None:
+        profile["stages_ms"].update(stages.stages_ms)
+        profile["total_ms"] += sum(stages.stages_ms.values())
+        results["profile"] = profile
+    return {**results, "cached": False}
+
+
+# ========== 感知哈希去重 (剥离元数据的副本继承来源结论) ==========
+PHASH_THUMB_SIZE = 32  # DCT 输入: 32x32 灰度缩略图
+PHASH_LOW_FREQ = 8  # 取左上 8x8 低频系数, 得到 64 位哈希
+PHASH_MAX_DISTANCE = 6  # 默认海明距离阈值: 64 位里最多这么多位不同视为同一张图
+PHASH_BATCH_SIZE = 256  # 攒满这么多张缩略图做一次向量化 DCT
+
+_dct_matrices = {}
+
+
+def _load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("感知哈希去重需要 numpy: pip install numpy")
+    return numpy
+
+
+def phash_thumbnail(source, size=PHASH_THUMB_SIZE):
+    """把图片解码成 size x size 的灰度缩略图 (原始字节), 供 phash_batch 计算哈希
+
+    JPEG 用 draft 模式在解码时直接按 1/2~1/8 缩小, 省掉大部分解码开销; 其他格式需要完整解码。
+    只有元数据前缀的 source 没有像素数据, 返回 None; 无法解码的图片同样返回 None。
+    """
+    if not source.complete:
+        return None
+    from PIL import Image
+    try:
+        with Image.open(source.stream()) as img:
+            img.draft("L", (size, size))
+            return img.convert("L").resize((size, size), Image.Resampling.BOX, reducing_gap=2.0).tobytes()
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        return None
+
+
+def _dct_matrix(n):
+    """n 点正交 DCT-II 矩阵 (只取前 PHASH_LOW_FREQ 行, 低频以外的系数用不到)"""
+    matrix = _dct_matrices.get(n)
+    if matrix is None:
+        np = _load_numpy()
+        k = np.arange(PHASH_LOW_FREQ)[:, None]
+        i = np.arange(n)[None, :]
+        matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+        matrix[0] /= np.sqrt(2)
+        matrix = _dct_matrices[n] = matrix.astype(np.float32)
+    return matrix
+
+
+def phash_batch(thumbnails, size=PHASH_THUMB_SIZE):
+    """一批缩略图 -> 64 位感知哈希 (Python int 列表)
+
+    标准 pHash: 二维 DCT 取左上 8x8 低频系数, 大于中位数 (不含直流分量) 的位记 1。
+    整批缩略图叠成 (N, size, size) 数组, 两次矩阵乘法算完所有图片的低频系数, 没有逐张循环。
+    """
+    np = _load_numpy()
+    pixels = np.frombuffer(b"".join(thumbnails), dtype=np.uint8).reshape(-1, size, size).astype(np.float32)
+    dct = _dct_matrix(size)
+    coeffs = (dct @ pixels @ dct.T).reshape(len(thumbnails), -1)
+    median = np.median(coeffs[:, 1:], axis=1, keepdims=True)
+    packed = np.packbits(coeffs > median, axis=1).view(">u8").ravel()
+    return [int(h) for h in packed]
+
+
+def perceptual_hash(filepath):
+    """单张图片 (路径 / ImageSource / bytes) 的感知哈希, 16 位十六进制字符串; 无法解码时返回 None"""
+    with open_source(filepath, full=True) as source:
+        thumbnail = phash_thumbnail(source)
+    if thumbnail is None:
+        return None
+    return f"{phash_batch([thumbnail])[0]:016x}"
+
+
+class PhashIndex:
+    """64 位感知哈希的近似重复索引 (多索引哈希表, multi-index hashing)
+
+    哈希切成 BLOCKS 段 16 位, 每段各建一张 段值 -> 条目 的表。海明距离 <= max_distance 的两个哈希,
+    至少有一段的距离 <= max_distance // BLOCKS (抽屉原理), 所以只需在每张表里查这个半径内的段值,
+    候选再用完整距离核对; 查询开销与索引大小基本无关。
+    """
+
+    BLOCKS = 4
+    BLOCK_BITS = 16
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE):
+        import itertools
+
+        self.max_distance = max_distance
+        self.entries = []  # [(hash, payload)]
+        self.tables = [{} for _ in range(self.BLOCKS)]
+        radius = max_distance // self.BLOCKS
+        # 每段需要探查的异或掩码: 翻转 0..radius 个位
+        self.probes = [sum(1 << bit for bit in bits)
+                       for r in range(radius + 1)
+                       for bits in itertools.combinations(range(self.BLOCK_BITS), r)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _blocks(self, h):
+        mask = (1 << self.BLOCK_BITS) - 1
+        return [(h >> (i * self.BLOCK_BITS)) & mask for i in range(self.BLOCKS)]
+
+    def add(self, h, payload):
+        entry_id = len(self.entries)
+        self.entries.append((h, payload))
+        for table, block in zip(self.tables, self._blocks(h)):
+            table.setdefault(block, []).append(entry_id)
+
+    def query(self, h):
+        """返回距离最近的 (海明距离, payload), 没有 max_distance 以内的条目时返回 None"""
+        best = None
+        seen = set()
+        for table, block in zip(self.tables, self._blocks(h)):
+            for probe in self.probes:
+                for entry_id in table.get(block ^ probe, ()):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    distance = (self.entries[entry_id][0] ^ h).bit_count()
+                    if distance <= self.max_distance and (best is None or distance < best[0]):
+                        best = (distance, self.entries[entry_id][1])
+        return best
+
+
+class PhashDeduper:
+    """批量模式的感知哈希阶段: 没有检测到来源的图片 (元数据被剥离的转发 / 重新编码副本),
+    到已扫描过、有来源结论的图片里找近似重复, 找到时继承其结论
+
+    结果先攒成一批再统一计算哈希; 同一批里先登记有结论的图片再查询, 原图和副本的完成顺序不影响匹配。
+    只能继承之前 (或同一批里) 扫描到的原图, 原图在后面的批次里出现时不会回头修改已输出的副本。
+    """
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, batch_size=PHASH_BATCH_SIZE):
+        self.index = PhashIndex(max_distance)
+        self.batch_size = batch_size
+        self.pending = []
+        self.hashed = 0
+        self.inherited = 0
+
+    def add(self, result):
+        """放入一个带 thumbnail 的结果, 返回可以输出的结果列表 (攒满一批前为空)"""
+        self.pending.append(result)
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        batch, self.pending = self.pending, []
+        hashed = []
+        to_hash = []
+        thumbnails = []
+        for result in batch:
+            thumbnail = result.pop("thumbnail", None)
+            if thumbnail is not None:
+                to_hash.append(result)
+                thumbnails.append(thumbnail)
+            elif result.get("phash"):  # 增量清单里没有变化的文件, 沿用上次算好的哈希
+                hashed.append(result)
+        if thumbnails:
+            for result, h in zip(to_hash, phash_batch(thumbnails)):
+                result["phash"] = f"{h:016x}"
+            hashed += to_hash
+            self.hashed += len(thumbnails)
+
+        for result in hashed:
+            if result["source"] != "未知" and not result.get("inherited_from"):
+                self.index.add(int(result["phash"], 16), {"path": result["path"], "source": result["source"]})
+        for result in hashed:
+            if result["source"] == "未知" and not result.get("error"):
+                match = self.index.query(int(result["phash"], 16))
+                if match:
+                    distance, original = match
+                    result["source"] = original["source"]
+                    result["inherited_from"] = {"path": original["path"], "distance": distance}
+                    self.inherited += 1
+        return batch
+
+
+# ========== 批量扫描 (目录 / glob / stdin 列表) ==========
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".gif", ".bmp", ".heic", ".avif"}
+
+
+def iter_image_paths(sources):
+    """把命令行输入展开成图片路径: 目录递归扫描, glob 通配, '-' 表示从 stdin 逐行读取路径"""
+    import glob
+
+    for source in sources:
+        if source == "-":
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
+                    yield line
+        elif os.path.isdir(source):
+            for root, _dirs, files in os.walk(source):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES:
+                        yield os.path.join(root, name)
+        elif glob.has_magic(source):
+            for path in sorted(glob.iglob(source, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+        else:
+            yield source
+
+
+def json_default(obj):
+    """json.dumps 的 default: LazyText 按上限输出, 其他非标准类型 (EXIF 分数等) 转成字符串"""
+    if isinstance(obj, LazyText):
+        return obj.to_json_value()
+    return str(obj)
+
+
+def iter_json_fragments(value):
+    """与 json.dumps(value, ensure_ascii=False, default=json_default) 输出相同, 但逐块产出
+
+    LazyText 值边解压边编码, 写出一个结果时不需要在内存里拼出完整的 JSON 字符串。
+    """
+    if isinstance(value, LazyText):
+        yield from value.iter_json()
+    elif isinstance(value, dict):
+        yield '{'
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                yield ', '
+            key = key if isinstance(key, str) else json.dumps(key)
+            yield json.encoder.encode_basestring(key)
+            yield ': '
+            yield from iter_json_fragments(item)
+        yield '}'
+    elif isinstance(value, (list, tuple)):
+        yield '['
+        for i, item in enumerate(value):
+            if i:
+                yield ', '
+            yield from iter_json_fragments(item)
+        yield ']'
+    else:
+        yield json.dumps(value, ensure_ascii=False, default=json_default)
+
+
+def write_json_line(result, out):
+    """以 JSON Lines 格式流式写出一个结果"""
+    for fragment in iter_json_fragments(result):
+        out.write(fragment)
+    out.write("\n")
+
+
+def to_json_output(results):
+    """转换成可序列化的输出 (移除原始 C2PA 数据和检测器耗时以减少输出)"""
+    return {k: v for k, v in results.items() if k not in ("c2pa_raw", "detector_ms")}
+
+
+class ProfileMetrics:
+    """汇总各结果的 profile, 输出 Prometheus 文本格式的计数器, 并记录最慢的几个文件
+
+    批量模式写成 node_exporter textfile collector 可读的文件, 常驻服务通过 /metrics/prometheus 暴露。
+    """
+
+    def __init__(self, slowest=10):
+        self.files = 0
+        self.errors = 0
+        self.cached = 0
+        self.bytes_read = 0
+        self.bytes_streamed = 0
+        self.total_ms = 0.0
+        self.stage_ms = {}
+        self.stage_calls = {}
+        self.slowest_limit = slowest
+        self.slowest = []  # 小顶堆: (total_ms, 序号, path, 最耗时的阶段)
+
+    def observe(self, result):
+        import heapq
+
+        self.files += 1
+        if result.get("error"):
+            self.errors += 1
+        if result.get("cached"):
+            self.cached += 1
+        profile = result.get("profile")
+        if not profile:
+            return
+        self.total_ms += profile["total_ms"]
+        self.bytes_read += profile.get("bytes_read", 0)
+        self.bytes_streamed += profile.get("bytes_streamed", 0)
+        for stage, ms in profile["stages_ms"].items():
+            self.stage_ms[stage] = self.stage_ms.get(stage, 0.0) + ms
+            self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+        # detector:* 是其内部步骤的总和, 找最耗时的阶段时只看叶子步骤
+        leaves = {k: v for k, v in profile["stages_ms"].items() if not k.startswith("detector:")}
+        worst = max(leaves, key=leaves.get) if leaves else None
+        entry = (profile["total_ms"], self.files, result.get("path"), worst)
+        if len(self.slowest) < self.slowest_limit:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def slowest_files(self):
+        """[(总耗时毫秒, 路径, 最耗时的阶段)], 从慢到快"""
+        return [(ms, path, stage) for ms, _, path, stage in sorted(self.slowest, reverse=True)]
+
+    def to_prometheus(self, prefix="aigc"):
+        def escape(value):
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = []
+
+        def counter(name, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        counter("files_total", "已检测的文件数", [("", self.files)])
+        counter("errors_total", "检测出错的文件数", [("", self.errors)])
+        counter("cache_hits_total", "结果缓存命中数", [("", self.cached)])
+        counter("bytes_read_total", "读进内存或映射的字节数", [("", self.bytes_read)])
+        counter("bytes_streamed_total", "Pillow / c2pa 通过流读取的字节数", [("", self.bytes_streamed)])
+        counter("detect_seconds_total", "检测总耗时 (秒)", [("", f"{self.total_ms / 1000:.6f}")])
+        counter("stage_seconds_total", "各阶段累计耗时 (秒)",
+                [(f'{{stage="{escape(stage)}"}}', f"{ms / 1000:.6f}") for stage, ms in sorted(self.stage_ms.items())])
+        counter("stage_calls_total", "各阶段执行次数",
+                [(f'{{stage="{escape(stage)}"}}', n) for stage, n in sorted(self.stage_calls.items())])
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """原子写入 (先写临时文件再 rename), 采集方不会读到写了一半的文件"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+@contextmanager
+def time_limit(seconds):
+    """用 SIGALRM 限制一段代码的执行时间, 超时抛出 DetectTimeout
+
+    进程池的任务在子进程的主线程里执行, 可以用信号打断; 在其他线程或没有 setitimer 的平台上不做限制。
+    信号只触发一次: 超时异常被解析代码里的 except 吞掉时, 离开代码块时再抛出。
+    卡在 C 扩展内部 (例如 c2pa 原生库) 时信号打断不了, 由进程池一侧的期限结束子进程 (见 DetectPool)。
+    结果缓存写 SQLite 期间屏蔽 SIGALRM (见 alarm_deferred), 超时不会留下未提交的事务。
+    """
+    import signal
+    import threading
+
+    if not seconds or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    expired = False
+
+    def on_alarm(signum, frame):
+        nonlocal expired
+        expired = True
+        raise DetectTimeout(f"检测超过 {seconds} 秒")
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        except DetectTimeout:
+            pass  # 代码块刚结束时恰好到期; 定时器是一次性的, 不会再触发, 下面统一抛出
+        signal.signal(signal.SIGALRM, previous)
+    if expired:
+        raise DetectTimeout(f"检测超过 {seconds} 秒")
+
+
+@contextmanager
+def alarm_deferred():
+    """在当前线程屏蔽 SIGALRM 执行一段代码, 期间到期的 time_limit 在代码块结束后才抛出超时"""
+    import signal
+
+    if not hasattr(signal, "pthread_sigmask"):
+        yield
+        return
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+_worker_caches = {}
+
+
+def _detect_worker(filepath, detect_options=None, cache_options=None, with_hash=False, timeout=None,
+                   with_thumbnail=False):
+    """进程池中执行的单文件检测 (必须是模块级函数才能被 pickle)
+
+    filepath 也可以是图片字节, 此时结果里的 path 为 None。
+    with_hash=True 时结果里带上 content_hash (增量扫描清单需要), 哈希与检测共用同一次打开的文件。
+    timeout 为单个文件的时间上限 (秒); 超时或超出字节预算 (detect_options 的 max_file_bytes) 的文件
+    只在结果里记录 error, 不影响同一进程接下来的文件。
+    with_thumbnail=True 时结果里带上感知哈希用的灰度缩略图 (thumbnail), 由主进程的 PhashDeduper 成批计算哈希。
+    """
+    detect_options = detect_options or {}
+    cache = None
+    if cache_options:
+        # 每个子进程各自持有一个 SQLite 连接
+        cache = _worker_caches.get(cache_options["path"])
+        if cache is None:
+            cache = _worker_caches[cache_options["path"]] = ResultCache(**cache_options)
+    digest = None
+    thumbnail = None
+    try:
+        with time_limit(timeout), open_source(filepath, full=detect_options.get("scan_after_idat", False),
+                                              max_bytes=detect_options.get("max_file_bytes")) as source:
+            if with_hash:
+                digest = content_hash(source.data)
+            if cache is not None:
+                results = detect_aigc_source_cached(source, cache, **detect_options)
+            else:
+                results = to_json_output(detect_aigc_source(source, **detect_options))
+            if with_thumbnail:
+                start = time.perf_counter()
+                thumbnail = phash_thumbnail(source)
+                if results.get("profile"):
+                    results["profile"]["stages_ms"]["phash:thumbnail"] = (time.perf_counter() - start) * 1000
+    except (OSError, ResourceLimitError) as e:
+        results = {"source": "未知", "error": str(e)}
+    path = str(filepath) if isinstance(filepath, (str, os.PathLike)) else None
+    result = {"path": path, **results}
+    if with_hash:
+        result["content_hash"] = digest
+    if with_thumbnail:
+        result["thumbnail"] = thumbnail
+    return result
+
+
+POOL_DEADLINE_GRACE = 5.0  # 任务超过 timeout 这么多秒仍未返回, 视为卡在原生代码里, 结束检测进程
+
+
+def kill_pool(pool):
+    """强制结束进程池的全部子进程, 回收卡在 C 扩展里、SIGALRM 打断不了的任务
+
+    进程池随之失效, 其他在途任务都会收到 BrokenProcessPool。
+    """
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+_started_queue = None
+
+
+def _init_tracked_worker(started_queue):
+    global _started_queue
+    _started_queue = started_queue
+
+
+def _detect_tracked(task_id, *args):
+    """DetectPool 的任务: 先报告 (任务号, 开始时间) 再检测, 排队时间不算进期限"""
+    _started_queue.put((task_id, time.time()))
+    return _detect_worker(*args)
+
+
+class DetectPool:
+    """scan_batch 用的检测进程池: 子进程报告每个任务真正开始执行的时间, 有任务卡死时整体换新
+
+    每个进程池配一个新的报告队列, 被结束的进程即使正持有队列的锁也不会影响新进程池。
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.restarts = 0
+        self._next_id = 0
+        self._new_pool()
+
+    def _new_pool(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.started = multiprocessing.SimpleQueue()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_tracked_worker,
+                                        initargs=(self.started,))
+
+    def submit(self, *args):
+        """提交 _detect_worker 的参数, 返回 (任务号, future)"""
+        self._next_id += 1
+        return self._next_id, self.pool.submit(_detect_tracked, self._next_id, *args)
+
+    def drain_started(self):
+        while not self.started.empty():
+            yield self.started.get()
+
+    def restart(self, kill=False):
+        if kill:
+            kill_pool(self.pool)
+        else:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+        self._new_pool()
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def scan_batch(paths, workers=None, max_inflight=None, detect_options=None, cache_options=None,
+               precheck=None, with_hash=False, pool=None, timeout=None, with_thumbnail=False):
+    """用进程池并发检测, 按完成顺序逐个产出结果
+
+    max_inflight 限制同时提交到进程池的文件数, 保证路径迭代器很长时内存不会膨胀。
+    detect_options 原样透传给 detect_aigc_source; cache_options 为 ResultCache 的参数。
+    precheck(path) 返回结果时直接产出, 不提交到进程池 (增量扫描跳过没有变化的文件)。
+    传入 pool (DetectPool) 时复用调用方的进程池 (watch 模式), 否则自己创建并在结束时关闭。
+    timeout 为单个文件的检测时间上限 (秒), 子进程里由 time_limit 打断; 开始执行后超过
+    timeout + POOL_DEADLINE_GRACE 秒仍未返回的文件 (卡在原生代码里) 记为超时, 结束全部检测进程,
+    其他在途文件提交到新进程池重新检测。检测进程崩溃时同样换新进程池, 在途文件记为出错。
+    with_thumbnail 见 _detect_worker。
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = workers or os.cpu_count() or 1
+    max_inflight = max(max_inflight or workers * 4, workers)
+    paths = iter(paths)
+    pending = {}
+    started_at = {}
+    ready = []
+
+    def submit(pool, path):
+        task_id, future = pool.submit(path, detect_options, cache_options, with_hash, timeout, with_thumbnail)
+        pending[future] = (task_id, path)
+
+    def submit_until_full(pool):
+        while len(pending) < max_inflight and len(ready) < max_inflight:
+            path = next(paths, None)
+            if path is None:
+                return
+            result = precheck(path) if precheck else None
+            if result is not None:
+                ready.append(result)
+            else:
+                submit(pool, path)
+
+    def kill_stuck(pool):
+        started_at.update(pool.drain_started())
+        now = time.time()
+        stuck = [future for future, (task_id, _path) in pending.items()
+                 if now - started_at.get(task_id, now) > timeout + POOL_DEADLINE_GRACE]
+        if not stuck:
+            return
+        retry = [path for future, (_task_id, path) in pending.items() if future not in stuck]
+        for future in stuck:
+            path = pending[future][1]
+            ready.append({"path": str(path) if isinstance(path, (str, os.PathLike)) else None,
+                          "source": "未知", "error": f"检测超过 {timeout} 秒 (卡在原生代码中, 已结束检测进程)"})
+        pending.clear()
+        started_at.clear()
+        pool.restart(kill=True)
+        print(f"♻️ 有文件检测卡死, 已重建进程池 (第 {pool.restarts} 次)", file=sys.stderr)
+        for path in retry:
+            submit(pool, path)
+
+    def run(pool):
+        submit_until_full(pool)
+        while pending or ready:
+            if ready:
+                batch, ready[:] = list(ready), []
+                yield from batch
+            else:
+                done, _ = wait(pending, timeout=1.0 if timeout else None, return_when=FIRST_COMPLETED)
+                broken = None
+                for future in done:
+                    task_id, path = pending.pop(future)
+                    started_at.pop(task_id, None)
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        # 子进程崩溃等情况, 不影响批次里其他文件
+                        if isinstance(e, BrokenProcessPool):
+                            broken = e
+                        yield {"path": path, "source": "未知", "error": str(e)}
+                if broken:
+                    # 进程池已经不可用: 其余在途文件同样记为出错, 换新进程池继续扫描
+                    for _task_id, path in pending.values():
+                        ready.append({"path": path, "source": "未知", "error": str(broken)})
+                    pending.clear()
+                    started_at.clear()
+                    pool.restart()
+                elif timeout:
+                    kill_stuck(pool)
+            submit_until_full(pool)
+
+    if pool is not None:
+        yield from run(pool)
+        return
+    with DetectPool(workers) as pool:
+        yield from run(pool)
+
+
+# ========== 增量扫描 (清单 + inotify) ==========
+class ScanManifest:
+    """增量扫描清单: 记录每个文件上次扫描时的 (大小, mtime, inode, 内容哈希, 结果)
+
+    (大小, mtime_ns, inode) 与检测选项都没变的文件直接复用上次的结果, 连文件内容都不读;
+    照片库每天变化不到 1% 时, 夜间重扫只需要对变化的文件调用 detect_aigc_source。
+    出错的结果不写入清单, 下次会重试。
+    """
+
+    COMMIT_EVERY = 1000
+    # 选项键的后缀: 结果里带感知哈希 (--phash); 带哈希的记录也可以给不需要哈希的扫描复用, 反过来不行
+    PHASH_SUFFIX = ",phash"
+
+    def __init__(self, path):
+        self.path = str(path)
+        import sqlite3
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                hash TEXT,
+                options TEXT NOT NULL,
+                result TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.unchanged = 0
+        self.updated = 0
+        self._seen = set()
+        self._stats = {}  # 已提交检测的文件 -> 提交前的 stat, 结果回来时写入清单
+        self._uncommitted = 0
+
+    @classmethod
+    def options_key(cls, detect_options, phash=False):
+        key = f"{DETECTOR_VERSION}:" + ",".join(f"{k}={v}" for k, v in sorted((detect_options or {}).items())
+                                                if k not in PROFILE_ONLY_OPTIONS)
+        return key + cls.PHASH_SUFFIX if phash else key
+
+    def check(self, path, options):
+        """文件没有变化时返回上次的结果 (带 unchanged 标记), 否则记下 stat 并返回 None"""
+        key = os.path.abspath(path)
+        self._seen.add(key)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None  # 交给检测进程报告错误
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, options, result FROM files WHERE path = ?", (key,)).fetchone()
+        if (row and row[:3] == (st.st_size, st.st_mtime_ns, st.st_ino)
+                and row[3] in (options, options + self.PHASH_SUFFIX)):
+            self.unchanged += 1
+            return {**json.loads(row[4]), "path": path, "unchanged": True}
+        # stat 取在读取内容之前: 读取期间文件再被修改, 下次扫描时 stat 必然不同
+        self._stats[path] = st
+        return None
+
+    def record(self, result, options):
+        st = self._stats.pop(result.get("path"), None)
+        if st is None or result.get("error"):
+            return
+        value = json.dumps(result, ensure_ascii=False, default=json_default)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, hash, options, result) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(result["path"]), st.st_size, st.st_mtime_ns, st.st_ino,
+             result.get("content_hash"), options, value),
+        )
+        self.updated += 1
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def prune(self, roots):
+        """删除 roots 目录下本次没有见到的文件 (已删除或移走), 返回被删除的路径"""
+        removed = []
+        for root in roots:
+            prefix = os.path.join(os.path.abspath(root), "")
+            # 不用 LIKE: 它对 ASCII 不区分大小写, 还要转义 % / _
+            rows = self.conn.execute("SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+            for (path,) in rows:
+                if path not in self._seen:
+                    removed.append(path)
+        self.conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+        self.conn.commit()
+        return removed
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class InotifyWatcher:
+    """用 inotify 递归监视目录, 返回写完 (IN_CLOSE_WRITE) 或移入 (IN_MOVED_TO) 的图片路径
+
+    通过 ctypes 直接调用 libc, 不需要额外依赖; 仅支持 Linux。
+    新建的子目录会自动加入监视; 事件队列溢出时返回整个目录树, 交给增量清单过滤。
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self, roots):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 失败: {os.strerror(errno)}")
+        self.roots = list(roots)
+        self._dirs = {}
+        for root in self.roots:
+            self.add_tree(root)
+
+    def add_tree(self, root):
+        for dirpath, _dirs, _files in os.walk(root):
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(dirpath), self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+            if wd >= 0:
+                self._dirs[wd] = dirpath
+
+    def read_paths(self, timeout=None):
+        """等待事件 (最多 timeout 秒), 返回这一批新到的图片路径 (去重, 保持顺序)"""
+        import select
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        pos = 0
+        while pos + self.EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = self.EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + self.EVENT_HEADER.size:pos + self.EVENT_HEADER.size + length].rstrip(b'\x00')
+            pos += self.EVENT_HEADER.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                return list(iter_image_paths(self.roots))
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                # 新建 / 移入的目录: 加入监视, 并处理其中已经存在的文件
+                self.add_tree(path)
+                paths.extend(iter_image_paths([path]))
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                if os.path.splitext(name)[1].lower().decode('ascii', errors='ignore') in IMAGE_SUFFIXES:
+                    paths.append(path)
+        return list(dict.fromkeys(paths))
+
+    def close(self):
+        os.close(self.fd)
+
+
+# 列名 -> Arrow 类型; 生成参数之外只保留便于过滤的字段, 原始元数据仍在 JSON Lines 里
+EXPORT_COLUMNS = (
+    ("path", "string"), ("source", "string"), ("format", "string"), ("width", "int32"), ("height", "int32"),
+    ("generator", "string"), ("prompt", "string"), ("negative_prompt", "string"), ("steps", "int32"),
+    ("sampler", "string"), ("scheduler", "string"), ("cfg_scale", "float64"), ("seed", "uint64"),
+    ("model", "string"), ("model_hash", "string"), ("checkpoints", "list<string>"), ("loras", "list<string>"),
+    ("node_types", "list<string>"), ("node_count", "int32"), ("aigc_producer", "string"), ("error", "string"),
+)
+EXPORT_FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow"}
+# 整数列的取值范围, 超出范围的值 (如 A1111 的 -1 种子) 写成空值
+EXPORT_INT_RANGES = {"int32": (-2 ** 31, 2 ** 31 - 1), "uint64": (0, 2 ** 64 - 1)}
+
+
+def export_row(result):
+    """把一个检测结果 (含 generation) 转成 EXPORT_COLUMNS 对应的一行"""
+    generation = result.get("generation") or {}
+    basic_info = result.get("basic_info") or {}
+    width = height = None
+    size = basic_info.get("尺寸")
+    if size:
+        width, _, height = str(size).partition(" x ")
+    aigc = result.get("aigc_standard") or {}
+    row = {
+        "path": result.get("path"),
+        "source": result.get("source"),
+        "format": basic_info.get("格式"),
+        "width": _convert(width, int),
+        "height": _convert(height, int),
+        "aigc_producer": aigc.get("ContentProducer") if isinstance(aigc, dict) else None,
+        "error": result.get("error"),
+    }
+    for name, typ in EXPORT_COLUMNS:
+        if name not in row:
+            value = generation.get(name)
+            row[name] = [str(v) for v in value or []] if typ == "list<string>" else value
+        if typ in EXPORT_INT_RANGES and row[name] is not None:
+            low, high = EXPORT_INT_RANGES[typ]
+            if not isinstance(row[name], int) or not low <= row[name] <= high:
+                row[name] = None
+    return row
+
+
+class ColumnarExporter:
+    """把批量检测结果按列写入 Parquet / Arrow IPC 文件 (需要 pyarrow)
+
+    每攒满 batch_size 行写出一个 record batch, 内存占用只与 batch_size 有关, 百万级文件的扫描也不会膨胀。
+    格式由扩展名决定: .parquet 为 Parquet (zstd 压缩), .arrow / .feather / .ipc 为 Arrow IPC 文件。
+    """
+
+    def __init__(self, path, batch_size=10000):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise RuntimeError("导出列式文件需要 pyarrow: pip install pyarrow")
+        fmt = EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise ValueError(f"不支持的导出格式: {path} (可用扩展名: {', '.join(EXPORT_FORMATS)})")
+        
+        types = {"string": pa.string(), "int32": pa.int32(), "uint64": pa.uint64(), "float64": pa.float64(),
+                 "list<string>": pa.list_(pa.string())}
+        self.pa = pa
+        self.schema = pa.schema([(name, types[typ]) for name, typ in EXPORT_COLUMNS])
+        self.batch_size = batch_size
+        self.rows = 0
+        self._columns = {name: [] for name, _ in EXPORT_COLUMNS}
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def add(self, result):
+        for name, value in export_row(result).items():
+            self._columns[name].append(value)
+        self.rows += 1
+        if len(self._columns["path"]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._columns["path"]:
+            return
+        batch = self.pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        self._writer.write_table(self.pa.Table.from_batches([batch]))
+        self._columns = {name: [] for name, _ in EXPORT_COLUMNS}
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+def run_batch(sources, workers=None, max_inflight=None, out=None, report_interval=5.0,
+              detect_options=None, cache_options=None, export=None, manifest=None, changed_only=False,
+              watch=False, metrics_file=None, timeout=None, phash=None):
+    """批量模式入口: 每完成一个文件输出一行 JSON, 吞吐量统计写到 stderr
+
+    export 为列式文件路径时, 同时把生成参数导出到 Parquet / Arrow IPC (自动开启 structured 解析)。
+    manifest 为增量清单路径时只检测新增或变化的文件, 没变化的文件输出上次的结果 (changed_only=True 时不输出),
+    扫描完成后从清单中清理已删除的文件。
+    watch=True 时扫描完继续用 inotify 监视目录, 新写入的文件立即检测, Ctrl+C 结束。
+    detect_options 开启 profile 时汇总各阶段耗时, 结束时列出最慢的文件;
+    metrics_file 为路径时按 report_interval 把 Prometheus 计数器写到该文件 (自动开启 profile)。
+    timeout 为单个文件的检测时间上限 (秒), 超时的文件记为出错, 不拖住整个批次。
+    phash 为海明距离阈值时计算感知哈希, 没有结论的图片继承近似重复原图的结论 (见 PhashDeduper, 需要 numpy)。
+    """
+    out = out or sys.stdout
+    exporter = None
+    if export:
+        exporter = ColumnarExporter(export)
+        detect_options = {**(detect_options or {}), "structured": True}
+    if metrics_file:
+        detect_options = {**(detect_options or {}), "profile": True}
+    metrics = ProfileMetrics() if (detect_options or {}).get("profile") else None
+    deduper = None
+    if phash is not None:
+        _load_numpy()  # 缺少 numpy 时在扫描开始前就报错
+        deduper = PhashDeduper(phash)
+    scan_manifest = ScanManifest(manifest) if manifest else None
+    options_key = ScanManifest.options_key(detect_options, phash=phash is not None)
+    precheck = (lambda path: scan_manifest.check(path, options_key)) if scan_manifest else None
+    roots = [source for source in sources if source != "-" and os.path.isdir(source)]
+    # 先建立监视再做首次扫描, 扫描期间落地的文件也不会漏掉
+    watcher = InotifyWatcher(roots) if watch else None
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    errors = 0
+    cache_hits = 0
+    removed = []
+    start = time.perf_counter()
+    last_report = start
+
+    def emit(result):
+        if deduper:
+            for ready in deduper.add(result):
+                write(ready)
+        else:
+            write(result)
+
+    def write(result):
+        nonlocal count, errors, cache_hits, last_report
+        if scan_manifest and not result.get("unchanged"):
+            scan_manifest.record(result, options_key)
+        if not (changed_only and result.get("unchanged")):
+            write_json_line(result, out)
+            out.flush()
+        if exporter:
+            exporter.add(result)
+        if metrics:
+            metrics.observe(result)
+        count += 1
+        if result.get("error"):
+            errors += 1
+        if result.get("cached"):
+            cache_hits += 1
+
+        now = time.perf_counter()
+        if now - last_report >= report_interval:
+            print(f"⏳ 已处理 {count} 个文件, {count / (now - start):.1f} 文件/秒", file=sys.stderr)
+            if metrics_file:
+                metrics.write_textfile(metrics_file)
+            last_report = now
+
+    def scan(paths, pool):
+        for result in scan_batch(paths, workers, max_inflight, detect_options, cache_options,
+                                 precheck=precheck, with_hash=scan_manifest is not None, pool=pool,
+                                 timeout=timeout, with_thumbnail=deduper is not None):
+            emit(result)
+        if deduper:
+            for result in deduper.flush():
+                write(result)
+
+    try:
+        with DetectPool(workers) as pool:
+            scan(iter_image_paths(sources), pool)
+            if scan_manifest:
+                removed = scan_manifest.prune(roots)
+            if watcher:
+                import signal
+
+                def stop(signum, frame):
+                    raise KeyboardInterrupt
+
+                # 作为服务运行时 (systemd 等) 用 SIGTERM 停止, 与 Ctrl+C 一样正常收尾
+                signal.signal(signal.SIGTERM, stop)
+                print(f"👀 正在监视 {len(roots)} 个目录, Ctrl+C 结束", file=sys.stderr)
+                try:
+                    while True:
+                        paths = watcher.read_paths(timeout=1.0)
+                        if paths:
+                            scan(paths, pool)
+                except KeyboardInterrupt:
+                    pass
+    finally:
+        if watcher:
+            watcher.close()
+        if exporter:
+            exporter.close()
+        if scan_manifest:
+            scan_manifest.close()
+        if metrics_file:
+            metrics.write_textfile(metrics_file)
+
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"✅ 扫描完成: {count} 个文件 ({errors} 个出错), 耗时 {elapsed:.2f}s, {rate:.1f} 文件/秒",
+          file=sys.stderr)
+    if cache_options:
+        print(f"💾 缓存命中 {cache_hits}/{count}", file=sys.stderr)
+    if scan_manifest:
+        print(f"📋 增量清单: {scan_manifest.unchanged} 个未变化, {scan_manifest.updated} 个新增/更新, "
+              f"{len(removed)} 个已删除", file=sys.stderr)
+    if exporter:
+        print(f"📦 已导出 {exporter.rows} 行到 {export}", file=sys.stderr)
+    if deduper:
+        print(f"🧬 感知哈希: 计算 {deduper.hashed} 张, {deduper.inherited} 张继承了近似重复原图的来源结论",
+              file=sys.stderr)
+    if metrics and metrics.files:
+        stages = sorted(metrics.stage_ms.items(), key=lambda item: -item[1])[:5]
+        print("⏱️ 耗时最多的阶段: " + ", ".join(f"{stage} {ms / 1000:.2f}s" for stage, ms in stages), file=sys.stderr)
+        for ms, path, stage in metrics.slowest_files()[:5]:
+            print(f"🐢 {ms:.1f} ms  {path}  (主要在 {stage})", file=sys.stderr)
+    return count
+
+
+def print_usage():
+    print("=" * 50)
+    print("🔍 AIGC 图片元数据检测工具")
+    print("=" * 50)
+    print("\n使用方法: python aigc_metadata.py <图片路径> [--json]")
+    print("          python aigc_metadata.py <目录|通配符|-> ... [--workers N] [--max-inflight N]")
+    print("\n示例:")
+    print("  python aigc_metadata.py image.png")
+    print("  python aigc_metadata.py ~/Downloads/ai_image.jpg")
+    print("  python aigc_metadata.py ~/uploads/ --workers 8 > results.jsonl")
+    print("  python aigc_metadata.py 'images/**/*.png'")
+    print("  find /data -name '*.jpg' | python aigc_metadata.py -")
+    print("  python aigc_metadata.py ~/Photos --incremental scan.db --changed-only")
+    print("  python aigc_metadata.py ~/uploads --phash > results.jsonl")
+    print("\n支持检测:")
+    print("  ✅ C2PA 认证 (Google Gemini, Adobe, Microsoft)")
+    print("  ✅ 中国 AIGC 国家标准")
+    print("  ✅ Stable Diffusion / ComfyUI / NovelAI")
+    print("  ✅ 通用 EXIF/XMP 元数据")
+
+
+def build_arg_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="AIGC 图片元数据检测工具")
+    parser.add_argument("paths", nargs="*", help="图片路径、目录、通配符, 或 '-' 从 stdin 读取路径列表")
+    parser.add_argument("--json", action="store_true", help="单文件模式下额外输出完整 JSON")
+    parser.add_argument("--batch", action="store_true", help="强制批量模式 (输出 JSON Lines)")
+    parser.add_argument("--workers", type=int, default=None, help="进程池大小 (默认 CPU 核数)")
+    parser.add_argument("--max-inflight", type=int, default=None, help="同时在处理中的文件数上限 (默认 workers*4)")
+    parser.add_argument("--mode", choices=DETECT_MODES, default="full",
+                        help="full: 用 Pillow 完整解析; fast: 只读容器头, 不调用 Pillow")
+    parser.add_argument("--scan-after-idat", action="store_true", help="继续读取 PNG 像素数据之后的文本 chunk")
+    parser.add_argument("--exhaustive", action="store_true", help="得出结论后仍执行全部检测器 (C2PA / XMP 等), 结果字段最完整")
+    parser.add_argument("--lazy-text-kb", type=int, default=None,
+                        help="超过该大小 (KB) 的 PNG 文本 chunk 延迟解码, 输出时流式编码 (ComfyUI workflow 等)")
+    parser.add_argument("--max-text-kb", type=int, default=None, help="PNG 文本 chunk 解码后的大小上限 (KB), 超出部分截断")
+    parser.add_argument("--structured", action="store_true", help="把 A1111 / ComfyUI / NovelAI 生成参数解析成结构化字段")
+    parser.add_argument("--export", metavar="FILE", default=None,
+                        help="批量模式下把生成参数导出为列式文件 (.parquet / .arrow, 需要 pyarrow)")
+    parser.add_argument("--incremental", metavar="DB", default=None,
+                        help="增量扫描清单 (SQLite): 大小 / mtime / inode 都没变的文件直接复用上次结果")
+    parser.add_argument("--changed-only", action="store_true", help="增量扫描时只输出新增或变化的文件")
+    parser.add_argument("--watch", action="store_true", help="扫描完成后用 inotify 监视目录, 处理新写入的文件 (仅 Linux)")
+    parser.add_argument("--profile", action="store_true", help="在结果中记录各阶段耗时和读取字节数, 批量模式结束时列出最慢的文件")
+    parser.add_argument("--metrics-file", metavar="FILE", default=None,
+                        help="批量模式下定期把 Prometheus 计数器写到该文件 (node_exporter textfile), 自动开启 --profile")
+    parser.add_argument("--timeout", type=float, default=None, help="批量模式下单个文件的检测时间上限 (秒)")
+    parser.add_argument("--max-file-mb", type=int, default=None,
+                        help="单个文件的字节预算 (MB): 更大的文件只读元数据前缀, 前缀也超出时记为出错")
+    parser.add_argument("--phash", type=int, nargs="?", const=PHASH_MAX_DISTANCE, default=None, metavar="DIST",
+                        help=f"批量模式下计算感知哈希, 元数据被剥离的近似重复副本继承原图的来源结论 "
+                             f"(海明距离阈值, 默认 {PHASH_MAX_DISTANCE}; 需要 numpy)")
+    parser.add_argument("--cache", metavar="DB", default=None, help="SQLite 结果缓存文件路径 (按内容哈希复用检测结果)")
+    parser.add_argument("--cache-max-mb", type=int, default=256, help="缓存大小上限 (MB), 超出后按 LRU 淘汰")
+    return parser
+
+
+def main(argv=None):
+    import glob
+
+    args = build_arg_parser().parse_args(argv)
+    if not args.paths:
+        print_usage()
+        return 1
+
+    detect_options = {"scan_after_idat": args.scan_after_idat, "mode": args.mode, "exhaustive": args.exhaustive}
+    # 只在设置时加入, 未设置时缓存键与之前相同
+    if args.lazy_text_kb is not None:
+        detect_options["lazy_text_bytes"] = args.lazy_text_kb * 1024
+    if args.max_text_kb is not None:
+        detect_options["max_text_bytes"] = args.max_text_kb * 1024
+    if args.structured:
+        detect_options["structured"] = True
+    if args.profile:
+        detect_options["profile"] = True
+    if args.max_file_mb is not None:
+        detect_options["max_file_bytes"] = args.max_file_mb * 1024 * 1024
+    cache_options = None
+    if args.cache:
+        cache_options = {"path": args.cache, "max_bytes": args.cache_max_mb * 1024 * 1024}
+    single_file = (
+        not args.batch
+        and not args.export
+        and not args.incremental
+        and not args.watch
+        and not args.metrics_file
+        and args.phash is None
+        and len(args.paths) == 1
+        and args.paths[0] != "-"
+        and not os.path.isdir(args.paths[0])
+        and not glob.has_magic(args.paths[0])
+    )
+    if not single_file:
+        if args.watch and not any(os.path.isdir(path) for path in args.paths):
+            print("❌ 错误: --watch 需要至少一个目录")
+            return 1
+        run_batch(args.paths, workers=args.workers, max_inflight=args.max_inflight,
+                  detect_options=detect_options, cache_options=cache_options, export=args.export,
+                  manifest=args.incremental, changed_only=args.changed_only, watch=args.watch,
+                  metrics_file=args.metrics_file, timeout=args.timeout, phash=args.phash)
+        return 0
+
+    image_path = args.paths[0]
+
     # 检查文件是否存在
-    if not Path(image_path).exists():
+    if not os.path.exists(image_path):
         print(f"❌ 错误: 文件不存在 - {image_path}")
-        sys.exit(1)
-    
-    results = detect_aigc_source(image_path)
+        return 1
+
+    if cache_options:
+        cache = ResultCache(**cache_options)
+        results = detect_aigc_source_cached(image_path, cache, **detect_options)
+        cache.close()
+    else:
+        results = detect_aigc_source(image_path, **detect_options)
     print_results(results)
-    
-    # 添加 --json 参数支持
-    if len(sys.argv) > 2 and sys.argv[2] == "--json":
+
+    if args.json:
         print("\n完整 JSON 数据:")
-        # 移除原始 C2PA 数据以减少输出
-        output = {k: v for k, v in results.items() if k != "c2pa_raw"}
-        print(json.dumps(output, indent=2, ensure_ascii=False, default=str))
+        print(json.dumps(to_json_output(results), indent=2, ensure_ascii=False, default=json_default))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,387 @@
+"""
+AIGC 图片元数据检测常驻服务
+进程池常驻, Pillow / c2pa 在子进程里保持预热, 不再为每张图重新启动解释器和初始化 C2PA 库。
+
+用法:
+  python aigc_server.py --port 8765                  # 本地 HTTP
+  python aigc_server.py --uds /tmp/aigc.sock         # Unix socket
+
+  curl -X POST localhost:8765/detect -H 'Content-Type: application/json' -d '{"path": "image.png"}'
+  curl -X POST localhost:8765/detect/bytes --data-binary @image.png
+  curl --unix-socket /tmp/aigc.sock http://localhost/metrics
+  python aigc_server.py --profile                    # 记录分阶段耗时, Prometheus 从 /metrics/prometheus 采集
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+import aigc_metadata as am
+
+
+# ========== 进程池任务 (模块级函数才能被 pickle) ==========
+def warm_up_worker():
+    """子进程启动时预先加载 Pillow 和 c2pa, 第一个请求不再承担导入耗时"""
+    from PIL import Image
+    Image.init()
+    am.load_c2pa()
+
+
+def detect_items(items, detect_options, cache_options, timeout=None):
+    """在子进程里检测一批输入, 每项是文件路径或图片字节
+
+    结果在子进程里先做一次 JSON 往返, EXIF 分数等非标准类型统一转成字符串, 主进程直接返回即可。
+    timeout 是每一项的时间上限, 恶意构造的图片超时后只影响它自己的结果, 同批其他项照常检测。
+    """
+    results = []
+    for item in items:
+        result = am._detect_worker(item, detect_options, cache_options, timeout=timeout)
+        results.append(json.loads(json.dumps(result, ensure_ascii=False, default=am.json_default)))
+    return results
+
+
+# ========== 延迟直方图 ==========
+class LatencyHistogram:
+    """固定分桶 (毫秒) 的延迟直方图, 分位数取所在桶的上界"""
+
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for upper, n in zip(self.BUCKETS_MS + (float("inf"),), self.counts):
+            seen += n
+            if seen >= target:
+                return upper
+        return float("inf")
+
+    def prometheus_lines(self, name, labels):
+        """Prometheus histogram 格式 (累计分桶, 单位秒)"""
+        lines = []
+        seen = 0
+        for upper, n in zip(self.BUCKETS_MS + (float("inf"),), self.counts):
+            seen += n
+            le = "+Inf" if upper == float("inf") else f"{upper / 1000:g}"
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {seen}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total_ms / 1000:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+    def snapshot(self):
+        labels = [f"<={b}" for b in self.BUCKETS_MS] + ["+Inf"]
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.quantile(0.50),
+            "p90_ms": self.quantile(0.90),
+            "p99_ms": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+# ========== 请求合批 ==========
+class MicroBatcher:
+    """把 max_wait 秒内到达的请求合成一批 (最多 max_batch 个) 一次提交给进程池, 摊薄进程间通信开销
+
+    检测进程崩溃 (上传的图片让 Pillow / c2pa 段错误或 OOM) 会让整个进程池失效, 这时换一个新进程池,
+    只有当前这一批请求失败, 后续请求照常处理。
+    单项超时由子进程里的 time_limit 处理; 卡在原生代码里打断不了时, 批次超过 _deadline() 仍未返回
+    就结束整个进程池, 按崩溃同样处理。
+    """
+
+    def __init__(self, pool, workers, max_batch, max_wait, detect_options, cache_options, timeout=None):
+        self.pool = pool
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.detect_options = detect_options
+        self.cache_options = cache_options
+        self.timeout = timeout
+        self.queue = asyncio.Queue()
+        # 同时在进程池里排队的批次数上限, 防止突发流量把任务无限堆进进程池
+        self.slots = asyncio.Semaphore(workers * 2)
+        self.batches = 0
+        self.items = 0
+        self.pool_restarts = 0
+        # 进程池坏掉后到新进程池确认可用之前为 True (新进程池的预热也可能失败)
+        self.pool_broken = False
+        self._task = None
+        self._dispatching = set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self._dispatching)
+        if self._task:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _restart_pool(self, broken):
+        """同一批失效可能被多个在途批次同时发现, 只替换一次"""
+        self.pool_broken = True
+        if self.pool is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_worker)
+        self.pool_restarts += 1
+        print(f"♻️ [检测服务] 检测进程异常退出, 已重建进程池 (第 {self.pool_restarts} 次)")
+        self._track(asyncio.create_task(self._check_pool(self.pool)))
+
+    async def _check_pool(self, pool):
+        """立即让新进程池跑一个空任务: 预热成功就恢复健康状态, 不必等下一个请求"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(pool, os.getpid)
+        except BrokenProcessPool:
+            # 预热本身就崩溃 (比如 c2pa 库损坏) 时不要无间隔地反复拉起进程
+            await asyncio.sleep(1.0)
+            self._restart_pool(pool)
+        else:
+            if pool is self.pool:
+                self.pool_broken = False
+
+    def _deadline(self, batch):
+        """批次从提交到返回的时间上限: 前面最多排着一批, 每项最多 timeout 秒 (time_limit 生效时)"""
+        if not self.timeout:
+            return None
+        return self.timeout * (self.max_batch + len(batch)) + am.POOL_DEADLINE_GRACE
+
+    def _track(self, task):
+        # 保留任务引用, 否则事件循环只持有弱引用, 任务可能在执行途中被垃圾回收
+        self._dispatching.add(task)
+        task.add_done_callback(self._dispatching.discard)
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            self._track(asyncio.create_task(self._dispatch(batch)))
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        self.batches += 1
+        self.items += len(batch)
+        pool = self.pool
+        try:
+            try:
+                results = await asyncio.wait_for(loop.run_in_executor(
+                    pool, detect_items, [item for item, _ in batch], self.detect_options, self.cache_options,
+                    self.timeout), self._deadline(batch))
+            except asyncio.TimeoutError:
+                if pool is self.pool:
+                    am.kill_pool(pool)
+                raise BrokenProcessPool("检测卡在原生代码中超过期限, 已结束检测进程")
+            if pool is self.pool:
+                self.pool_broken = False
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._restart_pool(pool)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.slots.release()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# ========== HTTP 接口 ==========
+class DetectRequest(BaseModel):
+    path: str = Field(..., min_length=1, description="服务端可访问的图片路径")
+
+
+class BatchDetectRequest(BaseModel):
+    paths: list[str] = Field(..., min_length=1, max_length=1000, description="图片路径列表")
+
+
+async def read_body(request, max_bytes):
+    """边读边计数, 超过上限立即 413, 不会先把整个上传缓冲进内存再检查"""
+    too_large = HTTPException(status_code=413, detail=f"图片超过 {max_bytes // 1024 // 1024} MB")
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise too_large
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > max_bytes:
+            raise too_large
+    return bytes(data)
+
+
+def create_app(workers=None, max_batch=16, max_wait_ms=5.0, detect_options=None, cache_options=None,
+               max_body_mb=64, timeout=None):
+    workers = workers or os.cpu_count() or 1
+    histograms = {}
+    state = {}
+    # 检测结果里带有 profile 时 (detect_options 开启 profile) 汇总各阶段耗时
+    profile_metrics = am.ProfileMetrics()
+
+    def observe(endpoint, start, results=()):
+        histograms.setdefault(endpoint, LatencyHistogram()).observe((time.perf_counter() - start) * 1000)
+        for result in results:
+            profile_metrics.observe(result)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_up_worker)
+        batcher = MicroBatcher(pool, workers, max_batch, max_wait_ms / 1000, detect_options, cache_options,
+                               timeout)
+        batcher.start()
+        state["batcher"] = batcher
+        print(f"🚀 [检测服务] 已启动 {workers} 个常驻检测进程, 合批上限 {max_batch} / {max_wait_ms} ms")
+        yield
+        await batcher.stop()
+        batcher.pool.shutdown(cancel_futures=True)
+
+    app = FastAPI(title="AIGC 图片元数据检测服务", lifespan=lifespan)
+
+    @app.post("/detect")
+    async def detect(request: DetectRequest):
+        start = time.perf_counter()
+        if not os.path.isfile(request.path):
+            raise HTTPException(status_code=404, detail=f"文件不存在 - {request.path}")
+        result = await state["batcher"].submit(request.path)
+        observe("/detect", start, [result])
+        return result
+
+    @app.post("/detect/batch")
+    async def detect_batch(request: BatchDetectRequest):
+        start = time.perf_counter()
+        results = await asyncio.gather(*(state["batcher"].submit(path) for path in request.paths))
+        observe("/detect/batch", start, results)
+        return {"results": results}
+
+    @app.post("/detect/bytes")
+    async def detect_bytes(request: Request):
+        start = time.perf_counter()
+        data = await read_body(request, max_body_mb * 1024 * 1024)
+        if not data:
+            raise HTTPException(status_code=400, detail="请求体为空")
+        result = await state["batcher"].submit(data)
+        observe("/detect/bytes", start, [result])
+        return result
+
+    @app.get("/metrics")
+    async def metrics():
+        batcher = state["batcher"]
+        return {
+            "workers": workers,
+            "batches": batcher.batches,
+            "avg_batch_size": batcher.items / batcher.batches if batcher.batches else None,
+            "queue_depth": batcher.queue.qsize(),
+            "latency": {endpoint: h.snapshot() for endpoint, h in histograms.items()},
+            "slowest": [{"ms": ms, "path": path, "stage": stage} for ms, path, stage in profile_metrics.slowest_files()],
+        }
+
+    @app.get("/metrics/prometheus", response_class=PlainTextResponse)
+    async def metrics_prometheus():
+        batcher = state["batcher"]
+        lines = [
+            "# HELP aigc_server_batches_total 提交到进程池的批次数",
+            "# TYPE aigc_server_batches_total counter",
+            f"aigc_server_batches_total {batcher.batches}",
+            "# HELP aigc_server_queue_depth 等待合批的请求数",
+            "# TYPE aigc_server_queue_depth gauge",
+            f"aigc_server_queue_depth {batcher.queue.qsize()}",
+            "# HELP aigc_server_request_duration_seconds 请求延迟",
+            "# TYPE aigc_server_request_duration_seconds histogram",
+        ]
+        for endpoint, h in sorted(histograms.items()):
+            lines += h.prometheus_lines("aigc_server_request_duration_seconds", f'endpoint="{endpoint}"')
+        return "\n".join(lines) + "\n" + profile_metrics.to_prometheus()
+
+    @app.get("/health")
+    async def health(response: Response):
+        batcher = state["batcher"]
+        if batcher.pool_broken:
+            response.status_code = 503
+        return {
+            "status": "degraded" if batcher.pool_broken else "ok",
+            "pool": {"workers": workers, "broken": batcher.pool_broken, "restarts": batcher.pool_restarts},
+        }
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AIGC 图片元数据检测常驻服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--uds", default=None, help="监听 Unix socket 路径 (设置后忽略 host/port)")
+    parser.add_argument("--workers", type=int, default=None, help="检测进程数 (默认 CPU 核数)")
+    parser.add_argument("--max-batch", type=int, default=16, help="单批最多合并的请求数")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="合批最长等待时间 (毫秒)")
+    parser.add_argument("--mode", choices=am.DETECT_MODES, default="full")
+    parser.add_argument("--timeout", type=float, default=10.0, help="单个文件的检测时间上限 (秒)")
+    parser.add_argument("--max-file-mb", type=int, default=None,
+                        help="单个文件的字节预算 (MB, 默认与 --max-body-mb 相同): 更大的文件只读元数据前缀")
+    parser.add_argument("--max-body-mb", type=int, default=64, help="/detect/bytes 请求体上限 (MB)")
+    parser.add_argument("--profile", action="store_true", help="结果中带上分阶段耗时, 并汇总到 /metrics/prometheus")
+    parser.add_argument("--cache", metavar="DB", default=None, help="SQLite 结果缓存文件路径")
+    parser.add_argument("--cache-max-mb", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    cache_options = None
+    if args.cache:
+        cache_options = {"path": args.cache, "max_bytes": args.cache_max_mb * 1024 * 1024}
+    # 服务默认处理不可信上传, 字节预算和超时都默认开启
+    detect_options = {"mode": args.mode, "max_file_bytes": (args.max_file_mb or args.max_body_mb) * 1024 * 1024}
+    if args.profile:
+        detect_options["profile"] = True
+    app = create_app(args.workers, args.max_batch, args.max_wait_ms, detect_options, cache_options,
+                     max_body_mb=args.max_body_mb, timeout=args.timeout)
+    if args.uds:
+        uvicorn.run(app, uds=args.uds)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
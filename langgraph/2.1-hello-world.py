@@ -1,23 +1,20 @@
 import asyncio
-import aiohttp
 import operator
 from typing import TypedDict, Annotated, Optional
 from langgraph.graph import StateGraph, START, END
 
+from ollama_client import generate, ollama_session
+
 
 # ==========================================
 # [底层设施] 你的 1.8 异步防弹调用工具
 # ==========================================
 async def call_ollama(prompt: str) -> str:
-    url = "http://localhost:11434/api/generate"
     payload = {"model": "llama3.2:3b", "prompt": prompt, "stream": False}
     try:
-        timeout = aiohttp.ClientTimeout(total=30)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, json=payload) as response:
-                response.raise_for_status()
-                result = await response.json()
-                return result.get("response", "")
+        # 共享连接池 (ollama_client.py), 不再每次调用都新建会话
+        result = await generate(payload, timeout=30)
+        return result.get("response", "")
     except Exception as e:
         return f"❌ 大模型宕机: {str(e)}"
 
@@ -68,8 +65,9 @@ async def main():
     # 5. 初始状态：往新黑板上写下第一句话
     initial_state = {"messages": ["User: 为什么天空是蓝色的？请用 15 个字以内回答。"]}
 
-    # 6. 启动异步引擎，推送数据流转
-    final_state = await app.ainvoke(initial_state)
+    # 6. 启动异步引擎，推送数据流转 (ollama_session 管理共享连接池的开关)
+    async with ollama_session():
+        final_state = await app.ainvoke(initial_state)
 
     print("\n🏁 运行结束！最终的记忆黑板 (State) 内容：")
     for msg in final_state["messages"]:
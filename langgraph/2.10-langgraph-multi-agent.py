@@ -1,10 +1,11 @@
 import asyncio
-import aiohttp
 import operator
 import json
 from typing import TypedDict, Annotated, Dict, Any
 from langgraph.graph import StateGraph, START, END
 
+from ollama_client import chat, chat_stream, ollama_session, stream_graph
+
 
 class AgentState(TypedDict):
     messages: Annotated[list[Dict[str, Any]], operator.add]
@@ -30,36 +31,30 @@ async def supervisor_node(state: AgentState):
             "content": "【系统绝对指令】：检测到小弟刚刚已经提交了最终产出！不要做任何二次分析，不要分配给其他人，立刻、马上输出 {\"next\": \"FINISH\"} ！"
         })
 
-    url = "http://localhost:11434/api/chat"
     payload = {"model": "llama3.2:3b", "messages": final_messages, "stream": False, "format": "json"}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as resp:
-            res = await resp.json()
-            try:
-                decision = json.loads(res["message"]["content"])
-                next_action = decision.get("next", "FINISH")
-            except:
-                next_action = "FINISH"
-            print(f"   🎯 [包工头决策]: 下一步交由 -> {next_action}")
-            return {"next_agent": next_action}
+    res = await chat(payload, raise_for_status=False)
+    try:
+        decision = json.loads(res["message"]["content"])
+        next_action = decision.get("next", "FINISH")
+    except:
+        next_action = "FINISH"
+    print(f"   🎯 [包工头决策]: 下一步交由 -> {next_action}")
+    return {"next_agent": next_action}
 
 
 async def coder_node(state: AgentState):
     print("   👨‍💻 [Coder 小弟] 收到！正在疯狂手撕 Python 代码...")
     sys_prompt = "你是顶级 Python 开发专家。只输出高质的代码和极简注释。如果任务无需代码，请直接回复『此任务无需代码』，绝不输出空白！"
     final_messages = [{"role": "system", "content": sys_prompt}] + state["messages"]
-    url = "http://localhost:11434/api/chat"
-    payload = {"model": "llama3.2:3b", "messages": final_messages, "stream": False}
+    payload = {"model": "llama3.2:3b", "messages": final_messages, "stream": True}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as resp:
-            res = await resp.json()
-            result_msg = res["message"]["content"]
-            if not result_msg.strip():
-                result_msg = "（系统拦截：Coder 生成了空内容，强行阻断幻觉）"
-            print(f"\n      📄 [Coder 产出明细]:\n{result_msg}\n")
-            return {"messages": [{"role": "assistant", "content": f"【Coder 交付】\n{result_msg}"}]}
+    res = await chat_stream(payload, node="coder", raise_for_status=False)
+    result_msg = res["message"]["content"]
+    if not result_msg.strip():
+        result_msg = "（系统拦截：Coder 生成了空内容，强行阻断幻觉）"
+    print(f"\n      📄 [Coder 产出明细]:\n{result_msg}\n")
+    return {"messages": [{"role": "assistant", "content": f"【Coder 交付】\n{result_msg}"}]}
 
 
 async def researcher_node(state: AgentState):
@@ -67,18 +62,15 @@ async def researcher_node(state: AgentState):
     # 【核心修复 2】：给 Researcher 加上防哑巴装甲
     sys_prompt = "你是云原生架构师。请给出专业的 Kubernetes/k9s 解答。如果任务与云原生完全无关，请直接回复『此任务非我专业』，绝不输出空白！"
     final_messages = [{"role": "system", "content": sys_prompt}] + state["messages"]
-    url = "http://localhost:11434/api/chat"
-    payload = {"model": "llama3.2:3b", "messages": final_messages, "stream": False}
+    payload = {"model": "llama3.2:3b", "messages": final_messages, "stream": True}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as resp:
-            res = await resp.json()
-            result_msg = res["message"]["content"]
-            # 【核心修复 3】：增加空包弹物理拦截
-            if not result_msg.strip():
-                result_msg = "（系统拦截：Researcher 生成了空内容，强行阻断幻觉）"
-            print(f"\n      📄 [Researcher 产出明细]:\n{result_msg}\n")
-            return {"messages": [{"role": "assistant", "content": f"【Researcher 交付】\n{result_msg}"}]}
+    res = await chat_stream(payload, node="researcher", raise_for_status=False)
+    result_msg = res["message"]["content"]
+    # 【核心修复 3】：增加空包弹物理拦截
+    if not result_msg.strip():
+        result_msg = "（系统拦截：Researcher 生成了空内容，强行阻断幻觉）"
+    print(f"\n      📄 [Researcher 产出明细]:\n{result_msg}\n")
+    return {"messages": [{"role": "assistant", "content": f"【Researcher 交付】\n{result_msg}"}]}
 
 
 def router(state: AgentState) -> str:
@@ -92,6 +84,12 @@ def router(state: AgentState) -> str:
 
 
 async def main():
+    # 包工头和两个小弟的每一轮调用共用一个 Ollama 连接池
+    async with ollama_session():
+        await run_team()
+
+
+async def run_team():
     workflow = StateGraph(AgentState)
     workflow.add_node("supervisor", supervisor_node)
     workflow.add_node("coder", coder_node)
@@ -107,13 +105,13 @@ async def main():
 
     query1 = "帮我用 Python 写一个极简的计算两个数最大公约数的函数。"
     print(f"\n👨‍💼 [Boss (User)]: {query1}")
-    await app.ainvoke({"messages": [{"role": "user", "content": query1}]})
+    await stream_graph(app, {"messages": [{"role": "user", "content": query1}]})
 
     print("\n" + "=" * 50)
 
     query2 = "我在本地 kind 集群里怎么用 k9s 快速看某个 Pod 的报错日志？"
     print(f"\n👨‍💼 [Boss (User)]: {query2}")
-    await app.ainvoke({"messages": [{"role": "user", "content": query2}]})
+    await stream_graph(app, {"messages": [{"role": "user", "content": query2}]})
 
 
 if __name__ == "__main__":
@@ -15,6 +15,8 @@ from langchain_ollama import ChatOllama
 # 【核心修复】：导入 LangChain 的底层配置对象
 from langchain_core.runnables import RunnableConfig
 
+from ollama_client import SingleFlight
+
 
 # ==========================================
 # [一、 LangGraph 核心架构]
@@ -45,8 +47,16 @@ app_graph = workflow.compile()
 # ==========================================
 app = FastAPI(title="raap Agent Streaming API")
 
+# 进行中请求合并：同一时刻相同的问题只跑一次图，SSE 事件逐条分发给所有连接（晚到的先补发已有的 token）
+flights = SingleFlight()
+
 
 async def token_generator(query: str):
+    async for event in flights.stream(query, lambda: graph_events(query)):
+        yield event
+
+
+async def graph_events(query: str):
     inputs = {"messages": [{"role": "user", "content": query}]}
     print(f"\n🌐 [网络通道建立] 接收到查询: {query}")
 
@@ -72,6 +82,11 @@ async def chat(query: str):
     )
 
 
+@app.get("/stats")
+async def stats():
+    return flights.stats()
+
+
 if __name__ == "__main__":
     import uvicorn
 
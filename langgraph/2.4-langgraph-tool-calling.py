@@ -1,10 +1,11 @@
 import asyncio
-import aiohttp
 import operator
 import json
 from typing import TypedDict, Annotated, Dict, Any
 from langgraph.graph import StateGraph, START, END
 
+from ollama_client import chat_stream, ollama_session, stream_graph, tags
+
 
 # ==========================================
 # [本地工具库] 物理世界的真实函数
@@ -36,21 +37,17 @@ TOOLS_MANUAL = [{
 # ==========================================
 async def auto_detect_model() -> str:
     """向本地 Ollama 查询已安装的模型，按优先级自动匹配"""
-    url = "http://localhost:11434/api/tags"
     # 【架构师思维】你的优先级列表：首选 3.2:3b，次选 3:latest
     candidates = ["llama3.2:3b", "llama3:latest", "llama3.2:latest", "llama3"]
 
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=3)) as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    installed = [m["name"] for m in data.get("models", [])]
-
-                    # 遍历优先级列表，匹配本机存在的模型
-                    for target in candidates:
-                        if target in installed:
-                            return target
+        data = await tags(timeout=3)
+        installed = [m["name"] for m in data.get("models", [])]
+
+        # 遍历优先级列表，匹配本机存在的模型
+        for target in candidates:
+            if target in installed:
+                return target
     except Exception:
         pass
     return "llama3.2:3b"  # 如果探测失败，给一个兜底的默认值
@@ -70,27 +67,24 @@ async def llm_node(state: AgentState):
     current_model = state.get("model_name", "llama3:latest")
     print(f"🧠 [LLM 节点] 正在使用 {current_model} 思考，并翻阅工具说明书...")
 
-    url = "http://localhost:11434/api/chat"
     payload = {
         "model": current_model,
         "messages": state["messages"],
         "tools": TOOLS_MANUAL,
-        "stream": False
+        "stream": True
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                result = await response.json()
+        # 流式接收：token 边生成边推到图的 custom 流, 结束后拼回完整的 message (含 tool_calls)
+        result = await chat_stream(payload, node="agent", raise_for_status=False)
 
-                # 防弹机制：如果 Ollama 依然抛错，优雅拦截
-                if "message" not in result:
-                    error_detail = result.get("error", "未知底层错误")
-                    print(f"\n🚨 [Ollama 原始报错]: {error_detail}\n")
-                    return {"messages": [{"role": "assistant", "content": f"系统拦截到模型异常: {error_detail}"}]}
+        # 防弹机制：如果 Ollama 依然抛错，优雅拦截
+        if "message" not in result:
+            error_detail = result.get("error", "未知底层错误")
+            print(f"\n🚨 [Ollama 原始报错]: {error_detail}\n")
+            return {"messages": [{"role": "assistant", "content": f"系统拦截到模型异常: {error_detail}"}]}
 
-                response.raise_for_status()
-                return {"messages": [result["message"]]}
+        return {"messages": [result["message"]]}
 
     except Exception as e:
         print(f"❌ [请求物理异常]: {str(e)}")
@@ -128,6 +122,12 @@ def should_continue(state: AgentState) -> str:
 # [引擎启动] 组装图纸
 # ==========================================
 async def main():
+    # 整个流程共用一个 Ollama 连接池, 退出时统一关闭
+    async with ollama_session():
+        await run_agent()
+
+
+async def run_agent():
     # 【架构师操作 1】开机瞬间，自动侦测当前电脑环境！
     best_model = await auto_detect_model()
     print(f"🌐 [系统启动] 成功为当前电脑适配模型: {best_model}\n")
@@ -150,7 +150,7 @@ async def main():
         "model_name": best_model
     }
 
-    final_state = await app.ainvoke(initial_state)
+    final_state = await stream_graph(app, initial_state)
     print("\n📊 [最终回复]:", final_state["messages"][-1].get("content"))
 
 
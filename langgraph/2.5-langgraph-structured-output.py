@@ -1,10 +1,11 @@
 import asyncio
-import aiohttp
 import json
 from typing import TypedDict
 from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, START, END
 
+from ollama_client import chat, ollama_session
+
 
 # ==========================================
 # [核心武器] 打造极其严格的 Pydantic 模具
@@ -28,8 +29,6 @@ class AgentState(TypedDict):
 async def extract_node(state: AgentState):
     print("🧠 [提取节点] 正在阅读文本，并强制按 Pydantic 模具输出 JSON...")
 
-    url = "http://localhost:11434/api/chat"
-
     # 【高能魔法】将 Python 的 Pydantic 模型，一键翻译成大模型听得懂的 JSON Schema
     strict_schema = UserProfile.model_json_schema()
 
@@ -42,19 +41,16 @@ async def extract_node(state: AgentState):
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                response.raise_for_status()
-                result = await response.json()
+        result = await chat(payload)
 
-                # 拿到大模型的回复
-                ai_msg = result["message"]["content"]
+        # 拿到大模型的回复
+        ai_msg = result["message"]["content"]
 
-                # 因为加了 format 紧箍咒，这里拿到的绝对是干净的 JSON 字符串，直接 load！
-                parsed_dict = json.loads(ai_msg)
-                print(f"   ✅ [解析成功] 拿到完美字典！")
+        # 因为加了 format 紧箍咒，这里拿到的绝对是干净的 JSON 字符串，直接 load！
+        parsed_dict = json.loads(ai_msg)
+        print(f"   ✅ [解析成功] 拿到完美字典！")
 
-                return {"extracted_profile": parsed_dict}
+        return {"extracted_profile": parsed_dict}
 
     except Exception as e:
         print(f"❌ 解析失败: {e}")
@@ -80,7 +76,8 @@ async def main():
 
     initial_state = {"user_input": test_text, "extracted_profile": None}
 
-    final_state = await app.ainvoke(initial_state)
+    async with ollama_session():
+        final_state = await app.ainvoke(initial_state)
 
     print("\n📊 [最终 State 里提取出的纯净数据]:")
     # 美化打印最终的字典
@@ -1,5 +1,4 @@
 import asyncio
-import aiohttp
 import operator
 import json
 from typing import TypedDict, Annotated, Dict, Any
@@ -8,6 +7,8 @@ from langgraph.graph import StateGraph, START, END
 # 【高能预警：新武器介入】状态保存器，HITL 的必备底层依赖
 from langgraph.checkpoint.memory import MemorySaver
 
+from ollama_client import chat_stream, ollama_session, stream_graph
+
 
 # ==========================================
 # [本地高危工具库]
@@ -44,17 +45,14 @@ class AgentState(TypedDict):
 
 async def llm_node(state: AgentState):
     print("🧠 [LLM 节点] 正在思考...")
-    url = "http://localhost:11434/api/chat"
     payload = {
         "model": "llama3.2:3b",  # 默认使用你刚刚升级的最新模型
         "messages": state["messages"],
         "tools": TOOLS_MANUAL,
-        "stream": False
+        "stream": True
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as response:
-            result = await response.json()
-            return {"messages": [result["message"]]}
+    result = await chat_stream(payload, node="agent", raise_for_status=False)
+    return {"messages": [result["message"]]}
 
 
 async def tool_executor_node(state: AgentState):
@@ -83,6 +81,12 @@ def should_continue(state: AgentState) -> str:
 # [引擎启动] 带有 HITL 拦截器的图纸
 # ==========================================
 async def main():
+    # 整个会话 (包括等待人类审批期间) 共用一个 Ollama 连接池
+    async with ollama_session():
+        await run_agent()
+
+
+async def run_agent():
     # 1. 初始化内存保险箱
     memory = MemorySaver()
 
@@ -107,7 +111,7 @@ async def main():
     initial_state = {"messages": [{"role": "user", "content": "我是 Lyston，你们的服务太差了，立刻给我退款 500 元！"}]}
 
     # 第一次运行：流水线会在 action 前急刹车
-    await app.ainvoke(initial_state, config=config)
+    await stream_graph(app, initial_state, config=config)
 
     # 【观测点】检查流水线当前的状态
     snapshot = app.get_state(config)
@@ -128,7 +132,7 @@ async def main():
         if user_approval.strip().upper() == "Y":
             print("\n✅ 人类已授权，释放拦截，流水线继续...")
             # 【恢复执行】传入 None，代表不需要新的用户输入，直接顺着记忆往下跑
-            final_state = await app.ainvoke(None, config=config)
+            final_state = await stream_graph(app, None, config=config)
             print("\n📊 [最终回复]:", final_state["messages"][-1].get("content"))
         else:
             print("\n🚫 人类已否决，任务强制终止。")
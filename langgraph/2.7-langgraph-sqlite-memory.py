@@ -1,11 +1,12 @@
 import asyncio
-import aiohttp
 import operator
 import os  # 【新增】用来做操作系统的文件和目录管理
 from typing import TypedDict, Annotated, Dict, Any
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
+from ollama_client import chat_stream, ollama_session, stream_graph
+
 
 # ==========================================
 # [LangGraph 核心] 状态图纸与打工人
@@ -17,18 +18,15 @@ class AgentState(TypedDict):
 async def llm_node(state: AgentState):
     print("🧠 [LLM 节点] 正在读取硬盘里的记忆，并思考回复...")
 
-    url = "http://localhost:11434/api/chat"
     payload = {
         "model": "llama3.2:3b",
         "messages": state["messages"],
-        "stream": False
+        "stream": True
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as response:
-            response.raise_for_status()
-            result = await response.json()
-            return {"messages": [result["message"]]}
+    # 多轮对话复用同一条 keep-alive 连接; 流式接收, 回答边生成边打印
+    result = await chat_stream(payload, node="agent")
+    return {"messages": [result["message"]]}
 
 
 # ==========================================
@@ -54,8 +52,8 @@ async def main():
 
     print(f"📁 [系统初始化] 数据库将安全保存在: {db_path}")
 
-    # 4. 把安全路径交给底层的 Saver
-    async with AsyncSqliteSaver.from_conn_string(db_path) as db_saver:
+    # 4. 把安全路径交给底层的 Saver (Ollama 连接池与数据库连接一起开关)
+    async with AsyncSqliteSaver.from_conn_string(db_path) as db_saver, ollama_session():
 
         app = workflow.compile(checkpointer=db_saver)
 
@@ -69,7 +67,7 @@ async def main():
                 break
 
             initial_state = {"messages": [{"role": "user", "content": user_input}]}
-            final_state = await app.ainvoke(initial_state, config=config)
+            final_state = await stream_graph(app, initial_state, config=config)
 
             print(f"🤖 [Agent]: {final_state['messages'][-1]['content']}")
 
@@ -1,10 +1,11 @@
 import asyncio
-import aiohttp
 import os
 from typing import TypedDict, Annotated, Dict, Any
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
+from ollama_client import chat_stream, ollama_session, stream_graph
+
 
 # ==========================================
 # [架构师绝技：自定义记忆消除棒]
@@ -22,24 +23,20 @@ class AgentState(TypedDict):
 
 
 async def llm_node(state: AgentState):
-    url = "http://localhost:11434/api/chat"
     payload = {
         "model": "llama3.2:3b",
         "messages": state["messages"],
-        "stream": False
+        "stream": True
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as response:
-            response.raise_for_status()
-            result = await response.json()
-            return {"messages": [result["message"]]}
+    result = await chat_stream(payload, node="agent")
+    return {"messages": [result["message"]]}
 
 
 async def main():
     os.makedirs("db_data", exist_ok=True)
     db_path = os.path.join("db_data", "time_travel_v4.sqlite")
 
-    async with AsyncSqliteSaver.from_conn_string(db_path) as db_saver:
+    async with AsyncSqliteSaver.from_conn_string(db_path) as db_saver, ollama_session():
         workflow = StateGraph(AgentState)
         workflow.add_node("agent", llm_node)
         workflow.add_edge(START, "agent")
@@ -56,12 +53,12 @@ async def main():
         input("⏳ [系统挂起] 请按回车键，发送第一句话...")
         msg1 = {"messages": [{"role": "user", "content": "我的特工代号是『猎鹰』。收到请只回复：已确认。"}]}
         print("\n👨‍💻 [User]:", msg1["messages"][0]["content"])
-        await app.ainvoke(msg1, thread_config)
+        await stream_graph(app, msg1, thread_config)
 
         input("\n⏳ [系统挂起] 请按回车键，验证大模型...")
         msg2 = {"messages": [{"role": "user", "content": "我的特工代号是什么？请只输出代号。"}]}
         print("\n👨‍💻 [User]:", msg2["messages"][0]["content"])
-        state_original = await app.ainvoke(msg2, thread_config)
+        state_original = await stream_graph(app, msg2, thread_config)
         print("🤖 [Agent 原生回复]:", state_original['messages'][-1]['content'])
 
         print("\n" + "=" * 50)
@@ -108,7 +105,7 @@ async def main():
         print("\n👨‍💻 [User]: 我的特工代号是什么？请只输出代号。 (在平行宇宙再次提问)")
 
         # 【全场最核心修复】：用 new_config 发车，而不是 past_config！
-        state_forked = await app.ainvoke(msg2, config=new_config)
+        state_forked = await stream_graph(app, msg2, config=new_config)
 
         print("\n🤯 [Agent 洗脑后回复]:", state_forked['messages'][-1]['content'])
         print("=" * 50)
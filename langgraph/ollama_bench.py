@@ -0,0 +1,447 @@
+"""
+Ollama 调用性能对比 (本地桩服务器, 不需要真的 Ollama)
+
+桩服务器模拟 /api/chat、/api/generate、/api/embeddings、/api/embed (批量)、/api/tags, 可以用 --delay-ms 模拟首 token 前的
+prompt 处理耗时, --tokens / --token-ms 模拟逐 token 生成 (请求 stream=true 时按 NDJSON 逐块返回),
+--parallel 模拟 OLLAMA_NUM_PARALLEL (同时只处理这么多请求, 其余排队), --item-ms 模拟每条文本的 embedding 耗时,
+并按客户端端口统计一共建立了多少条 TCP 连接。
+
+用法:
+  python ollama_bench.py pool                          # 每次新建会话 vs 共享连接池
+  python ollama_bench.py pool -n 500 --concurrency 32 --delay-ms 2
+  python ollama_bench.py stream --tokens 200 --token-ms 20   # 非流式 vs 流式的首 token 延迟
+  python ollama_bench.py cache --unique 20 --rounds 5         # 回放相同请求: 无缓存 / 内存 / SQLite
+  python ollama_bench.py singleflight --burst 32 --parallel 2  # 突发的相同请求: 各自调用 vs 合并
+  python ollama_bench.py embed -n 5000                         # 知识库录入: 逐条 vs 批量 + 并发
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+import rag_ingest
+from ollama_client import OllamaClient, ResponseCache
+
+
+# ==========================================
+# [桩服务器] 固定回复, 记录连接数
+# ==========================================
+class StubOllama:
+    def __init__(self, delay_ms=0.0, tokens=0, token_ms=0.0, parallel=None, item_ms=0.0):
+        self.delay = delay_ms / 1000
+        self.tokens = tokens
+        self.token_delay = token_ms / 1000
+        self.item_delay = item_ms / 1000
+        # 模型同时处理的请求数 (GPU / CPU 算力有限), 默认不限制
+        self.slots = asyncio.Semaphore(parallel or 1 << 30)
+        self.ports = set()
+        self.requests = 0
+        self.base_url = None
+        self._runner = None
+
+    def _seen(self, request):
+        self.requests += 1
+        peer = request.transport.get_extra_info("peername")
+        if peer:
+            self.ports.add(peer[1])
+
+    async def _reply(self, request, body):
+        self._seen(request)
+        async with self.slots:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        return web.json_response(body)
+
+    def _tokens(self, text):
+        """要回复的 token 序列: 设置了 --tokens 时生成定长回复, 否则整段文字算一个 token"""
+        return [f"词{i} " for i in range(self.tokens)] if self.tokens else [text]
+
+    async def _generate(self, request, payload, tokens, wrap):
+        """模拟生成: 先等 prompt 处理, 再每 token_delay 秒出一个 token; Ollama 默认 stream=true"""
+        self._seen(request)
+        async with self.slots:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            final = {"model": payload.get("model"), "done": True, "eval_count": len(tokens)}
+            if not payload.get("stream", True):
+                await asyncio.sleep(self.token_delay * len(tokens))
+                return web.json_response({**final, **wrap("".join(tokens))})
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            for token in tokens:
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+                chunk = {"model": payload.get("model"), "done": False, **wrap(token)}
+                await response.write(json.dumps(chunk, ensure_ascii=False).encode() + b"\n")
+            await response.write(json.dumps({**final, **wrap("")}).encode() + b"\n")
+            await response.write_eof()
+            return response
+
+    async def handle_chat(self, request):
+        payload = await request.json()
+        tokens = self._tokens(f"收到 {len(payload.get('messages', []))} 条消息")
+        return await self._generate(request, payload, tokens,
+                                    lambda text: {"message": {"role": "assistant", "content": text}})
+
+    async def handle_generate(self, request):
+        payload = await request.json()
+        tokens = self._tokens(f"回复: {payload.get('prompt', '')[:20]}")
+        return await self._generate(request, payload, tokens, lambda text: {"response": text})
+
+    @staticmethod
+    def fake_embedding(text):
+        """由文本决定的假向量, 用来核对批量结果的顺序"""
+        seed = sum(text.encode()) % 97
+        return [(seed + i) / 100 for i in range(768)]
+
+    async def handle_embeddings(self, request):
+        payload = await request.json()
+        if self.item_delay:
+            await asyncio.sleep(self.item_delay)
+        return await self._reply(request, {"embedding": self.fake_embedding(payload.get("prompt", ""))})
+
+    async def handle_embed(self, request):
+        payload = await request.json()
+        inputs = payload.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        # 一批文本共用一次请求开销 (delay), 每条另算 item_ms (模型是批量前向, 实际比逐条更省)
+        self._seen(request)
+        async with self.slots:
+            await asyncio.sleep(self.delay + self.item_delay * len(inputs))
+        return web.json_response({"model": payload.get("model"),
+                                  "embeddings": [self.fake_embedding(text) for text in inputs]})
+
+    async def handle_tags(self, request):
+        return await self._reply(request, {"models": [{"name": "llama3.2:3b"}, {"name": "nomic-embed-text:latest"}]})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/api/chat", self.handle_chat)
+        app.router.add_post("/api/generate", self.handle_generate)
+        app.router.add_post("/api/embeddings", self.handle_embeddings)
+        app.router.add_post("/api/embed", self.handle_embed)
+        app.router.add_get("/api/tags", self.handle_tags)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def reset(self):
+        self.ports.clear()
+        self.requests = 0
+
+
+# ==========================================
+# [计时工具]
+# ==========================================
+def summarize(latencies_ms):
+    ordered = sorted(latencies_ms)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return {"mean": statistics.fmean(ordered), "p50": statistics.median(ordered), "p99": p99}
+
+
+async def timed_calls(call, n, concurrency):
+    """并发 concurrency 个协程共执行 n 次 call(), 返回每次调用的毫秒耗时和总耗时"""
+    latencies = []
+    remaining = iter(range(n))
+
+    async def worker():
+        for i in remaining:
+            start = time.perf_counter()
+            await call(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def print_row(label, latencies, elapsed, stub):
+    s = summarize(latencies)
+    print(f"   {label:<22} mean {s['mean']:7.3f} ms | p50 {s['p50']:7.3f} ms | p99 {s['p99']:7.3f} ms | "
+          f"{len(latencies) / elapsed:8.1f} 次/秒 | TCP 连接 {len(stub.ports)}")
+    return s
+
+
+def chat_payload(i):
+    return {"model": "llama3.2:3b", "messages": [{"role": "user", "content": f"第 {i} 个问题"}], "stream": False}
+
+
+# ==========================================
+# [pool] 每次新建会话 vs 共享连接池
+# ==========================================
+async def bench_pool(args):
+    stub = await StubOllama(args.delay_ms).start()
+    url = stub.base_url + "/api/chat"
+
+    async def per_call_session(i):
+        # 改造前各节点的写法: 每次调用新建 ClientSession, 用完即关, 连接无法复用
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=chat_payload(i)) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    print(f"🧪 [pool] 桩服务器 {stub.base_url}, {args.n} 次 /api/chat, 模拟模型耗时 {args.delay_ms} ms")
+    try:
+        for concurrency in (1, args.concurrency):
+            print(f"\n📊 并发 {concurrency}:")
+            stub.reset()
+            latencies, elapsed = await timed_calls(per_call_session, args.n, concurrency)
+            before = print_row("改造前 (每次新建会话)", latencies, elapsed, stub)
+
+            stub.reset()
+            async with OllamaClient(stub.base_url, limit_per_host=max(concurrency, args.limit_per_host)) as client:
+                await client.tags()  # 预热: 第一条连接的建立不计入
+                stub.reset()
+                latencies, elapsed = await timed_calls(lambda i: client.chat(chat_payload(i)), args.n, concurrency)
+                after = print_row("改造后 (共享连接池)", latencies, elapsed, stub)
+
+            print(f"   ⚡ 平均延迟降低 {before['mean'] - after['mean']:.3f} ms/次 "
+                  f"({before['mean'] / after['mean']:.1f}x), p99 {before['p99']:.3f} -> {after['p99']:.3f} ms")
+    finally:
+        await stub.stop()
+
+
+# ==========================================
+# [stream] 非流式 (等完整回复) vs 流式 (NDJSON 逐块解析)
+# ==========================================
+async def bench_stream(args):
+    stub = await StubOllama(args.delay_ms, args.tokens, args.token_ms).start()
+    print(f"🧪 [stream] 桩服务器 {stub.base_url}, {args.n} 次 /api/chat, "
+          f"prompt 处理 {args.delay_ms} ms + {args.tokens} tokens x {args.token_ms} ms")
+    try:
+        async with OllamaClient(stub.base_url) as client:
+            await client.tags()
+            blocking, streaming, speeds = [], [], []
+            for i in range(args.n):
+                # 非流式: 第一个字能展示给用户的时刻 = 整个回复返回的时刻
+                start = time.perf_counter()
+                result = await client.chat({**chat_payload(i), "stream": False})
+                blocking.append((time.perf_counter() - start) * 1000)
+
+                streamed = await client.chat_stream(chat_payload(i))
+                assert streamed["message"]["content"] == result["message"]["content"], "流式拼接结果与非流式不一致"
+                stats = streamed["stream_stats"]
+                streaming.append(stats["ttft_ms"])
+                if stats["tokens_per_sec"]:
+                    speeds.append(stats["tokens_per_sec"])
+
+        print("\n📊 首 token 延迟 (TTFT):")
+        before, after = summarize(blocking), summarize(streaming)
+        for label, s in (("非流式 (等完整回复)", before), ("流式 (NDJSON 逐块)", after)):
+            print(f"   {label:<18} mean {s['mean']:9.2f} ms | p50 {s['p50']:9.2f} ms | p99 {s['p99']:9.2f} ms")
+        print(f"   ⚡ TTFT 降低 {before['mean'] - after['mean']:.2f} ms ({before['mean'] / after['mean']:.1f}x)")
+        if speeds:
+            print(f"   🔤 流式生成速度 {statistics.fmean(speeds):.1f} tokens/秒 (客户端测得, 首 token 之后)")
+    finally:
+        await stub.stop()
+
+
+# ==========================================
+# [cache] 回放完全相同的请求: 无缓存 vs 内存 LRU vs SQLite
+# ==========================================
+async def bench_cache(args):
+    stub = await StubOllama(args.delay_ms, args.tokens, args.token_ms).start()
+    print(f"🧪 [cache] 桩服务器 {stub.base_url}, {args.unique} 个不同请求 x {args.rounds} 轮回放, "
+          f"每次生成约 {args.delay_ms + args.tokens * args.token_ms:.0f} ms")
+
+    def replay_payload(i, temperature):
+        return {**chat_payload(i), "options": {"temperature": temperature}}
+
+    async def replay(cache, temperature=0):
+        stub.reset()
+        latencies = []
+        async with OllamaClient(stub.base_url, cache=cache) as client:
+            for _ in range(args.rounds):
+                for i in range(args.unique):
+                    start = time.perf_counter()
+                    await client.chat(replay_payload(i, temperature))
+                    latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    def report(label, latencies, cache):
+        s = summarize(latencies)
+        line = f"   {label:<24} mean {s['mean']:8.2f} ms | p50 {s['p50']:8.2f} ms | 实际请求 {stub.requests:4d} 次"
+        if cache is not None:
+            stats = cache.stats()
+            line += f" | 命中率 {stats['hit_ratio']:.0%} (磁盘 {stats['disk_hits']}) | 节省 {stats['saved_ms']:.0f} ms"
+        print(line)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "llm_cache.sqlite")
+        try:
+            print()
+            report("无缓存", await replay(None), None)
+
+            cache = ResponseCache(max_entries=args.max_entries)
+            report("内存 LRU", await replay(cache), cache)
+
+            cache = ResponseCache(max_entries=args.max_entries, path=db_path)
+            report("内存 + SQLite (首次运行)", await replay(cache), cache)
+            cache.close()
+
+            # 下一次回放: 新进程内存是空的, 从 SQLite 读回
+            cache = ResponseCache(max_entries=args.max_entries, path=db_path)
+            report("内存 + SQLite (再次运行)", await replay(cache), cache)
+            cache.close()
+
+            # 采样温度不为 0 时结果不确定, 默认不缓存
+            cache = ResponseCache(max_entries=args.max_entries)
+            report("temperature=0.8 (不缓存)", await replay(cache, temperature=0.8), cache)
+        finally:
+            await stub.stop()
+
+
+# ==========================================
+# [singleflight] 突发的相同请求: 各自调用上游 vs 合并成一次
+# ==========================================
+async def bench_singleflight(args):
+    stub = await StubOllama(args.delay_ms, args.tokens, args.token_ms, args.parallel).start()
+    print(f"🧪 [singleflight] 桩服务器 {stub.base_url}, {args.bursts} 轮 x {args.burst} 个同时到达的相同请求, "
+          f"模型并行度 {args.parallel}")
+
+    kinds = {
+        "chat": lambda client, b: client.chat({**chat_payload(b), "stream": False}),
+        "chat 流式 (TTFT)": lambda client, b: client.chat_stream(chat_payload(b)),
+        "embeddings": lambda client, b: client.embeddings("nomic-embed-text", f"第 {b} 段文本"),
+    }
+    try:
+        for name, call in kinds.items():
+            print(f"\n📊 {name}:")
+            for coalesce in (False, True):
+                stub.reset()
+                latencies = []
+                async with OllamaClient(stub.base_url, limit_per_host=args.burst, coalesce=coalesce) as client:
+                    await client.tags()
+                    stub.reset()
+
+                    async def one(b):
+                        start = time.perf_counter()
+                        result = await call(client, b)
+                        if isinstance(result, dict) and "stream_stats" in result:
+                            latencies.append(result["stream_stats"]["ttft_ms"])
+                        else:
+                            latencies.append((time.perf_counter() - start) * 1000)
+
+                    for b in range(args.bursts):
+                        await asyncio.gather(*(one(b) for _ in range(args.burst)))
+                s = summarize(latencies)
+                label = "合并 (single-flight)" if coalesce else "各自调用"
+                print(f"   {label:<20} mean {s['mean']:8.2f} ms | p50 {s['p50']:8.2f} ms | p99 {s['p99']:8.2f} ms | "
+                      f"上游请求 {stub.requests} 次")
+    finally:
+        await stub.stop()
+
+
+# ==========================================
+# [embed] 知识库录入: 逐条 embedding vs 批量 /api/embed + 有界并发
+# ==========================================
+class CheckingSink(rag_ingest.NullSink):
+    """核对每条文本拿到的是它自己的向量 (批量 / 并发不能错位)"""
+
+    async def write(self, rows):
+        for text, vector in rows:
+            assert vector[:2] == StubOllama.fake_embedding(text)[:2], f"向量错位: {text}"
+        await super().write(rows)
+
+
+async def bench_embed(args):
+    stub = await StubOllama(args.delay_ms, parallel=args.parallel, item_ms=args.item_ms).start()
+    texts = [f"知识片段 {i}: Ollama / LangGraph / pgvector 笔记" for i in range(args.n)]
+    print(f"🧪 [embed] 桩服务器 {stub.base_url}, {args.n} 条文本, 每次请求 {args.delay_ms} ms + 每条 {args.item_ms} ms, "
+          f"模型并行度 {args.parallel}")
+    try:
+        # 改造前: 逐条请求 (每次新建会话), 逐条写入
+        baseline = texts[:args.baseline_n]
+        stub.reset()
+        start = time.perf_counter()
+        for text in baseline:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(stub.base_url + "/api/embeddings",
+                                        json={"model": "nomic-embed-text", "prompt": text}) as resp:
+                    (await resp.json())["embedding"]
+        rate = len(baseline) / (time.perf_counter() - start)
+        print(f"\n   {'逐条 (改造前, 抽样 ' + str(len(baseline)) + ' 条)':<28} {rate:9.1f} 条/秒 | 上游请求 {stub.requests}")
+
+        for batch_size, concurrency in ((args.batch_size, 1), (args.batch_size, args.concurrency)):
+            stub.reset()
+            sink = CheckingSink()
+            async with OllamaClient(stub.base_url, limit_per_host=max(concurrency, 8)) as client:
+                progress = await rag_ingest.ingest(texts, sink, batch_size=batch_size, concurrency=concurrency,
+                                                   client=client, interval=0)
+            assert sink.rows == len(texts)
+            label = f"批量 {batch_size} 条 x 并发 {concurrency}"
+            print(f"   {label:<28} {progress.rate:9.1f} 条/秒 | 上游请求 {stub.requests} ({rate and progress.rate / rate:.0f}x)")
+    finally:
+        await stub.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ollama 调用性能对比 (本地桩服务器)")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    pool = sub.add_parser("pool", help="每次新建会话 vs 共享 keep-alive 连接池")
+    pool.add_argument("-n", type=int, default=300, help="每组调用次数")
+    pool.add_argument("--concurrency", type=int, default=16, help="并发组的并发数")
+    pool.add_argument("--limit-per-host", type=int, default=8, help="共享连接池的单主机连接上限 (至少等于并发数)")
+    pool.add_argument("--delay-ms", type=float, default=0.0, help="桩服务器模拟的模型耗时")
+    pool.set_defaults(run=bench_pool)
+
+    stream = sub.add_parser("stream", help="非流式 vs 流式的首 token 延迟与生成速度")
+    stream.add_argument("-n", type=int, default=20, help="调用次数")
+    stream.add_argument("--delay-ms", type=float, default=50.0, help="首 token 前的 prompt 处理耗时")
+    stream.add_argument("--tokens", type=int, default=100, help="每次回复的 token 数")
+    stream.add_argument("--token-ms", type=float, default=10.0, help="每个 token 的生成耗时")
+    stream.set_defaults(run=bench_stream)
+
+    cache = sub.add_parser("cache", help="响应缓存: 回放相同请求的命中率与节省的延迟")
+    cache.add_argument("--unique", type=int, default=20, help="不同请求的个数")
+    cache.add_argument("--rounds", type=int, default=5, help="回放轮数")
+    cache.add_argument("--max-entries", type=int, default=1024, help="内存 LRU 的条目上限")
+    cache.add_argument("--delay-ms", type=float, default=20.0, help="首 token 前的 prompt 处理耗时")
+    cache.add_argument("--tokens", type=int, default=20, help="每次回复的 token 数")
+    cache.add_argument("--token-ms", type=float, default=1.0, help="每个 token 的生成耗时")
+    cache.set_defaults(run=bench_cache)
+
+    flight = sub.add_parser("singleflight", help="请求合并: 突发的相同请求只打一次上游")
+    flight.add_argument("--bursts", type=int, default=5, help="突发轮数 (每轮换一个问题)")
+    flight.add_argument("--burst", type=int, default=32, help="每轮同时到达的相同请求数")
+    flight.add_argument("--parallel", type=int, default=2, help="桩服务器同时处理的请求数 (OLLAMA_NUM_PARALLEL)")
+    flight.add_argument("--delay-ms", type=float, default=20.0, help="首 token 前的 prompt 处理耗时")
+    flight.add_argument("--tokens", type=int, default=20, help="每次回复的 token 数")
+    flight.add_argument("--token-ms", type=float, default=1.0, help="每个 token 的生成耗时")
+    flight.set_defaults(run=bench_singleflight)
+
+    embed = sub.add_parser("embed", help="知识库录入: 逐条 vs 批量 /api/embed + 并发")
+    embed.add_argument("-n", type=int, default=5000, help="录入的文本条数")
+    embed.add_argument("--baseline-n", type=int, default=200, help="逐条方式只抽样这么多条 (太慢)")
+    embed.add_argument("--batch-size", type=int, default=64)
+    embed.add_argument("--concurrency", type=int, default=4)
+    embed.add_argument("--parallel", type=int, default=4, help="桩服务器同时处理的请求数")
+    embed.add_argument("--delay-ms", type=float, default=5.0, help="每次请求的固定开销")
+    embed.add_argument("--item-ms", type=float, default=0.2, help="每条文本的 embedding 耗时")
+    embed.set_defaults(run=bench_embed)
+
+    args = parser.parse_args(argv)
+    asyncio.run(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
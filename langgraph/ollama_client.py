@@ -0,0 +1,615 @@
+"""
+Ollama 共享异步客户端 (langgraph 2.1 ~ 2.10 共用)
+
+原来每个节点每次调用都新建一个 aiohttp.ClientSession, 每一轮对话都要重新建立 TCP 连接、初始化会话。
+这里整个进程共用一个带 keep-alive 连接池的会话, 由 main() 用 ollama_session() 管理生命周期:
+
+    async def main():
+        async with ollama_session():
+            await app.ainvoke(...)
+
+节点里直接 await chat(payload) / generate(payload) / embeddings(model, text) / embed(model, texts)。
+需要边生成边输出时用 await chat_stream(payload, node="llm"), token 写进图的 custom 流,
+main() 里用 stream_graph(app, input) 代替 app.ainvoke(input) 即可实时打印。
+
+回归 / 回放时可以打开精确匹配的响应缓存 (只缓存 temperature=0 的请求, 除非 OLLAMA_CACHE_ALWAYS=1):
+  OLLAMA_CACHE=memory python 2.4-langgraph-tool-calling.py
+  OLLAMA_CACHE=db_data/llm_cache.sqlite OLLAMA_CACHE_ALWAYS=1 python 2.10-langgraph-multi-agent.py
+
+多人同时发出完全相同的请求时, OllamaClient(coalesce=True) 只向 Ollama 发一次, 结果 (流式时逐块) 分发给所有人;
+ollama_session() 默认打开 (OLLAMA_COALESCE=0 关闭), 并行分支问同一个问题时只占用一次模型;
+SingleFlight 也可以单独用在接口层 (见 2.12-fastapi-streaming.py)。
+性能对比见 ollama_bench.py (本地桩服务器, 不需要真的 Ollama)。
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+
+
+# ==========================================
+# [流式统计] 首 token 延迟 (TTFT) 与生成速度
+# ==========================================
+class StreamStats:
+    """一次流式调用的计时: ttft_ms 是从发出请求到收到第一个 token, tokens_per_sec 是首 token 之后的生成速度"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first = None
+        self.end = None
+        self.chunks = 0
+        self.eval_count = None
+
+    def token(self):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.chunks += 1
+
+    def finish(self, last_chunk):
+        self.end = time.perf_counter()
+        # 最后一块带有 Ollama 自己统计的 eval_count, 比按块计数更准 (一块可能不止一个 token)
+        self.eval_count = last_chunk.get("eval_count")
+
+    def to_dict(self):
+        end = self.end or time.perf_counter()
+        first = self.first or end
+        tokens = self.eval_count or self.chunks
+        generating = end - first
+        return {
+            "ttft_ms": (first - self.start) * 1000,
+            "total_ms": (end - self.start) * 1000,
+            "tokens": tokens,
+            "tokens_per_sec": (tokens - 1) / generating if tokens > 1 and generating > 0 else None,
+        }
+
+
+# ==========================================
+# [响应缓存] 完全相同的请求直接返回上次的结果
+# ==========================================
+class ResponseCache:
+    """精确匹配的 LLM 响应缓存: 内存 LRU + 可选的 SQLite 持久层
+
+    键是请求体规范化 JSON (键排序, 去掉 stream / keep_alive 这类不影响结果的字段) 的 SHA-256,
+    覆盖 model、messages / prompt、tools、format、options。采样结果不确定, 默认只缓存 temperature=0 的请求;
+    always=True 时 (回放录制好的会话) 不管温度全部缓存。embedding 结果是确定的, 总是可以缓存。
+    SQLite 的查询和提交 (fsync) 都在一个专用线程里串行执行, 不阻塞事件循环; 内存 LRU 直接在事件循环里读写。
+    """
+
+    # 这些字段只影响传输方式或模型驻留时间, 不影响生成内容
+    TRANSPORT_FIELDS = ("stream", "keep_alive")
+    DETERMINISTIC_PATHS = ("/api/embeddings", "/api/embed")
+
+    def __init__(self, max_entries=1024, path=None, always=False, max_rows=100_000):
+        self.max_entries = max_entries
+        self.always = always
+        self.max_rows = max_rows
+        self.memory = OrderedDict()  # key -> (JSON 字符串, 原始耗时 ms)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+        self.conn = None
+        self._disk = None
+        if path:
+            import sqlite3
+            # 连接只在 _disk 这一个线程里使用 (建表除外), 单线程执行器同时保证了写入顺序
+            self.conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+            self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ollama-cache")
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    latency_ms REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_last_access ON llm_responses (last_access)")
+            self.conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """OLLAMA_CACHE=memory 只用内存, 其他值当作 SQLite 文件路径; 没设置时返回 None (不缓存)"""
+        target = os.environ.get("OLLAMA_CACHE")
+        if not target:
+            return None
+        always = os.environ.get("OLLAMA_CACHE_ALWAYS", "") not in ("", "0")
+        return cls(path=None if target == "memory" else target, always=always)
+
+    def cacheable(self, path, payload):
+        if not payload:
+            return False
+        if path in self.DETERMINISTIC_PATHS or self.always:
+            return True
+        return (payload.get("options") or {}).get("temperature") == 0
+
+    @classmethod
+    def make_key(cls, path, payload):
+        canonical = {k: v for k, v in payload.items() if k not in cls.TRANSPORT_FIELDS}
+        text = json.dumps([path, canonical], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    async def get(self, key):
+        """命中时返回结果的新副本 (调用方改了也不会污染缓存)"""
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+        elif self.conn is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(self._disk, self._disk_get, key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._remember(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_ms += entry[1]
+        return json.loads(entry[0])
+
+    def put(self, key, result, latency_ms):
+        """写入内存后立即返回; 落盘交给 _disk 线程在后台完成 (close() 时等它写完)"""
+        value = json.dumps(result, ensure_ascii=False)
+        self._remember(key, (value, latency_ms))
+        if self.conn is not None:
+            self._disk.submit(self._disk_put, key, value, latency_ms)
+
+    def _disk_get(self, key):
+        row = self.conn.execute("SELECT value, latency_ms FROM llm_responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0], row[1]
+
+    def _disk_put(self, key, value, latency_ms):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO llm_responses (key, value, latency_ms, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, latency_ms, time.time()),
+        )
+        # 超过行数上限时删掉最久未访问的 10%
+        count = self.conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        if count > self.max_rows:
+            self.conn.execute(
+                "DELETE FROM llm_responses WHERE key IN "
+                "(SELECT key FROM llm_responses ORDER BY last_access LIMIT ?)", (count - int(self.max_rows * 0.9),))
+        self.conn.commit()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "saved_ms": self.saved_ms,
+            "entries": len(self.memory),
+        }
+
+    def close(self):
+        if self.conn is not None:
+            self._disk.shutdown(wait=True)  # 等排队中的写入落盘
+            self.conn.close()
+            self.conn = None
+
+
+# ==========================================
+# [请求合并] 同时到达的相同请求只打一次上游
+# ==========================================
+class Broadcast:
+    """把一个异步迭代器的输出分发给多个订阅者
+
+    上游在独立的 task 里读取, 收到的块全部保留: 晚到的订阅者先补发已有的块, 再跟着实时接收。
+    最后一个订阅者离开 (客户端断开) 时取消上游, 不再为没人听的回答占用模型。
+    """
+
+    def __init__(self, source):
+        self.chunks = []
+        self.error = None
+        self.done = False
+        self.closed = False
+        self.subscribers = 0
+        self._wake = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    def _notify(self):
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            # 订阅者从 error / done 得知失败; 任务本身保持 cancelled 状态, 关闭时 await / cancel 它的人能看到
+            self.error = RuntimeError("上游请求已取消")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        i = 0
+        try:
+            while True:
+                while i < len(self.chunks):
+                    yield self.chunks[i]
+                    i += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._wake.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.closed = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    """进行中请求合并 (single-flight): 同一个 key 同时只有一个上游调用, 其余调用者共享它的结果
+
+    do() 用于一次性返回的请求, stream() 用于流式请求 (逐块分发)。请求结束后 key 立即释放,
+    之后的相同请求会重新调用上游 (要复用历史结果用 ResponseCache)。
+    temperature > 0 时合并后大家拿到的是同一次采样, 对 "同时问同一个问题" 来说这正是想要的。
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.streams = {}
+        self.leaders = 0
+        self.joined = 0
+
+    async def do(self, key, fn):
+        future = self.calls.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._finished(self.calls, key, f))
+        else:
+            self.joined += 1
+        # shield: 发起者自己被取消 (客户端断开) 时不连累其他等待者
+        return await asyncio.shield(future)
+
+    def stream(self, key, factory):
+        """factory() 返回上游异步迭代器; 返回值是当前调用者的订阅迭代器"""
+        broadcast = self.streams.get(key)
+        if broadcast is None or broadcast.closed:
+            self.leaders += 1
+            broadcast = Broadcast(factory())
+            self.streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._finished(self.streams, key, broadcast))
+        else:
+            self.joined += 1
+        return broadcast.subscribe()
+
+    @staticmethod
+    def _finished(flights, key, flight):
+        if flights.get(key) is flight:
+            del flights[key]
+        # 所有等待者都已离开时, 取走异常避免 "exception was never retrieved" 警告
+        if isinstance(flight, asyncio.Future) and not flight.cancelled():
+            flight.exception()
+
+    def stats(self):
+        total = self.leaders + self.joined
+        return {"upstream": self.leaders, "joined": self.joined, "coalesced_ratio": self.joined / total if total else 0.0}
+
+
+# ==========================================
+# [连接池] 一个会话 + 一个连接器, 连接在多次调用之间复用
+# ==========================================
+class OllamaClient:
+    """带 keep-alive 连接池的 Ollama 客户端
+
+    limit 是总连接数上限, limit_per_host 是单个 Ollama 实例的并发连接上限 (超出的请求排队等待空闲连接,
+    与 Ollama 的 OLLAMA_NUM_PARALLEL 配合设置); keepalive_timeout 秒内没有复用的空闲连接才会被关闭。
+    """
+
+    def __init__(self, base_url=OLLAMA_URL, limit=64, limit_per_host=8, keepalive_timeout=60.0, timeout=300.0,
+                 cache=None, coalesce=False):
+        self.base_url = base_url
+        self.cache = cache
+        self.flights = SingleFlight() if coalesce else None
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.requests = 0
+        self._session = None
+        self._loop = None
+
+    @property
+    def session(self):
+        """第一次使用时在当前事件循环里创建会话; close() 之后可以在新的事件循环 (又一次 asyncio.run) 里重新创建
+
+        会话和它的连接只能在创建它的事件循环里使用和关闭; 没 close() 就换了事件循环时直接报错,
+        不悄悄新建一个, 把旧连接池的 socket 泄漏掉。
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is not loop:
+            raise RuntimeError("OllamaClient 的连接池属于另一个事件循环: 先在原来的事件循环里 await close(), "
+                               "或者每个 asyncio.run() 用自己的 ollama_session()")
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                self.base_url, connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._loop = loop
+        return self._session
+
+    def _cache_key(self, path, payload):
+        if self.cache is not None and self.cache.cacheable(path, payload):
+            return self.cache.make_key(path, payload)
+        return None
+
+    async def request_json(self, method, path, payload=None, timeout=None, raise_for_status=True):
+        """发送请求并解析 JSON 响应; raise_for_status=False 时 4xx/5xx 也返回响应体 (Ollama 把错误写在 error 字段)"""
+        key = self._cache_key(path, payload) if method == "POST" else None
+        if key is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+        fetch = lambda: self._fetch_json(method, path, payload, timeout, raise_for_status, key)
+        if self.flights is None or method != "POST":
+            return await fetch()
+        # 相同请求正在进行中就等它的结果; 每个调用者拿到自己的副本, 互相修改不影响
+        return copy.deepcopy(await self.flights.do(ResponseCache.make_key(path, payload), fetch))
+
+    async def _fetch_json(self, method, path, payload, timeout, raise_for_status, cache_key):
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        self.requests += 1
+        start = time.perf_counter()
+        async with self.session.request(method, path, json=payload, **kwargs) as response:
+            if raise_for_status:
+                response.raise_for_status()
+            result = await response.json()
+        # 只缓存成功的结果, 报错 (模型不存在、显存不足等) 下次还要重试
+        if cache_key is not None and response.status == 200 and "error" not in result:
+            self.cache.put(cache_key, result, (time.perf_counter() - start) * 1000)
+        return result
+
+    async def chat(self, payload, **kwargs):
+        return await self.request_json("POST", "/api/chat", payload, **kwargs)
+
+    async def generate(self, payload, **kwargs):
+        return await self.request_json("POST", "/api/generate", payload, **kwargs)
+
+    async def embeddings(self, model, prompt, **kwargs):
+        result = await self.request_json("POST", "/api/embeddings", {"model": model, "prompt": prompt}, **kwargs)
+        return result["embedding"]
+
+    async def embed(self, model, inputs, **kwargs):
+        """批量 embedding (/api/embed, 一次请求多条文本), 返回与 inputs 顺序一致的向量列表"""
+        result = await self.request_json("POST", "/api/embed", {"model": model, "input": list(inputs)}, **kwargs)
+        return result["embeddings"]
+
+    async def tags(self, **kwargs):
+        return await self.request_json("GET", "/api/tags", **kwargs)
+
+    async def stream(self, path, payload, **kwargs):
+        """流式请求: 按块读取 Ollama 的 NDJSON 响应, 每凑齐一行就解析并产出一个字典 (不等整个响应结束)
+
+        开启 coalesce 时, 相同的流式请求共用一个上游响应, 每个块分发给所有调用者 (块是共享的, 只读)。
+        """
+        if self.flights is None:
+            async for chunk in self._stream_upstream(path, payload, **kwargs):
+                yield chunk
+            return
+        key = ResponseCache.make_key(path, payload)
+        async for chunk in self.flights.stream(key, lambda: self._stream_upstream(path, payload, **kwargs)):
+            yield chunk
+
+    async def _stream_upstream(self, path, payload, timeout=None, raise_for_status=True):
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        self.requests += 1
+        async with self.session.post(path, json={**payload, "stream": True}, **kwargs) as response:
+            if raise_for_status:
+                response.raise_for_status()
+            buffer = b""
+            async for data in response.content.iter_any():
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+            if buffer.strip():
+                yield json.loads(buffer)
+
+    async def chat_stream(self, payload, on_token=None, **kwargs):
+        """流式 chat: 每个 token 回调 on_token(text), 结束后拼出与非流式相同结构的结果 (另带 stream_stats)
+
+        出错时 (HTTP 报错且 raise_for_status=False, 或生成中途的 error 块) 原样返回错误块, 与非流式一样没有 message 字段。
+        """
+        stats = StreamStats()
+        key = self._cache_key("/api/chat", payload)
+        cached = await self.cache.get(key) if key is not None else None
+        if cached is not None:
+            # 命中缓存: 整段回复当作一个 token 推给调用方
+            token = cached["message"].get("content", "")
+            if token:
+                stats.token()
+                if on_token:
+                    on_token(token)
+            stats.finish(cached)
+            return {**cached, "stream_stats": {**stats.to_dict(), "tokens_per_sec": None, "cached": True}}
+        content = []
+        tool_calls = []
+        last = {}
+        async for chunk in self.stream("/api/chat", payload, **kwargs):
+            if "error" in chunk:
+                return chunk
+            message = chunk.get("message") or {}
+            token = message.get("content", "")
+            if message.get("tool_calls"):
+                # 工具调用一般整块出现在某一帧里, 按顺序收集
+                tool_calls += message["tool_calls"]
+                stats.token()
+            if token:
+                stats.token()
+                content.append(token)
+                if on_token:
+                    on_token(token)
+            last = chunk
+        stats.finish(last)
+        message = {"role": (last.get("message") or {}).get("role", "assistant"), "content": "".join(content)}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        result = {**last, "message": message}
+        if key is not None and last.get("done"):
+            self.cache.put(key, result, stats.to_dict()["total_ms"])
+        return {**result, "stream_stats": stats.to_dict()}
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+
+# ==========================================
+# [生命周期] 进程内共享的客户端
+# ==========================================
+_client = None
+
+
+def get_client() -> OllamaClient:
+    """返回 ollama_session() 管理的共享客户端
+
+    不在 ollama_session() 里时直接报错, 不悄悄创建一个没人关闭的连接池 (asyncio.run 退出时泄漏连接);
+    单独使用时自己创建 OllamaClient 并用 async with 管理。
+    """
+    if _client is None:
+        raise RuntimeError("没有可用的 Ollama 客户端: 请在 async with ollama_session(): 里调用, "
+                           "或者显式传入 async with OllamaClient() as client 创建的客户端")
+    return _client
+
+
+@asynccontextmanager
+async def ollama_session(**options):
+    """在 main() 外面包一层: 进入时创建共享客户端 (参数同 OllamaClient), 退出时关闭连接池
+
+    没有传 cache 时按环境变量 OLLAMA_CACHE 决定是否启用响应缓存, 退出时打印命中率和节省的时间;
+    没有传 coalesce 时默认合并同时进行的相同请求, OLLAMA_COALESCE=0 关闭。
+    """
+    global _client
+    previous = _client
+    owns_cache = "cache" not in options
+    if owns_cache:
+        options["cache"] = ResponseCache.from_env()
+    options.setdefault("coalesce", os.environ.get("OLLAMA_COALESCE", "1") not in ("", "0"))
+    _client = OllamaClient(**options)
+    try:
+        yield _client
+    finally:
+        await _client.close()
+        cache = _client.cache
+        if cache is not None and cache.hits + cache.misses:
+            stats = cache.stats()
+            print(f"🗃️ [响应缓存] 命中 {stats['hits']}/{stats['hits'] + stats['misses']} "
+                  f"({stats['hit_ratio']:.0%}, 其中磁盘 {stats['disk_hits']}), 节省约 {stats['saved_ms']:.0f} ms")
+        if owns_cache and cache is not None:
+            cache.close()
+        if _client.flights is not None and _client.flights.joined:
+            stats = _client.flights.stats()
+            print(f"🔗 [请求合并] 上游 {stats['upstream']} 次, 合并 {stats['joined']} 次 ({stats['coalesced_ratio']:.0%})")
+        _client = previous
+
+
+async def chat(payload, **kwargs):
+    return await get_client().chat(payload, **kwargs)
+
+
+async def generate(payload, **kwargs):
+    return await get_client().generate(payload, **kwargs)
+
+
+async def embeddings(model, prompt, **kwargs):
+    return await get_client().embeddings(model, prompt, **kwargs)
+
+
+async def embed(model, inputs, **kwargs):
+    return await get_client().embed(model, inputs, **kwargs)
+
+
+async def tags(**kwargs):
+    return await get_client().tags(**kwargs)
+
+
+# ==========================================
+# [流式输出] 节点里的 token 通过 LangGraph 的 custom 流推给调用方
+# ==========================================
+def graph_writer():
+    """在 LangGraph 节点里返回 custom 流的写入函数; 不在图里运行 (或没装 langgraph) 时返回 None"""
+    try:
+        from langgraph.config import get_stream_writer
+        return get_stream_writer()
+    except (ImportError, RuntimeError):
+        return None
+
+
+async def chat_stream(payload, node=None, on_token=None, **kwargs):
+    """流式 chat; 在节点里调用时每个 token 写成 {"node", "token"}, 结束时写一条 {"node", "stats"}"""
+    writer = graph_writer() if on_token is None else None
+    if writer:
+        on_token = lambda token: writer({"node": node, "token": token})
+    result = await get_client().chat_stream(payload, on_token=on_token, **kwargs)
+    if writer and "stream_stats" in result:
+        writer({"node": node, "stats": result["stream_stats"]})
+    return result
+
+
+async def stream_graph(app, graph_input, config=None):
+    """代替 app.ainvoke: 边运行边打印节点写出的 token 和 TTFT, 返回最终 State (与 ainvoke 的返回值相同)"""
+    final_state = None
+    speaking = None
+    async for mode, chunk in app.astream(graph_input, config=config, stream_mode=["custom", "values"]):
+        if mode == "values":
+            final_state = chunk
+        elif "token" in chunk:
+            if speaking != chunk["node"]:
+                speaking = chunk["node"]
+                print(f"   💬 [{speaking}] ", end="")
+            print(chunk["token"], end="", flush=True)
+        elif "stats" in chunk:
+            stats = chunk["stats"]
+            speed = f"{stats['tokens_per_sec']:.1f} tokens/秒" if stats["tokens_per_sec"] else "-"
+            if stats.get("cached"):
+                speed = "缓存命中"
+            # 换行一起写出: 同步的路由函数在线程池里运行, 分开写的换行可能被它的 print 插队
+            print(f"\n   ⏱️ [{chunk['node']}] 首 token {stats['ttft_ms']:.0f} ms, "
+                  f"共 {stats['tokens']} tokens / {stats['total_ms']:.0f} ms, {speed}\n", end="", flush=True)
+            speaking = None
+    return final_state
@@ -0,0 +1,592 @@
+"""
+RAG 向量检索后端 (2.9 retrieve_node 可插拔)
+
+  pgvector  PostgreSQL + pgvector (原来的方式, 需要数据库服务)
+  numpy     进程内精确检索: 归一化后的 float32 矩阵, 余弦 top-k = 一次矩阵乘 + argpartition, 适合几万条以内
+  ivf       进程内近似检索 (IVF-Flat): k-means 把向量分到 nlist 个桶, 查询只扫最近的 nprobe 个桶, 适合几十万条以上
+
+进程内索引保存成一个目录 (.npy + 文本 blob), 加载时 np.load(mmap_mode="r") 直接映射文件, 不读入内存也不反序列化,
+几十万条的索引瞬间可用; 查询只解码命中的那几条文本。
+
+用法:
+  python rag_ingest.py knowledge.txt --store ivf --out db_data/kb_ivf      # 录入并保存索引
+  RAG_VECTOR_STORE=ivf RAG_VECTOR_PATH=db_data/kb_ivf python 2.9-langgraph-rag-memory.py
+  python vector_store.py bench -n 100000 --nprobe 4,8,16,32                 # 与精确检索对比召回率和延迟
+"""
+
+import argparse
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+
+STORE_KINDS = ("pgvector", "numpy", "ivf")
+
+
+def _load_numpy():
+    """numpy 只有进程内索引需要; 默认的 pgvector 后端不依赖它"""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("进程内向量检索 (numpy / ivf) 需要 numpy: pip install numpy") from None
+    return numpy
+
+
+def normalize(vectors):
+    """转成 float32 并按行归一化, 之后余弦相似度就是点积"""
+    np = _load_numpy()
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """一维分数里最大的 k 个下标 (从大到小); argpartition 是 O(n), 只对选出的 k 个排序"""
+    np = _load_numpy()
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+# ==========================================
+# [接口] write(rows) 录入 (与 rag_ingest 的 sink 相同), search(vector, k) 检索
+# ==========================================
+class VectorStore(ABC):
+    kind = None
+
+    @abstractmethod
+    async def write(self, rows):
+        """rows: [(文本, 向量), ...]"""
+
+    @abstractmethod
+    async def search(self, query, k=1):
+        """返回 [(余弦相似度, 文本), ...], 按相似度从高到低"""
+
+    async def close(self):
+        pass
+
+
+class PgvectorStore(VectorStore):
+    """PostgreSQL + pgvector; 连接在整个会话里复用 (原来每次检索都重新连接)"""
+
+    kind = "pgvector"
+
+    def __init__(self, conn, table="memories"):
+        from rag_ingest import PgvectorSink
+
+        self.conn = conn
+        self.table = table
+        self.sink = PgvectorSink(conn, table)
+
+    @classmethod
+    async def connect(cls, db_uri, dim=768, truncate=False):
+        import psycopg
+        from rag_ingest import prepare_table
+
+        conn = await psycopg.AsyncConnection.connect(db_uri, autocommit=True)
+        await prepare_table(conn, dim, truncate)
+        return cls(conn)
+
+    async def write(self, rows):
+        await self.sink.write(rows)
+
+    async def search(self, query, k=1):
+        async with self.conn.cursor() as cur:
+            await cur.execute(
+                f"SELECT 1 - (embedding <=> %s::vector), content FROM {self.table} "
+                f"ORDER BY embedding <=> %s::vector LIMIT %s", (query, query, k))
+            return [(float(score), content) for score, content in await cur.fetchall()]
+
+    async def close(self):
+        await self.conn.close()
+
+
+# ==========================================
+# [文本] UTF-8 blob + 偏移表, 追加 / 重排都在字节层面做, 检索时只解码命中的几条
+# ==========================================
+class PackedTexts:
+    def __init__(self, blob=None, offsets=None):
+        np = _load_numpy()
+        self.blob = np.zeros(0, dtype=np.uint8) if blob is None else blob
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+
+    @classmethod
+    def from_strings(cls, texts):
+        np = _load_numpy()
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def concat(self, other):
+        np = _load_numpy()
+        blob = np.concatenate([self.blob, other.blob])
+        offsets = np.concatenate([self.offsets[:-1], np.asarray(other.offsets) + self.offsets[-1]])
+        return PackedTexts(blob, offsets)
+
+    def take(self, order):
+        """按 order 重排; 下标连续的一段只切一次 blob (并入增量时大部分行都是成段的)"""
+        np = _load_numpy()
+        order = np.asarray(order, dtype=np.int64)
+        if not len(order):
+            return PackedTexts()
+        lengths = np.diff(self.offsets)[order]
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        breaks = np.flatnonzero(np.diff(order) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        ends = np.concatenate([breaks, [len(order)]])
+        blob = np.concatenate([
+            self.blob[self.offsets[order[a]]:self.offsets[order[b - 1] + 1]] for a, b in zip(starts, ends)
+        ])
+        return PackedTexts(blob, offsets)
+
+
+def replace_file(path, name, write):
+    """先写临时文件再 os.replace: 覆盖正被内存映射的旧索引时, 旧映射仍指向原来的文件, 不会读到半截数据"""
+    target = os.path.join(path, name)
+    with open(target + ".tmp", "wb") as f:
+        write(f)
+    os.replace(target + ".tmp", target)
+
+
+def save_array(path, name, array):
+    np = _load_numpy()
+    replace_file(path, name, lambda f: np.save(f, array))
+
+
+def save_texts(path, texts):
+    np = _load_numpy()
+    replace_file(path, "texts.bin", lambda f: f.write(memoryview(np.ascontiguousarray(texts.blob))))
+    save_array(path, "text_offsets.npy", texts.offsets)
+
+
+def load_texts(path):
+    np = _load_numpy()
+    offsets = np.load(os.path.join(path, "text_offsets.npy"), mmap_mode="r")
+    blob_path = os.path.join(path, "texts.bin")
+    # 空文件不能 memmap
+    blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else None
+    return PackedTexts(blob, offsets)
+
+
+# ==========================================
+# [numpy] 精确检索
+# ==========================================
+class NumpyStore(VectorStore):
+    """全部向量放在一个归一化的 float32 矩阵里; 新增的向量先攒着, 下次检索前一次性拼接"""
+
+    kind = "numpy"
+
+    def __init__(self, dim=None):
+        np = _load_numpy()
+        self.dim = dim
+        self.vectors = np.zeros((0, dim or 0), dtype=np.float32)
+        self.texts = PackedTexts()
+        self._new_vectors = []
+        self._new_texts = []
+
+    def __len__(self):
+        return len(self.texts) + len(self._new_texts)
+
+    def add(self, texts, vectors):
+        vectors = normalize(vectors)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.vectors = self.vectors.reshape(0, self.dim)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致")
+        self._new_vectors.append(vectors)
+        self._new_texts.extend(texts)
+
+    def _flush(self):
+        np = _load_numpy()
+        if not self._new_vectors:
+            return False
+        self.vectors = np.concatenate([self.vectors, *self._new_vectors])
+        self.texts = self.texts.concat(PackedTexts.from_strings(self._new_texts))
+        self._new_vectors = []
+        self._new_texts = []
+        return True
+
+    def topk(self, queries, k=10):
+        """批量检索: queries 为 (m, dim), 返回 (分数, 下标) 两个 (m, k) 数组"""
+        np = _load_numpy()
+        self._flush()
+        queries = normalize(np.atleast_2d(queries))
+        k = min(k, len(self.vectors))
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        scores = queries @ self.vectors.T
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        picked = np.take_along_axis(scores, idx, axis=1)
+        order = np.argsort(-picked, axis=1)
+        return np.take_along_axis(picked, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+    async def write(self, rows):
+        if rows:
+            texts, vectors = zip(*rows)
+            self.add(texts, vectors)
+
+    async def search(self, query, k=1):
+        scores, ids = self.topk(query, k)
+        return [(float(s), self.texts[i]) for s, i in zip(scores[0], ids[0])]
+
+    def _meta(self):
+        return {"kind": self.kind, "dim": self.dim, "count": len(self.texts)}
+
+    def save(self, path):
+        self._flush()
+        os.makedirs(path, exist_ok=True)
+        save_array(path, "vectors.npy", self.vectors)
+        save_texts(path, self.texts)
+        self._save_extra(path)
+        # meta.json 最后写: 读者看到新 meta 时其余文件都已就位
+        replace_file(path, "meta.json", lambda f: f.write(json.dumps(self._meta(), ensure_ascii=False).encode("utf-8")))
+
+    def _save_extra(self, path):
+        pass
+
+    def _load_arrays(self, path, meta):
+        np = _load_numpy()
+        self.dim = meta["dim"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.texts = load_texts(path)
+
+
+def load_store(path):
+    """按 meta.json 里的类型加载进程内索引 (向量和文本都是内存映射)"""
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    store = {"numpy": NumpyStore, "ivf": IVFStore}[meta["kind"]]()
+    store._load_arrays(path, meta)
+    return store
+
+
+# ==========================================
+# [ivf] 近似检索: 倒排桶 + 只扫最近的 nprobe 个桶
+# ==========================================
+class IVFStore(NumpyStore):
+    """IVF-Flat 近似检索
+
+    建索引: 在抽样上跑球面 k-means 得到 nlist 个质心, 每个向量归到最近的质心, 再按桶重排,
+    同一个桶的向量在矩阵里连续存放 (list_offsets 记录每个桶的起止行), 检索时按行切片, 不需要下标表。
+    检索: 先和 nlist 个质心比, 再只对最近 nprobe 个桶里的向量算精确分数。nprobe 越大召回越高、越慢。
+    增量写入: 新向量分到已有的最近质心, 先放在增量段里 (检索时一并扫描被选中桶的部分),
+    增量段超过主段的 DELTA_MERGE_RATIO 或保存时才按桶并入主段; 只有显式 build(),
+    或桶大小失衡 / 数据量相对上次训练增长过多时才重新跑 k-means。
+    """
+
+    kind = "ivf"
+    TRAIN_POINTS_PER_LIST = 32
+    TRAIN_ITERATIONS = 8
+    DELTA_MERGE_RATIO = 0.1
+    # 失衡度 = nlist * sum(桶大小^2) / n^2 (每次查询的期望扫描量相对均匀分桶的倍数), 超过训练时的这个倍数就重训
+    RETRAIN_IMBALANCE = 2.0
+    RETRAIN_GROWTH = 4.0
+
+    def __init__(self, dim=None, nlist=None, nprobe=None, seed=0):
+        super().__init__(dim)
+        # 构造时指定的桶数; 不指定时每次训练按 4*sqrt(n) 重新选
+        self.fixed_nlist = nlist
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.list_offsets = None
+        self.trained_count = 0
+        self.trained_imbalance = 1.0
+        self._reset_delta()
+
+    def __len__(self):
+        return super().__len__() + len(self._delta_texts)
+
+    def _reset_delta(self):
+        np = _load_numpy()
+        self._delta_vectors = np.zeros((0, self.dim or 0), dtype=np.float32)
+        self._delta_lists = np.zeros(0, dtype=np.int64)
+        self._delta_texts = []
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        """每个向量最近的质心; 分块做, 避免 (n, nlist) 的分数矩阵一次占太多内存"""
+        np = _load_numpy()
+        assign = np.empty(len(vectors), dtype=np.int64)
+        step = max(1, (1 << 24) // len(centroids))
+        for start in range(0, len(vectors), step):
+            assign[start:start + step] = np.argmax(vectors[start:start + step] @ centroids.T, axis=1)
+        return assign
+
+    @staticmethod
+    def _imbalance(sizes):
+        np = _load_numpy()
+        n = sizes.sum()
+        return float(len(sizes) * np.sum(sizes.astype(np.float64) ** 2) / n ** 2) if n else 1.0
+
+    def _list_sizes(self):
+        np = _load_numpy()
+        return np.diff(self.list_offsets) + np.bincount(self._delta_lists, minlength=self.nlist)
+
+    def _flush(self):
+        np = _load_numpy()
+        if self.centroids is None:
+            if NumpyStore._flush(self):
+                self.build()
+            return False
+        if not self._new_vectors:
+            return False
+        vectors = np.concatenate(self._new_vectors)
+        self._delta_vectors = np.concatenate([self._delta_vectors, vectors]) if len(self._delta_texts) else vectors
+        self._delta_lists = np.concatenate([self._delta_lists, self._assign(vectors, self.centroids)])
+        self._delta_texts.extend(self._new_texts)
+        self._new_vectors = []
+        self._new_texts = []
+        sizes = self._list_sizes()
+        if (sizes.sum() > self.RETRAIN_GROWTH * self.trained_count
+                or self._imbalance(sizes) > self.RETRAIN_IMBALANCE * self.trained_imbalance):
+            self.build()
+        elif len(self._delta_texts) > self.DELTA_MERGE_RATIO * len(self.vectors):
+            self._merge()
+        return False
+
+    def _merge(self):
+        """增量段按桶并入主段: 只做一次稳定排序和拷贝, 不重新训练, 文本也不解码"""
+        np = _load_numpy()
+        if not self._delta_texts:
+            return
+        main_lists = np.repeat(np.arange(self.nlist), np.diff(self.list_offsets))
+        lists = np.concatenate([main_lists, self._delta_lists])
+        order = np.argsort(lists, kind="stable")
+        self.vectors = np.concatenate([self.vectors, self._delta_vectors])[order]
+        self.texts = self.texts.concat(PackedTexts.from_strings(self._delta_texts)).take(order)
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=self.nlist), out=self.list_offsets[1:])
+        self._reset_delta()
+
+    def build(self):
+        """(重新) 训练质心并按桶重排全部向量和文本"""
+        np = _load_numpy()
+        NumpyStore._flush(self)
+        if self._delta_texts:
+            self.vectors = np.concatenate([self.vectors, self._delta_vectors])
+            self.texts = self.texts.concat(PackedTexts.from_strings(self._delta_texts))
+            self._reset_delta()
+        n = len(self.vectors)
+        if n == 0:
+            return
+        nlist = min(self.fixed_nlist or max(1, int(4 * np.sqrt(n))), n)
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n, nlist * self.TRAIN_POINTS_PER_LIST)
+        sample = np.asarray(self.vectors[rng.choice(n, sample_size, replace=False)])
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.TRAIN_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            # 按桶排序后用 reduceat 一次求出各桶向量和 (比 np.add.at 逐行累加快一个数量级)
+            filled = counts > 0
+            starts = (np.cumsum(counts) - counts)[filled]
+            sums = np.empty_like(centroids)
+            sums[filled] = np.add.reduceat(sample[np.argsort(assign, kind="stable")], starts, axis=0)
+            # 空桶重新随机挑一个样本当质心
+            sums[~filled] = sample[rng.choice(sample_size, int((~filled).sum()))]
+            centroids = normalize(sums)
+
+        assign = self._assign(self.vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        self.vectors = np.ascontiguousarray(self.vectors[order])
+        self.texts = self.texts.take(order)
+        sizes = np.bincount(assign, minlength=nlist)
+        self.list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.list_offsets[1:])
+        self.centroids = centroids
+        self.nlist = nlist
+        self.trained_count = n
+        self.trained_imbalance = self._imbalance(sizes)
+
+    def topk(self, queries, k=10, nprobe=None):
+        """返回的下标: 小于主段行数的指向主段, 其余指向增量段 (见 text)"""
+        np = _load_numpy()
+        self._flush()
+        queries = normalize(np.atleast_2d(queries))
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        nprobe = min(nprobe or self.nprobe or max(1, self.nlist // 16), self.nlist)
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        centroid_scores = queries @ self.centroids.T
+        # 空桶不占 nprobe 名额
+        centroid_scores[:, self._list_sizes() == 0] = -np.inf
+        main_rows = len(self.vectors)
+        for row, (query, cs) in enumerate(zip(queries, centroid_scores)):
+            probes = top_k(cs, nprobe)
+            ranges = []
+            # 桶在矩阵里连续, 相邻桶合并成一次切片读
+            for p in sorted(probes):
+                start, end = self.list_offsets[p], self.list_offsets[p + 1]
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], end)
+                elif end > start:
+                    ranges.append((start, end))
+            blocks = [self.vectors[s:e] for s, e in ranges]
+            ids = [np.arange(s, e) for s, e in ranges]
+            if len(self._delta_lists):
+                delta_rows = np.flatnonzero(np.isin(self._delta_lists, probes))
+                if len(delta_rows):
+                    blocks.append(self._delta_vectors[delta_rows])
+                    ids.append(delta_rows + main_rows)
+            if not blocks:
+                continue
+            block = np.concatenate(blocks)
+            ids = np.concatenate(ids)
+            scores = block @ query
+            best = top_k(scores, k)
+            all_scores[row, :len(best)] = scores[best]
+            all_ids[row, :len(best)] = ids[best]
+        return all_scores, all_ids
+
+    def text(self, i):
+        main_rows = len(self.vectors)
+        return self.texts[i] if i < main_rows else self._delta_texts[i - main_rows]
+
+    async def search(self, query, k=1):
+        scores, ids = self.topk(query, k)
+        return [(float(s), self.text(i)) for s, i in zip(scores[0], ids[0]) if i >= 0]
+
+    def save(self, path):
+        self._flush()
+        self._merge()
+        super().save(path)
+
+    def _meta(self):
+        return {**super()._meta(), "nlist": self.nlist, "nprobe": self.nprobe,
+                "trained_count": self.trained_count, "trained_imbalance": self.trained_imbalance}
+
+    def _save_extra(self, path):
+        if self.centroids is None:  # 空索引还没训练过
+            return
+        save_array(path, "centroids.npy", self.centroids)
+        save_array(path, "list_offsets.npy", self.list_offsets)
+
+    def _load_arrays(self, path, meta):
+        np = _load_numpy()
+        super()._load_arrays(path, meta)
+        self.nlist = meta["nlist"]
+        self.nprobe = meta.get("nprobe")
+        self._reset_delta()
+        if self.nlist is None:
+            return
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        self.trained_count = meta.get("trained_count", meta["count"])
+        self.trained_imbalance = meta.get("trained_imbalance") or self._imbalance(np.diff(self.list_offsets))
+
+
+async def open_store(kind, db_uri=None, path=None, dim=768, truncate=False):
+    """按类型创建检索后端; 进程内索引给了 path 且已存在时直接内存映射加载"""
+    if kind == "pgvector":
+        return await PgvectorStore.connect(db_uri, dim, truncate)
+    if path and os.path.exists(os.path.join(path, "meta.json")) and not truncate:
+        return load_store(path)
+    if kind == "numpy":
+        return NumpyStore(dim)
+    if kind == "ivf":
+        return IVFStore(dim)
+    raise ValueError(f"未知的向量检索后端: {kind} (可选 {', '.join(STORE_KINDS)})")
+
+
+# ==========================================
+# [基准] 召回率 / 延迟: IVF vs 精确检索
+# ==========================================
+def synthetic_embeddings(n, dim, clusters, noise=1.0, seed=0):
+    """带主题簇结构的假向量 (真实 embedding 也是按主题聚集的, 纯随机向量对 IVF 不公平)"""
+    np = _load_numpy()
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    step = 65536
+    for start in range(0, n, step):
+        m = min(step, n - start)
+        vectors[start:start + m] = centers[rng.integers(clusters, size=m)]
+        vectors[start:start + m] += rng.standard_normal((m, dim), dtype=np.float32) * noise
+    return vectors
+
+
+def bench(args):
+    np = _load_numpy()
+    import tempfile
+
+    print(f"🧪 [vector bench] {args.n:,} 条 x {args.dim} 维, {args.queries} 个查询, top-{args.k}")
+    vectors = synthetic_embeddings(args.n, args.dim, args.clusters, args.noise)
+    rng = np.random.default_rng(1)
+    # 查询: 数据集里的点加噪声 (模拟与某条记忆相近的提问)
+    queries = vectors[rng.integers(args.n, size=args.queries)]
+    queries = queries + rng.standard_normal(queries.shape, dtype=np.float32) * args.noise
+    texts = [f"片段 {i}" for i in range(args.n)]
+
+    def timed(fn):
+        start = time.perf_counter()
+        result = fn()
+        return result, (time.perf_counter() - start) * 1000
+
+    exact = NumpyStore()
+    exact.add(texts, vectors)
+    _, build_ms = timed(exact._flush)
+    ivf = IVFStore(nlist=args.nlist)
+    ivf.add(texts, vectors)
+    _, ivf_build_ms = timed(ivf._flush)
+    print(f"   🏗️ 建索引: 精确 {build_ms:.0f} ms, IVF {ivf_build_ms:.0f} ms (nlist={ivf.nlist})")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _, save_ms = timed(lambda: ivf.save(tmp))
+        loaded, load_ms = timed(lambda: load_store(tmp))
+        print(f"   💾 保存 {save_ms:.0f} ms, 加载 (mmap) {load_ms:.2f} ms")
+
+        # 精确结果作为标准答案; 逐条查询 (与 retrieve_node 的用法一致) 计时
+        truth, exact_total = timed(lambda: [exact.topk(q, args.k)[1][0] for q in queries])
+        print(f"\n   {'方式':<22} {'每次查询':>10} {'召回率@' + str(args.k):>10}")
+        print(f"   {'精确 (numpy)':<22} {exact_total / args.queries:8.3f} ms {1.0:>10.3f}")
+        _, batch_ms = timed(lambda: exact.topk(queries, args.k))
+        print(f"   {'精确 (批量查询)':<22} {batch_ms / args.queries:8.3f} ms {1.0:>10.3f}")
+        for nprobe in args.nprobe:
+            found, total = timed(lambda: [loaded.topk(q, args.k, nprobe=nprobe)[1][0] for q in queries])
+            # IVF 重排过行, 用文本对回原始下标
+            recall = np.mean([
+                len({loaded.texts[i] for i in got} & {texts[i] for i in want}) / len(want)
+                for got, want in zip(found, truth)
+            ])
+            label = f"IVF nprobe={nprobe} (mmap)"
+            print(f"   {label:<22} {total / args.queries:8.3f} ms {recall:>10.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="进程内向量检索: 召回率 / 延迟基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("bench", help="IVF 近似检索 vs numpy 精确检索")
+    b.add_argument("-n", type=int, default=100_000, help="向量条数")
+    b.add_argument("--dim", type=int, default=768)
+    b.add_argument("--clusters", type=int, default=1000, help="合成数据的主题簇数")
+    b.add_argument("--noise", type=float, default=1.5, help="簇内噪声 (越大簇越松散, 近似检索越难)")
+    b.add_argument("--queries", type=int, default=200)
+    b.add_argument("--k", type=int, default=10)
+    b.add_argument("--nlist", type=int, default=None, help="IVF 桶数 (默认 4*sqrt(n))")
+    b.add_argument("--nprobe", type=lambda s: [int(x) for x in s.split(",")], default=[4, 8, 16, 32],
+                   help="逗号分隔的 nprobe 取值")
+    args = parser.parse_args(argv)
+    bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import asyncio
 import aiohttp
+import json
+import os
 import time
 from typing import Optional, Dict, Any
 
@@ -7,17 +9,19 @@ async def call_ollama(
     prompt: str,
     model: str = "llama3.2:3b",
     temperature: float = 0.7,
-    timeout_seconds: int = 30
+    timeout_seconds: int = 30,
+    stream: bool = True
 ) -> Optional[Dict[str, Any]]:
     """
     异步调用本地 Ollama 服务的企业级标准函数。
+    stream=True 时边生成边打印 (逐行解析 NDJSON), 首 token 延迟只取决于 prompt 处理, 不再等整段回复。
     """
-    url = "http://localhost:11434/api/generate"
+    url = os.environ.get("OLLAMA_URL", "http://localhost:11434") + "/api/generate"
     payload = {
         "model": model,
         "prompt": prompt,
         "temperature": temperature,
-        "stream": False 
+        "stream": stream
     }
 
     # 设置超时时间拦截器
@@ -33,9 +37,42 @@ async def call_ollama(
                 # 状态码核查：非 200 直接抛出异常
                 response.raise_for_status() 
                 
-                # 挂起当前协程，等待网卡数据返回
-                result = await response.json()
-                print(f"✅ [SUCCESS] 请求成功，耗时: {time.time() - start_time:.2f}秒")
+                if not stream:
+                    # 挂起当前协程，等待网卡数据返回
+                    result = await response.json()
+                    print(f"✅ [SUCCESS] 请求成功，耗时: {time.time() - start_time:.2f}秒")
+                    return result
+
+                # 流式：每收到一块就按换行切出完整的 JSON 行，最后一行 (done=true) 带统计字段
+                result = {}
+                tokens = []
+                first_token_time = None
+                buffer = b""
+                async for data in response.content.iter_any():
+                    buffer += data
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if "error" in chunk:
+                            raise RuntimeError(chunk["error"])
+                        if chunk.get("response"):
+                            if first_token_time is None:
+                                first_token_time = time.time()
+                                print(f"⚡ [TTFT] 首 token 到达: {first_token_time - start_time:.2f}秒")
+                            tokens.append(chunk["response"])
+                            print(chunk["response"], end="", flush=True)
+                        result = chunk
+
+                end_time = time.time()
+                print()
+                result["response"] = "".join(tokens)
+                # eval_count 是 Ollama 统计的生成 token 数，没有时按收到的块数估算
+                count = result.get("eval_count") or len(tokens)
+                generating = end_time - (first_token_time or end_time)
+                speed = f"{(count - 1) / generating:.1f} tokens/秒" if count > 1 and generating > 0 else "-"
+                print(f"✅ [SUCCESS] 请求成功，耗时: {end_time - start_time:.2f}秒，共 {count} tokens，{speed}")
                 return result
 
     # 细粒度异常捕获拦截网
@@ -55,6 +92,9 @@ async def main():
     if response:
         print(f"🤖 模型回复: {response.get('response', '')}\n")
 
+    print("=== 测试 1b: 关闭流式，等完整回复一次性返回 (对比首 token 延迟) ===")
+    await call_ollama(prompt="作为资深工程师，用一句话描述 Python 异步的优势。", stream=False)
+
     print("=== 测试 2: 模拟一次会失败的请求 ===")
     await call_ollama(prompt="你好", model="fake-model:888b")
 
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import time
 from functools import wraps
 from fastapi import FastAPI, HTTPException
@@ -24,10 +26,13 @@ def log_execution(func):
         except Exception as e:
             end = time.time()
             print(f"[LOG] 失败: {e}，耗时 {end - start:.2f}s")
+            if isinstance(e, HTTPException):  # 内层已经转换过，不再套一层
+                raise
             raise HTTPException(status_code=500, detail=str(e))
     return wrapper
 
-# 异步调用Ollama
+# 异步调用Ollama（每次真正打到 Ollama 都会记一条 [LOG]，合并的请求不会重复出现）
+@log_execution
 async def call_ollama(request: ChatRequest) -> str:
     payload = {
         "model": "llama3",  # 改成你的模型，如 "qwen2:72b"
@@ -49,10 +54,41 @@ async def call_ollama(request: ChatRequest) -> str:
         except Exception as e:
             raise Exception(f"Ollama调用失败: {e}")
 
+# 进行中请求合并（single-flight）：多个用户同时发来完全相同的请求时，只调用一次 Ollama，大家共享同一个结果。
+# 与 langgraph/ollama_client.py 的 SingleFlight.do() 是同一套做法；这个 demo 是独立项目（自己的 requirements.txt，
+# 用 httpx、在本目录 uvicorn main:app 启动），不依赖 aiohttp，也不为了一个类去改 sys.path，所以这里保留一个最小实现。
+class SingleFlight:
+    def __init__(self):
+        self.calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn):
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._finished(key, f))
+        # shield：发起者的客户端断开时，不取消其他人还在等的调用
+        return await asyncio.shield(future)
+
+    def _finished(self, key: str, future: asyncio.Future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        if not future.cancelled():
+            future.exception()  # 所有等待者都断开时也把异常取走，避免 "never retrieved" 警告
+
+
+flights = SingleFlight()
+
+
+async def call_ollama_shared(request: ChatRequest) -> str:
+    """所有调用 Ollama 的接口都走这里（目前只有 /chat）"""
+    key = json.dumps(request.model_dump(), sort_keys=True, ensure_ascii=False)
+    return await flights.do(key, lambda: call_ollama(request))
+
 @app.post("/chat", response_model=ChatResponse)
 @log_execution
 async def chat(request: ChatRequest):
-    reply = await call_ollama(request)
+    reply = await call_ollama_shared(request)
     return ChatResponse(reply=reply)
 
 @app.get("/")
@@ -0,0 +1,415 @@
+"""
+aigc_metadata.py 的单元测试 (pytest)
+
+测试图片都在内存里现场构造, 不依赖样例文件:
+  python -m pytest -q test_aigc_metadata.py
+"""
+
+import struct
+import zlib
+
+import pytest
+
+import aigc_metadata as am
+
+
+# ========== 构造测试用 PNG ==========
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def make_png(*chunks):
+    """1x1 灰度 PNG, 文本 chunk 放在 IDAT 之前"""
+    ihdr = struct.pack('>IIBBBBB', 1, 1, 8, 0, 0, 0, 0)
+    return (am.PNG_SIGNATURE + png_chunk(b'IHDR', ihdr) + b''.join(chunks)
+            + png_chunk(b'IDAT', zlib.compress(b'\x00\x00')) + png_chunk(b'IEND', b''))
+
+
+def text_chunk(key, value):
+    return png_chunk(b'tEXt', key.encode('latin-1') + b'\x00' + value.encode('latin-1'))
+
+
+def ztxt_chunk(key, value):
+    return png_chunk(b'zTXt', key.encode('latin-1') + b'\x00\x00' + zlib.compress(value.encode('latin-1')))
+
+
+def itxt_chunk(key, value, compressed=False):
+    raw = value.encode('utf-8')
+    body = zlib.compress(raw) if compressed else raw
+    return png_chunk(b'iTXt', key.encode('latin-1') + b'\x00' + bytes([int(compressed), 0])
+                     + b'zh\x00' + '提示词'.encode('utf-8') + b'\x00' + body)
+
+
+# ========== PNG 文本 chunk (tEXt / zTXt / iTXt) ==========
+def test_png_text_chunks_decoded():
+    data = make_png(text_chunk("parameters", "a cat"),
+                    ztxt_chunk("Comment", "café"),
+                    itxt_chunk("prompt", "一只猫"),
+                    itxt_chunk("workflow", '{"节点": 1}', compressed=True))
+    chunks = am.read_png_chunks(data)
+    assert chunks == {"parameters": "a cat", "Comment": "café", "prompt": "一只猫", "workflow": '{"节点": 1}'}
+
+
+def test_decode_png_text_chunk_compressed_itxt():
+    chunk = itxt_chunk("prompt", "你好" * 100, compressed=True)
+    assert am.decode_png_text_chunk(b'iTXt', chunk[8:-4]) == ("prompt", "你好" * 100)
+
+
+def test_png_text_after_idat_only_with_full_scan():
+    data = make_png()
+    iend = png_chunk(b'IEND', b'')
+    data = data[:-len(iend)] + text_chunk("parameters", "late") + iend
+    assert "parameters" not in am.read_png_chunks(data, metadata_only=True)
+    assert am.read_png_chunks(data)["parameters"] == "late"
+
+
+def test_png_text_truncated_zlib_stream_dropped():
+    broken = png_chunk(b'zTXt', b'Comment\x00\x00' + zlib.compress(b'x' * 1000)[:-6])
+    assert "Comment" not in am.read_png_chunks(make_png(broken, text_chunk("parameters", "ok")))
+
+
+def test_png_text_lazy_and_limited():
+    value = "长文本" * 1000
+    chunks = am.read_png_chunks(make_png(itxt_chunk("workflow", value, compressed=True)),
+                                lazy_bytes=16, max_bytes=30)
+    lazy = chunks["workflow"]
+    assert isinstance(lazy, am.LazyText)
+    assert lazy.truncated
+    assert lazy.to_json_value() == {"truncated": True, "bytes": len(value.encode('utf-8')), "head": "长文本" * 3 + "长"}
+
+
+def test_png_text_default_limit_stops_decompression_bomb():
+    bomb = png_chunk(b'zTXt', b'Comment\x00\x00' + zlib.compress(b'a' * (am.TEXT_DEFAULT_LIMIT + 1)))
+    value = am.read_png_chunks(make_png(bomb))["Comment"]
+    assert isinstance(value, am.LazyText)
+    assert value.truncated
+    assert len(value.to_json_value()["head"]) == am.TEXT_DEFAULT_LIMIT
+
+
+# ========== 结果缓存 (ResultCache) ==========
+@pytest.fixture
+def clock(monkeypatch):
+    """可控的 time.time, last_access 的先后顺序不受系统时钟精度影响"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(am.time, "time", lambda: now[0])
+    return now
+
+
+def test_result_cache_round_trip(tmp_path):
+    cache = am.ResultCache(tmp_path / "cache.db")
+    key = am.ResultCache.make_key("abc", mode="fast", profile=True)
+    assert key == am.ResultCache.make_key("abc", mode="fast")
+    assert cache.get(key) is None
+    cache.put(key, {"source": "ComfyUI", "metadata": {"prompt": "猫"}})
+    assert cache.get(key) == {"source": "ComfyUI", "metadata": {"prompt": "猫"}}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    cache.close()
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path, clock):
+    value = {"source": "x" * 90}
+    size = len(am.json.dumps(value))
+    cache = am.ResultCache(tmp_path / "cache.db", max_bytes=size * 10)
+    for i in range(10):
+        clock[0] += 1
+        cache.put(f"k{i}", value)
+    assert cache.stats()["entries"] == 10
+
+    # k0 超过 TOUCH_INTERVAL 后被读过一次, 成为最近使用的条目
+    clock[0] += cache.TOUCH_INTERVAL + 1
+    assert cache.get("k0") == value
+    clock[0] += 1
+    cache.put("k10", value)
+
+    # 超出上限后淘汰到上限的 90%: 去掉最久未访问的 k1, k2
+    assert cache.total_bytes <= cache.max_bytes * 0.9
+    assert cache.get("k1") is None and cache.get("k2") is None
+    assert cache.get("k0") == value and cache.get("k10") == value
+    assert cache.stats()["entries"] == 9
+    cache.close()
+
+
+
+# ========== 生成参数解析 (A1111 / ComfyUI / NovelAI) ==========
+A1111_TEXT = (
+    "masterpiece, 1girl\n"
+    "sitting on a chair\n"
+    "Negative prompt: lowres, bad hands\n"
+    "blurry\n"
+    'Steps: 28, Sampler: DPM++ 2M, Schedule type: Karras, CFG scale: 6.5, Seed: 1234567890, '
+    'Size: 832x1216, Model hash: abcdef1234, Model: animagine-xl, Lora hashes: "detail: 0a1b, style: 2c3d", '
+    "Version: v1.10.1"
+)
+
+
+def test_parse_a1111_parameters():
+    info = am.parse_a1111_parameters(A1111_TEXT)
+    assert info["generator"] == "a1111"
+    assert info["prompt"] == "masterpiece, 1girl\nsitting on a chair"
+    assert info["negative_prompt"] == "lowres, bad hands\nblurry"
+    assert info["steps"] == 28 and info["seed"] == 1234567890 and info["cfg_scale"] == 6.5
+    assert info["sampler"] == "DPM++ 2M" and info["scheduler"] == "Karras"
+    assert info["size"] == "832x1216" and info["model"] == "animagine-xl"
+    # 带引号的值里的逗号不会切断字段
+    assert info["extra"] == {"Lora hashes": "detail: 0a1b, style: 2c3d", "Version": "v1.10.1"}
+
+
+def test_parse_a1111_parameters_without_settings_line():
+    info = am.parse_a1111_parameters("just a prompt, with commas")
+    assert info["prompt"] == "just a prompt, with commas"
+    assert info["negative_prompt"] == "" and info["extra"] == {}
+    assert "steps" not in info
+
+
+def test_parse_a1111_parameters_bad_number():
+    info = am.parse_a1111_parameters("cat\nSteps: many, Sampler: Euler, CFG scale: 7, Seed: -1")
+    assert info["steps"] is None and info["seed"] == -1 and info["sampler"] == "Euler"
+
+
+COMFYUI_PROMPT = {
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sdxl_base.safetensors"}},
+    "5": {"class_type": "LoraLoader", "inputs": {"lora_name": "pixel.safetensors", "model": ["4", 0]}},
+    "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "a red fox", "clip": ["5", 1]}},
+    "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["5", 1]}},
+    "3": {"class_type": "KSampler", "inputs": {
+        "seed": 42, "steps": 20, "cfg": 7.5, "sampler_name": "euler", "scheduler": "normal",
+        "model": ["5", 0], "positive": ["6", 0], "negative": ["7", 0]}},
+}
+
+
+def test_parse_comfyui_graph():
+    info = am.parse_comfyui_graph(am.json.dumps(COMFYUI_PROMPT))
+    assert info["generator"] == "comfyui"
+    assert info["node_count"] == 5
+    assert info["node_types"] == ["CLIPTextEncode", "CheckpointLoaderSimple", "KSampler", "LoraLoader"]
+    assert info["checkpoints"] == ["sdxl_base.safetensors"] and info["model"] == "sdxl_base.safetensors"
+    assert info["loras"] == ["pixel.safetensors"]
+    assert (info["seed"], info["steps"], info["cfg_scale"]) == (42, 20, 7.5)
+    assert (info["sampler"], info["scheduler"]) == ("euler", "normal")
+    assert (info["prompt"], info["negative_prompt"]) == ("a red fox", "blurry")
+
+
+def test_parse_comfyui_graph_linked_seed_not_taken_as_value():
+    prompt = {**COMFYUI_PROMPT, "3": {"class_type": "KSampler", "inputs": {
+        **COMFYUI_PROMPT["3"]["inputs"], "seed": ["9", 0]}}}
+    info = am.parse_comfyui_graph(am.json.dumps(prompt))
+    assert "seed" not in info and info["steps"] == 20
+
+
+def test_parse_comfyui_graph_falls_back_to_workflow():
+    workflow = {"nodes": [{"type": "KSampler"}, {"type": "SaveImage"}, {"type": "KSampler"}]}
+    info = am.parse_comfyui_graph("not json", am.json.dumps(workflow))
+    assert info["node_types"] == ["KSampler", "SaveImage"] and info["node_count"] == 3
+    assert "prompt" not in info
+
+
+def test_parse_novelai_comment():
+    comment = am.json.dumps({"prompt": "1girl", "uc": "lowres", "steps": 28, "sampler": "k_euler",
+                             "scale": 5, "seed": 7})
+    assert am.parse_novelai_comment(comment) == {
+        "generator": "novelai", "prompt": "1girl", "negative_prompt": "lowres", "steps": 28,
+        "sampler": "k_euler", "cfg_scale": 5.0, "seed": 7}
+    assert am.parse_novelai_comment("made with NAI") is None
+
+
+def test_structured_detection_from_png():
+    data = make_png(text_chunk("prompt", am.json.dumps(COMFYUI_PROMPT)), text_chunk("workflow", "{}"))
+    results = am.detect_aigc_source(data, structured=True)
+    assert results["source"] == "ComfyUI"
+    assert results["generation"]["prompt"] == "a red fox"
+
+
+# ========== 增量扫描清单 (ScanManifest) ==========
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = am.ScanManifest(tmp_path / "manifest.db")
+    yield manifest
+    manifest.close()
+
+
+def scan_once(manifest, path, options, result=None):
+    """模拟一次扫描: 清单命中时返回复用的结果, 否则记录一个新结果并返回 None"""
+    cached = manifest.check(str(path), options)
+    if cached is None:
+        manifest.record(result or {"path": str(path), "source": "ComfyUI"}, options)
+    return cached
+
+
+def test_manifest_reuses_unchanged_file(tmp_path, manifest):
+    image = tmp_path / "a.png"
+    image.write_bytes(make_png(text_chunk("prompt", "{}")))
+    options = am.ScanManifest.options_key({"mode": "fast"})
+    assert scan_once(manifest, image, options) is None
+    cached = scan_once(manifest, image, options)
+    assert cached == {"path": str(image), "source": "ComfyUI", "unchanged": True}
+    assert (manifest.updated, manifest.unchanged) == (1, 1)
+
+
+def test_manifest_invalidated_by_content_change(tmp_path, manifest):
+    image = tmp_path / "a.png"
+    image.write_bytes(make_png())
+    options = am.ScanManifest.options_key({})
+    scan_once(manifest, image, options)
+    image.write_bytes(make_png(text_chunk("parameters", "cat")))
+    assert scan_once(manifest, image, options) is None
+
+
+def test_manifest_invalidated_by_options(tmp_path, manifest):
+    image = tmp_path / "a.png"
+    image.write_bytes(make_png())
+    scan_once(manifest, image, am.ScanManifest.options_key({"mode": "fast"}))
+    assert scan_once(manifest, image, am.ScanManifest.options_key({"mode": "full"})) is None
+    # profile 只影响耗时统计, 不让清单失效
+    options = am.ScanManifest.options_key({"mode": "full", "profile": True})
+    assert scan_once(manifest, image, options) is not None
+
+
+def test_manifest_does_not_record_errors(tmp_path, manifest):
+    image = tmp_path / "a.png"
+    image.write_bytes(b"not an image")
+    options = am.ScanManifest.options_key({})
+    scan_once(manifest, image, options, {"path": str(image), "source": "未知", "error": "boom"})
+    assert scan_once(manifest, image, options) is None
+
+
+def test_manifest_prune_removes_deleted_files(tmp_path):
+    manifest = am.ScanManifest(tmp_path / "manifest.db")
+    root = tmp_path / "photos"
+    root.mkdir()
+    keep, gone = root / "keep.png", root / "gone.png"
+    options = am.ScanManifest.options_key({})
+    for image in (keep, gone):
+        image.write_bytes(make_png())
+        scan_once(manifest, image, options)
+    manifest.close()
+
+    rescan = am.ScanManifest(tmp_path / "manifest.db")
+    gone.unlink()
+    assert scan_once(rescan, keep, options) is not None
+    assert rescan.prune([str(root)]) == [str(gone)]
+    rescan.close()
+
+
+# ========== 单文件时间 / 字节上限 ==========
+def test_time_limit_raises_once_and_restores_handler():
+    import signal
+    import time
+
+    previous = signal.getsignal(signal.SIGALRM)
+    with pytest.raises(am.DetectTimeout):
+        with am.time_limit(0.05):
+            time.sleep(1)
+    assert signal.getsignal(signal.SIGALRM) is previous
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+
+
+def test_time_limit_swallowed_timeout_raised_on_exit():
+    import time
+
+    with pytest.raises(am.DetectTimeout):
+        with am.time_limit(0.05):
+            try:
+                time.sleep(1)
+            except Exception:
+                pass  # 模拟解析代码里的 except: pass
+
+
+def test_alarm_deferred_until_cache_write_finishes(tmp_path):
+    import time
+
+    cache = am.ResultCache(tmp_path / "cache.db")
+    with pytest.raises(am.DetectTimeout):
+        with am.time_limit(0.05):
+            with am.alarm_deferred():
+                time.sleep(0.2)
+                cache.put("key", {"source": "x"})
+    assert not cache.conn.in_transaction
+    assert cache.get("key") == {"source": "x"}
+    cache.close()
+
+
+def test_detect_worker_reports_timeout(tmp_path, monkeypatch):
+    import time
+
+    def hang(*args, **kwargs):
+        time.sleep(5)
+
+    image = tmp_path / "a.png"
+    image.write_bytes(make_png())
+    monkeypatch.setattr(am, "detect_aigc_source", hang)
+    result = am._detect_worker(str(image), timeout=0.1)
+    assert result["path"] == str(image) and result["source"] == "未知"
+    assert "超过" in result["error"]
+
+
+def test_detect_worker_reports_byte_budget(tmp_path):
+    iend = png_chunk(b'IEND', b'')
+    data = make_png(text_chunk("parameters", "x" * 100_000))[:-len(iend)]
+    image = tmp_path / "big.png"
+    image.write_bytes(data + png_chunk(b'prIv', b'\x00' * 300_000) + iend)
+    result = am._detect_worker(str(image), {"max_file_bytes": 10_000})
+    assert result["source"] == "未知" and "字节预算" in result["error"]
+    # 文件超过预算但元数据前缀放得下时照常检测, IDAT 之后的数据不读
+    result = am._detect_worker(str(image), {"max_file_bytes": 150_000})
+    assert "error" not in result and result["source"] == "Stable Diffusion (A1111/Forge)"
+
+
+def test_detect_aigc_source_byte_budget_for_bytes_input():
+    results = am.detect_aigc_source(make_png(text_chunk("parameters", "x" * 5000)), max_file_bytes=1000)
+    assert results["source"] == "未知" and "字节预算" in results["error"]
+
+
+# ========== 感知哈希 (PhashIndex / 清单的 phash 后缀) ==========
+def flip(h, *bits):
+    for bit in bits:
+        h ^= 1 << bit
+    return h
+
+
+BASE_HASH = 0x0123_4567_89AB_CDEF
+
+
+def test_phash_index_exact_and_radius():
+    index = am.PhashIndex(max_distance=6)
+    index.add(BASE_HASH, "original")
+    assert index.query(BASE_HASH) == (0, "original")
+    # 6 个不同的位分散在 4 段里 (每段 16 位), 至少有一段只差 1 位
+    assert index.query(flip(BASE_HASH, 0, 17, 18, 33, 49, 63)) == (6, "original")
+    assert index.query(flip(BASE_HASH, 0, 1, 17, 18, 33, 49, 63)) is None
+
+
+def test_phash_index_all_flips_in_one_block():
+    index = am.PhashIndex(max_distance=6)
+    index.add(BASE_HASH, "original")
+    assert index.query(flip(BASE_HASH, *range(6))) == (6, "original")
+
+
+def test_phash_index_returns_nearest():
+    index = am.PhashIndex(max_distance=8)
+    index.add(flip(BASE_HASH, 1, 2, 3, 4), "far")
+    index.add(flip(BASE_HASH, 40), "near")
+    index.add(flip(BASE_HASH, *range(20, 40)), "out of range")
+    assert index.query(BASE_HASH) == (1, "near")
+    assert len(index) == 3
+
+
+def test_phash_index_zero_radius():
+    index = am.PhashIndex(max_distance=0)
+    index.add(BASE_HASH, "original")
+    assert index.query(BASE_HASH) == (0, "original")
+    assert index.query(flip(BASE_HASH, 5)) is None
+
+
+def test_manifest_phash_suffix(tmp_path, manifest):
+    plain = am.ScanManifest.options_key({"mode": "fast"})
+    with_phash = am.ScanManifest.options_key({"mode": "fast"}, phash=True)
+    assert with_phash == plain + am.ScanManifest.PHASH_SUFFIX
+
+    hashed, unhashed = tmp_path / "hashed.png", tmp_path / "unhashed.png"
+    for image in (hashed, unhashed):
+        image.write_bytes(make_png())
+    scan_once(manifest, hashed, with_phash, {"path": str(hashed), "source": "ComfyUI", "phash": "00ff"})
+    scan_once(manifest, unhashed, plain)
+    # 带哈希的记录可以给不需要哈希的扫描复用, 反过来不行
+    assert scan_once(manifest, hashed, plain)["phash"] == "00ff"
+    assert scan_once(manifest, unhashed, with_phash) is None